@@ -0,0 +1,182 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+""" Offline benchmarks for parser, classification and dispatch """
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from threading import Thread
+import time
+
+from myprefetch import readahead, synthetic
+from myprefetch.binlog import Binlog, MappedBinlog
+from myprefetch.mysql import Config
+from myprefetch.relaylog import RelayLog
+
+
+class BenchPrefetch(readahead.Prefetch):
+    """Prefetch talking to synthetic.FakeServer instead of MySQL"""
+    def __init__(self, server, **kwargs):
+        readahead.Prefetch.__init__(self, Config("localhost", 0, "", ""),
+                                    **kwargs)
+        self.server = server
+        # Schema lookups have no server to go to
+        self.row_rewriter = lambda event: None
+
+    def _connect(self):
+        return synthetic.FakeSlave(self.server, self.worker_init_connect)
+
+
+def bench_parser(directory, names, binlog_class):
+    """Returns (events, seconds) for reading through all relay logs"""
+    relaylog = RelayLog(directory, binlog_class)
+    relaylog.sync(names[0], 4)
+    started = time.time()
+    count = 0
+    for _ in relaylog:
+        count += 1
+    return count, time.time() - started
+
+
+def bench_detect(directory, names, rounds=3):
+    """Returns (events, seconds) spent in Prefetch.detect"""
+    relaylog = RelayLog(directory, Binlog)
+    relaylog.sync(names[0], 4)
+    events = list(relaylog)
+    prefetch = readahead.Prefetch(Config("localhost", 0, "", ""))
+    started = time.time()
+    for _ in range(rounds):
+        for event in events:
+            prefetch.detect(event)
+    return len(events) * rounds, time.time() - started
+
+
+def bench_dispatch(directory, names, duration, apply_rate, latency, **kwargs):
+    """Returns (queries run, seconds, stale drops) of prefetching against
+       simulated replica"""
+    server = synthetic.FakeServer(directory, names, apply_rate, latency)
+    prefetch = BenchPrefetch(server, logpath=directory, threshold=0,
+                             metrics_interval=0, **kwargs)
+    thread = Thread(target=prefetch.prefetch)
+    thread.daemon = True
+    thread.start()
+    time.sleep(duration)
+    return server.queries.value, duration, prefetch.queue.dropped
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="""
+Runs parser, classification and dispatch benchmarks against synthetic relay
+logs and a simulated replica.""".strip(),
+                                     fromfile_prefix_chars='@',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--events', default=200000, type=int,
+                        help='Number of events to generate')
+    parser.add_argument('--mix', default='insert=40,update=30,delete=10,rows=20',
+                        help='Statement kinds and their weights '
+                             '(insert, update, delete, select, ddl, rows)')
+    parser.add_argument('--transaction_size', default=1, type=int,
+                        help='Statements in each generated transaction')
+    parser.add_argument('--query_size', default=100, type=int,
+                        help='Mean statement size in bytes')
+    parser.add_argument('--density', default=1000, type=int,
+                        help='Events per second of master time')
+    parser.add_argument('--file_size', default=64, type=int,
+                        help='Relay log file size in MB')
+    parser.add_argument('--server_version', default='5.5.62-log',
+                        help='Server version generated logs look like, 5.6 and '
+                             'later ones have GTID and ROWS_QUERY events')
+    parser.add_argument('--checksum', action='store_true',
+                        help='Write CRC32 checksums, with 5.6 or later --server_version')
+    parser.add_argument('--duration', default=10, type=int,
+                        help='Seconds to run dispatch benchmark for')
+    parser.add_argument('--apply_rate', default=1000, type=int,
+                        help='Events a second simulated SQL thread applies')
+    parser.add_argument('--latency', default=0.001, type=float,
+                        help='Seconds each simulated prefetch query takes')
+    parser.add_argument('--runners', default=4, type=int,
+                        help='Number of statement runner threads to use')
+    parser.add_argument('--engine', default='threads',
+                        choices=('threads', 'processes'),
+                        help='Runner engine for dispatch benchmark')
+    parser.add_argument('--workers', default=2, type=int,
+                        help='Worker processes with processes engine')
+    parser.add_argument('--batch_size', default=1, type=int,
+                        help='Events each runner sends in single round trip')
+    parser.add_argument('--affinity', default=None, choices=('db', 'table'),
+                        help='Route events to runners by db or table')
+    parser.add_argument('--window_start', default=1, type=int,
+                        help='Prefetch window start (seconds)')
+    parser.add_argument('--window_stop', default=30, type=int,
+                        help='Prefetch window stop (seconds)')
+    parser.add_argument('--logpath', default=None,
+                        help='Keep generated relay logs in this directory')
+    args = parser.parse_args()
+
+    mix = dict((kind, int(weight)) for kind, weight in
+               (item.split('=') for item in args.mix.split(',')))
+    directory = args.logpath or tempfile.mkdtemp(prefix="prefetch-bench-")
+    try:
+        started = time.time()
+        names = synthetic.generate(directory, args.events, mix, args.query_size,
+                                   args.density, file_size=args.file_size << 20,
+                                   transaction_size=args.transaction_size,
+                                   server_version=args.server_version,
+                                   checksum=args.checksum)
+        size = sum(os.path.getsize(os.path.join(directory, name))
+                   for name in names)
+        print "Generated %d events, %d files, %.1f MB in %.1fs" % (
+            args.events, len(names), size / 1048576.0, time.time() - started)
+
+        parsers = [(Binlog, False), (MappedBinlog, False)]
+        if args.checksum:
+            parsers += [(Binlog, True), (MappedBinlog, True)]
+        for binlog_class, verify in parsers:
+            count, elapsed = bench_parser(
+                directory, names,
+                lambda path: binlog_class(path, verify_checksums=verify))
+            print "Parser %-12s %8d events/s  %6.1f MB/s" % (
+                binlog_class.__name__ + (verify and "+crc:" or ":"),
+                count / elapsed, size / elapsed / 1048576)
+
+        count, elapsed = bench_detect(directory, names)
+        print "Detect:              %8d events/s  %6.2f us/event" % (
+            count / elapsed, elapsed / count * 1000000)
+
+        queries, elapsed, dropped = bench_dispatch(
+            directory, names, args.duration, args.apply_rate, args.latency,
+            runners=args.runners, engine=args.engine, workers=args.workers,
+            affinity=args.affinity, batch_size=args.batch_size,
+            window_start=args.window_start,
+            window_stop=args.window_stop)
+        print "Dispatch:            %8d queries/s  %d stale drops" % (
+            queries / elapsed, dropped)
+    finally:
+        if not args.logpath:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
+    # Prefetcher threads never return, do not wait for them at exit
+    sys.stdout.flush()
+    os._exit(0)
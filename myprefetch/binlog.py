@@ -15,7 +15,13 @@
 #   limitations under the License.
 #
 
+import mmap
+import os
+import re
 import struct
+import zlib
+
+from myprefetch import rows
 
 UNKNOWN_EVENT = 0
 START_EVENT_V3 = 1
@@ -45,18 +51,77 @@ UPDATE_ROWS_EVENT = 24
 DELETE_ROWS_EVENT = 25
 INCIDENT_EVENT = 26
 HEARTBEAT_LOG_EVENT = 27
+IGNORABLE_LOG_EVENT = 28
+ROWS_QUERY_LOG_EVENT = 29
+WRITE_ROWS_EVENT_V2 = 30
+UPDATE_ROWS_EVENT_V2 = 31
+DELETE_ROWS_EVENT_V2 = 32
+GTID_LOG_EVENT = 33
+ANONYMOUS_GTID_LOG_EVENT = 34
+PREVIOUS_GTIDS_LOG_EVENT = 35
+
+# Checksum algorithms FDE can name
+BINLOG_CHECKSUM_ALG_OFF = 0
+BINLOG_CHECKSUM_ALG_CRC32 = 1
+CHECKSUM_LENGTH = 4
+# Servers from these versions on tell checksum algorithm in FDE
+CHECKSUM_VERSION = (5, 6, 1)
+MARIADB_CHECKSUM_VERSION = (5, 3, 0)
+
+ROWS_EVENTS = {
+    WRITE_ROWS_EVENT: 'insert',
+    UPDATE_ROWS_EVENT: 'update',
+    DELETE_ROWS_EVENT: 'delete',
+    WRITE_ROWS_EVENT_V2: 'insert',
+    UPDATE_ROWS_EVENT_V2: 'update',
+    DELETE_ROWS_EVENT_V2: 'delete',
+}
+
+# Events that only set up context for the event following them
+CONTEXT_EVENTS = frozenset([
+    INTVAR_EVENT, RAND_EVENT, USER_VAR_EVENT, TABLE_MAP_EVENT,
+    GTID_LOG_EVENT, ANONYMOUS_GTID_LOG_EVENT, ROWS_QUERY_LOG_EVENT,
+])
+
+# Events relay log starts with before those of master, FDE of master
+# among them
+HEAD_EVENTS = frozenset([
+    FORMAT_DESCRIPTION_EVENT, PREVIOUS_GTIDS_LOG_EVENT, ROTATE_EVENT,
+])
+
+# Query events opening and closing transactions, XID_EVENT closes them too
+BEGIN = "BEGIN"
+TRANSACTION_END = frozenset(["COMMIT", "ROLLBACK"])
+END_LENGTHS = frozenset(len(text) for text in TRANSACTION_END)
+# Query events longer than this are not looked into by Binlog.scan()
+SCAN_QUERY_LENGTH = 256
 
 class MalformedBinlogException (ValueError):
     pass
 
+def has_checksum_alg(server_version):
+    """Does FDE of server_version end with checksum algorithm and checksum"""
+    match = re.match(r"(\d+)\.(\d+)\.(\d+)", server_version)
+    if not match:
+        return False
+    version = tuple(int(part) for part in match.groups())
+    if "mariadb" in server_version.lower():
+        return version >= MARIADB_CHECKSUM_VERSION
+    return version >= CHECKSUM_VERSION
+
 class Event(object):
     """Fixed wrapper for event data"""
+    __slots__ = ('pos', 'type', 'timestamp', 'elapsed', 'insert_id',
+                 'last_insert_id', '_db', '_query', 'buf', 'db_offset',
+                 'db_len', 'end')
+
     def __init__(self, pos, type_, db, query, timestamp,
                  elapsed, insert_id, last_insert_id):
         self.pos = pos
         self.type = type_
-        self.db = db
-        self.query = query
+        self._db = db
+        self._query = query
+        self.buf = None
         self.timestamp = timestamp
         if elapsed < 4294967200:
             self.elapsed = elapsed
@@ -66,15 +131,151 @@ class Event(object):
         self.insert_id = insert_id
         self.last_insert_id = last_insert_id
 
+    @property
+    def db(self):
+        if self._db is None and self.buf is not None:
+            self._db = self.buf[self.db_offset:self.db_offset + self.db_len]
+        return self._db
+
+    @db.setter
+    def db(self, value):
+        self._db = value
+
+    @property
+    def query(self):
+        if self._query is None and self.buf is not None:
+            self._query = self.buf[self.db_offset + self.db_len + 1:self.end]
+        return self._query
+
+    @query.setter
+    def query(self, value):
+        self._query = value
+
+    @property
+    def query_length(self):
+        if self._query is None and self.buf is not None:
+            return self.end - self.db_offset - self.db_len - 1
+        return len(self._query)
+
+    def head(self, length):
+        """First length bytes of query, without copying out the rest"""
+        if self._query is None and self.buf is not None:
+            start = self.db_offset + self.db_len + 1
+            return self.buf[start:min(start + length, self.end)]
+        return self._query[:length]
+
+    def query_is(self, text):
+        return self.query_length == len(text) and self.head(len(text)) == text
+
+    def materialize(self):
+        """Copy out everything still left in buffer"""
+        self.db
+        self.query
+        self.buf = None
+
+    def __getstate__(self):
+        # Buffers, memory maps among them, stay behind
+        self.materialize()
+        return dict((name, getattr(self, name))
+                    for cls in type(self).__mro__
+                    for name in getattr(cls, '__slots__', ())
+                    if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __str__(self):
         db = self.db or 'None'
         return "# Binlog Event at %d DB: %s TS: %d Elapsed: %d Query:\n%s" % (
             self.pos, db, self.timestamp, self.elapsed, self.query
         )
 
+class MappedEvent(Event):
+    """Query event pointing into a memory mapped binlog or data read from
+       one, db and query strings are copied out on first access only"""
+    __slots__ = ()
+
+    def __init__(self, pos, buf, db_offset, db_len, end, timestamp,
+                 elapsed, insert_id, last_insert_id):
+        Event.__init__(self, pos, 'query', None, None, timestamp,
+                       elapsed, insert_id, last_insert_id)
+        self.buf = buf
+        self.db_offset = db_offset
+        self.db_len = db_len
+        self.end = end
+
+class RowsEvent(Event):
+    """Row-based replication event with row images decoded on first access.
+       Rows hold before images for deletes, after images for inserts,
+       and both images (before, after, before, ...) for updates."""
+    __slots__ = ('action', 'table', 'table_map', '_rows', 'rows_offset')
+
+    def __init__(self, pos, action, table_map, buf, offset, end, timestamp,
+                 insert_id, last_insert_id):
+        Event.__init__(self, pos, 'rows', table_map.schema, '', timestamp,
+                       0, insert_id, last_insert_id)
+        self.action = action
+        self.table = table_map.table
+        self.table_map = table_map
+        self._rows = None
+        self.buf = buf
+        self.rows_offset = offset
+        self.end = end
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            try:
+                self._rows = rows.decode_rows(self.table_map, self.buf,
+                                              self.rows_offset, self.end,
+                                              self.action == 'update')
+            except (struct.error, KeyError, IndexError):
+                # Table map does not match the event, or type is unsupported
+                self._rows = []
+            self.buf = None
+        return self._rows
+
+    def materialize(self):
+        self.rows
+
+    def __str__(self):
+        return "# Binlog Event at %d DB: %s TS: %d Rows: %s %s.%s (%d)" % (
+            self.pos, self.db, self.timestamp, self.action, self.db,
+            self.table, len(self.rows)
+        )
+
+class Transaction(Event):
+    """Events between BEGIN and XID_EVENT or COMMIT, handed out together.
+       Position and timestamp are those of BEGIN."""
+    __slots__ = ('events', )
+
+    def __init__(self, begin):
+        Event.__init__(self, begin.pos, 'transaction', begin.db, '',
+                       begin.timestamp, 0, None, None)
+        self.events = []
+
+    def __str__(self):
+        return "# Binlog Event at %d DB: %s TS: %d Transaction (%d)\n%s" % (
+            self.pos, self.db, self.timestamp, len(self.events),
+            "\n".join(str(event) for event in self.events)
+        )
+
+def begins_transaction(event):
+    return event.type == 'query' and event.query_is(BEGIN)
+
+def ends_transaction(event):
+    """Is event XID_EVENT, COMMIT or ROLLBACK"""
+    if event.type == 'xid':
+        return True
+    if event.type != 'query':
+        return False
+    length = event.query_length
+    return length in END_LENGTHS and event.head(length) in TRANSACTION_END
+
 class Binlog(object):
     """Implements methods to access binary log"""
-    def __init__(self, filename):
+    def __init__(self, filename, verify_checksums=False):
         self.file = open(filename)
 
         self.filename = filename
@@ -84,25 +285,90 @@ class Binlog(object):
 
         self.until = None
 
-        self.max_event_size = 1024 * 1024
+        # TABLE_MAP_EVENT definitions by table id, kept across seeks
+        self.table_maps = {}
+        # Log file named by last ROTATE_EVENT, there is nothing after it
+        self.rotate_to = None
+        # Where context events of last returned event start, seeking there
+        # replays everything needed to decode it
+        self.group_position = None
+        self.event_start = None
+        # Number of events decoded so far
+        self.events_read = 0
+        # Events have CRC32 trailer, checked if verify_checksums is set.
+        # Events failing the check are skipped and counted.
+        self.checksum = False
+        self.verify_checksums = verify_checksums
+        self.checksum_errors = 0
 
-        fde = struct.unpack("<IIBIIIHH50sIB", self.file.read(4 + 76))
-        (magic, timestamp, type_code, server_id, event_length,
-         next_position, flags, binlog_version, server_version,
-         create_timestamp, self.header_length) = fde
+        self.max_event_size = 1024 * 1024
 
-        if magic != 1852400382:    # 0xfe bin
+        if self.file.read(4) != "\xfebin":
             raise MalformedBinlogException("Bad magic byte")
-
+        header = self.file.read(19)
+        if len(header) < 19:
+            raise MalformedBinlogException("No FDE found")
+        (timestamp, type_code, server_id, event_length,
+         next_position, flags) = struct.unpack("<IBIIIH", header)
         if type_code != FORMAT_DESCRIPTION_EVENT:
             raise MalformedBinlogException("No FDE found")
-        if binlog_version != 4:
-            raise NotImplementedError("Only binlog format 4 (5.x) is supported")
-
-        tail = self.file.read(event_length - 76)
-        self.header_lengths = (0, ) + struct.unpack("%dB" % len(tail), tail)
+        body = self.file.read(event_length - 19)
+        self.format_description(body, 0, len(body))
         self.position = next_position
         self.start_position = self.position
+        # Where events past those read_head() looks at start
+        self.head_end = self.position
+        self.read_head()
+
+    def format_description(self, data, start, end):
+        """Takes header lengths and checksum algorithm from FDE body found
+           at data[start:end], checksum included"""
+        (binlog_version, server_version, create_timestamp,
+         self.header_length) = struct.unpack_from("<H50sIB", data, start)
+        if binlog_version != 4:
+            raise NotImplementedError("Only binlog format 4 (5.x) is supported")
+        self.server_version = server_version.split("\0", 1)[0]
+
+        lengths_end = end
+        self.checksum = False
+        if has_checksum_alg(self.server_version):
+            lengths_end -= 1 + CHECKSUM_LENGTH
+            self.checksum = ord(data[lengths_end]) == BINLOG_CHECKSUM_ALG_CRC32
+        start += 57
+        self.header_lengths = (0, ) + struct.unpack_from(
+            "%dB" % (lengths_end - start), data, start)
+
+    def read_head(self):
+        """Relay logs go on with FDE of master after their own one, and
+           events following it are in format of master. Read it now, so
+           that seeking right to those events works."""
+        position = self.position
+        while True:
+            self.file.seek(position)
+            header = self.file.read(19)
+            if len(header) < 19:
+                break
+            (timestamp, event_type, server_id, event_length,
+             next_position, flags) = struct.unpack("<IBIIIH", header)
+            if event_type not in HEAD_EVENTS:
+                break
+            if event_type == FORMAT_DESCRIPTION_EVENT:
+                body = self.file.read(event_length - 19)
+                if len(body) < event_length - 19:
+                    break
+                self.format_description(body, 0, len(body))
+            position += event_length
+        self.head_end = position
+        self.file.seek(self.position)
+
+    def checksum_ok(self, data, start, end, crc=0):
+        """Does CRC32 of data[start:end], continuing from crc, match
+           trailer following it"""
+        crc = zlib.crc32(buffer(data, start, end - start), crc) & 0xffffffff
+        if crc == struct.unpack_from("<I", data, end)[0]:
+            return True
+        self.checksum_errors += 1
+        return False
 
     def read_event(self):
         """Returns a dictionary with query event data
@@ -126,10 +392,10 @@ class Binlog(object):
         total_tail = event_length - self.header_length
 
         cur_position = self.position
-        self.position += event_length
 
         # We allow very efficient skipping of large events
         if event_length > self.max_event_size:
+            self.position += event_length
             self.file.seek(total_tail, 1)
             return False
 
@@ -139,21 +405,72 @@ class Binlog(object):
             self.file.seek(cur_position)
             return None
 
+        self.position += event_length
+        end = total_tail
+        # FDE tells for itself whether it has checksum
+        if self.checksum and event_type != FORMAT_DESCRIPTION_EVENT:
+            end -= CHECKSUM_LENGTH
+            if self.verify_checksums and not self.checksum_ok(
+                    event_data, 0, end, zlib.crc32(header_data)):
+                return False
+        return self.decode_event(cur_position, timestamp, event_type,
+                                 event_data, 0, end)
+
+    def decode_event(self, cur_position, timestamp, event_type,
+                     data, start, end):
+        """Decodes event body found at data[start:end]"""
+        self.events_read += 1
+        if self.group_position is None:
+            self.group_position = cur_position
+
+        event = self.decode_body(cur_position, timestamp, event_type,
+                                 data, start, end)
+        if event:
+            self.event_start = self.group_position
+            self.group_position = None
+        elif event_type not in CONTEXT_EVENTS:
+            self.group_position = None
+        return event
+
+    def decode_body(self, cur_position, timestamp, event_type,
+                    data, start, end):
         if event_type == QUERY_EVENT:
-            hlen = 13
             (thread_id, elapsed, db_len, error_code, status_length) = \
-                struct.unpack("<IIBHH", event_data[0:hlen])
-            db_offset = hlen + status_length
-            db = event_data[db_offset:db_offset + db_len]
-            query = event_data[db_offset + db_len + 1:]
-
-            return Event(cur_position, 'query', db, query, timestamp,
-                         elapsed, self.insert_id, self.last_insert_id)
-
-        elif event_type in (STOP_EVENT, ROTATE_EVENT):
+                struct.unpack_from("<IIBHH", data, start)
+            db_offset = start + 13 + status_length
+
+            return self.query_event(cur_position, timestamp, elapsed,
+                                    data, db_offset, db_len, end)
+
+        elif event_type in ROWS_EVENTS:
+            return self.read_rows_event(cur_position, timestamp,
+                                        event_type, data, start, end)
+        elif event_type == TABLE_MAP_EVENT:
+            table_id = self.read_table_id(event_type, data, start)
+            try:
+                self.table_maps[table_id] = rows.parse_table_map(
+                    table_id, data, start + self.header_lengths[event_type],
+                    end)
+            except (struct.error, IndexError):
+                raise MalformedBinlogException(
+                    "Bad table map at %d" % cur_position)
+            return False
+        elif event_type == ROTATE_EVENT:
+            self.rotate_to = data[start + self.header_lengths[event_type]:end]
+            return False
+        elif event_type == FORMAT_DESCRIPTION_EVENT:
+            # Master's FDE in relay log, its events may differ from ours
+            self.format_description(data, start, end)
+            return False
+        elif event_type in (GTID_LOG_EVENT, ANONYMOUS_GTID_LOG_EVENT,
+                            STOP_EVENT):
+            # Nothing prefetching needs
             return False
+        elif event_type == XID_EVENT:
+            return Event(cur_position, 'xid', None, '', timestamp, 0,
+                         None, None)
         elif event_type == INTVAR_EVENT:
-            (intvar_type, intvar_value) = struct.unpack("<BQ", event_data)
+            (intvar_type, intvar_value) = struct.unpack_from("<BQ", data, start)
             if intvar_type == 1:
                 self.last_insert_id = intvar_value
             elif intvar_type == 2:
@@ -161,12 +478,114 @@ class Binlog(object):
             return False
         return False
 
+    def query_event(self, cur_position, timestamp, elapsed,
+                    data, db_offset, db_len, end):
+        return MappedEvent(cur_position, data, db_offset, db_len, end,
+                           timestamp, elapsed,
+                           self.insert_id, self.last_insert_id)
+
+    def read_table_id(self, event_type, data, start):
+        """Table id is 6 bytes wide unless post-header is the old 6 byte one"""
+        if self.header_lengths[event_type] == 6:
+            return struct.unpack_from("<I", data, start)[0]
+        (low, high) = struct.unpack_from("<IH", data, start)
+        return low | high << 32
+
+    def read_rows_event(self, cur_position, timestamp, event_type,
+                        data, start, end):
+        table_map = self.table_maps.get(
+            self.read_table_id(event_type, data, start))
+        # We have not seen the map (yet), nothing to decode against
+        if table_map is None:
+            return False
+
+        offset = start + self.header_lengths[event_type]
+        if event_type >= WRITE_ROWS_EVENT_V2:
+            # v2 events carry extra data, its length includes length field
+            extra_length = struct.unpack_from("<H", data, start + 8)[0]
+            offset += extra_length - 2
+
+        return RowsEvent(cur_position, ROWS_EVENTS[event_type], table_map,
+                         data, offset, end, timestamp,
+                         self.insert_id, self.last_insert_id)
+
+    def scan(self, position, timestamp):
+        """Finds where event groups outside transactions start from
+           position on, reading event headers and short statements only.
+           Stops at first event at least timestamp old, at standalone
+           statements (DDL, callers should see those), at format
+           description events and at end of what is written. Returns
+           ([(timestamp, position)] of groups older than timestamp,
+           position scan got to) - latter is a group start with only
+           older events before it."""
+        # Whether we are outside transaction, None if not known yet
+        outside = None
+        if position <= self.head_end:
+            # Nothing before head events, and read_head() has seen those
+            position = self.head_end
+            outside = True
+        groups = []
+        end = position
+        # Where context events of next event start
+        group = None
+        while True:
+            self.file.seek(position)
+            header = self.file.read(19)
+            if len(header) < 19:
+                break
+            (event_timestamp, event_type, server_id, event_length,
+             next_position, flags) = struct.unpack("<IBIIIH", header)
+            if event_length < 19 or event_type == FORMAT_DESCRIPTION_EVENT:
+                break
+            if group is None:
+                group = position
+            position += event_length
+            if event_type in CONTEXT_EVENTS:
+                continue
+
+            starts = outside
+            standalone = False
+            if event_type == XID_EVENT:
+                outside = True
+            elif event_type == QUERY_EVENT:
+                text = None
+                if event_length - 19 <= SCAN_QUERY_LENGTH:
+                    body = self.file.read(event_length - 19)
+                    if len(body) < event_length - 19:
+                        break
+                    (db_len, error_code, status_length) = \
+                        struct.unpack_from("<BHH", body, 8)
+                    text = body[13 + status_length + db_len + 1:
+                                len(body) - (self.checksum and
+                                             CHECKSUM_LENGTH or 0)]
+                if text == BEGIN:
+                    starts = True
+                    outside = False
+                elif text in TRANSACTION_END:
+                    outside = True
+                elif outside is not False:
+                    standalone = True
+            if starts:
+                end = group
+            if event_timestamp >= timestamp or standalone:
+                break
+            if starts:
+                groups.append((event_timestamp, group))
+            group = None
+        self.file.seek(self.position)
+        return groups, end
+
     def seek(self, pos):
         self.position = pos
         self.file.seek(pos, 0)
+        self.rotate_to = None
+        self.group_position = None
         self.insert_id = None
         self.last_insert_id = None
 
+    def close(self):
+        self.file.close()
+
     def rewind(self):
         self.seek(self.start_position)
 
@@ -198,6 +617,60 @@ class Binlog(object):
     def __iter__(self):
         return self.events()
 
+class MappedBinlog(Binlog):
+    """Binlog reader decoding straight from a memory mapped file.
+       Mapping is extended whenever the file has grown past it."""
+    def __init__(self, filename, verify_checksums=False):
+        Binlog.__init__(self, filename, verify_checksums)
+        self.map = None
+        self.size = 0
+        self.remap()
+
+    def remap(self):
+        """Map the file again if it has grown, returns True if it did"""
+        size = os.fstat(self.file.fileno()).st_size
+        if size <= self.size:
+            return False
+        # Events handed out keep referencing the old mapping
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+        self.size = size
+        return True
+
+    def read_event(self):
+        """Same as Binlog.read_event, without reading through file object"""
+
+        if self.until and self.position >= self.until:
+            return None
+
+        cur_position = self.position
+        if cur_position + 19 > self.size and not self.remap() or \
+                cur_position + 19 > self.size:
+            return None
+
+        (timestamp, event_type,
+         server_id, event_length,
+         next_position, flags
+        ) = struct.unpack_from("<IBIIIH", self.map, cur_position)
+
+        end = cur_position + event_length
+
+        # Large events are skipped without touching their pages
+        if event_length > self.max_event_size:
+            self.position = end
+            return False
+
+        if end > self.size and not self.remap() or end > self.size:
+            return None
+
+        self.position = end
+        if self.checksum and event_type != FORMAT_DESCRIPTION_EVENT:
+            end -= CHECKSUM_LENGTH
+            if self.verify_checksums and not self.checksum_ok(
+                    self.map, cur_position, end):
+                return False
+        return self.decode_event(cur_position, timestamp, event_type, self.map,
+                                 cur_position + self.header_length, end)
+
 # Simple standalone testcase
 if __name__ == "__main__":
     import sys
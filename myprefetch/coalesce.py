@@ -0,0 +1,80 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Batching of point lookups from many events into IN-list SELECTs, trading
+few milliseconds of delay for far fewer round trips.
+"""
+
+import threading
+import time
+
+from myprefetch.rewriters import lookup_query
+
+
+class Coalescer(object):
+    """Collects rewriters.Lookup keys by (db, table, columns, index), each
+       group turns into single SELECT once `size` keys are pending or the
+       oldest of them has waited `delay` seconds. With prepared, queries
+       are rewriters.Prepared."""
+    # Replaced by replay with clock of its own
+    clock = staticmethod(time.time)
+
+    def __init__(self, size=100, delay=0.05, prepared=False):
+        self.size = size
+        self.delay = delay
+        self.prepared = prepared
+        # group -> (time first key was added, keys, set of keys)
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def add(self, lookup):
+        """Queue lookup, returns list of queries ready to run"""
+        group = (lookup.db, lookup.table, lookup.columns, lookup.index)
+        with self.lock:
+            pending = self.groups.get(group)
+            if pending is None:
+                pending = self.groups[group] = (self.clock(), [], set())
+            _, keys, seen = pending
+            for key in lookup.values:
+                if key not in seen:
+                    seen.add(key)
+                    keys.append(key)
+            if len(keys) < self.size:
+                return []
+            del self.groups[group]
+        return self.queries(group, keys)
+
+    def flush(self, force=False):
+        """Queries for groups that waited long enough, or all with force"""
+        now = self.clock()
+        with self.lock:
+            due = [(group, pending[1])
+                   for group, pending in self.groups.items()
+                   if force or now - pending[0] >= self.delay]
+            for group, _ in due:
+                del self.groups[group]
+        ret = []
+        for group, keys in due:
+            ret.extend(self.queries(group, keys))
+        return ret
+
+    def queries(self, group, keys):
+        db, table, columns, index = group
+        return [lookup_query(db, table, columns, keys[i:i + self.size], index,
+                             self.prepared)
+                for i in range(0, len(keys), self.size)]
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Feedback controller retuning prefetch window and concurrency while running.
+"""
+
+import collections
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveController(object):
+    """Adjusts window_start, window_stop and active_runners of a Prefetch
+       every cycle, based on lag trend, queue depth, runner latency and how
+       far ahead of the SQL thread the last cycle got"""
+    def __init__(self, min_runners=1, min_window=1, max_window=3600,
+                 interval=1.0, smoothing=0.2, baseline_updates=300):
+        self.min_runners = min_runners
+        # Bounds for window_start and window_stop (seconds)
+        self.min_window = min_window
+        self.max_window = max_window
+        # How often (seconds) we allow changing anything
+        self.interval = interval
+        # Weight of newest sample in moving averages
+        self.smoothing = smoothing
+
+        self.last_update = 0
+        self.last_lag = None
+        # Lag change in seconds per second, positive if falling behind
+        self.lag_trend = 0.0
+        # Lowest runner latency of last baseline_updates updates, what an
+        # idle server gives us
+        self.base_latency = None
+        self.latencies = collections.deque(maxlen=baseline_updates)
+
+    def average(self, old, new):
+        return old + self.smoothing * (new - old)
+
+    def update(self, prefetch, lag, lead):
+        """Called after each prefetch cycle, lead is how many seconds ahead
+           of the SQL thread we have queued events"""
+        now = time.time()
+        if now - self.last_update < self.interval:
+            return
+        if self.last_lag is not None:
+            trend = (lag - self.last_lag) / (now - self.last_update)
+            self.lag_trend = self.average(self.lag_trend, trend)
+        self.last_update = now
+        self.last_lag = lag
+
+        # Nothing measured before first event is done
+        latency = prefetch.runner_latency or 0.0
+        if latency:
+            self.latencies.append(latency)
+            self.base_latency = min(self.latencies)
+        depth = float(prefetch.queue.qsize()) / max(prefetch.queue.maxsize, 1)
+
+        self.update_runners(prefetch, depth, latency)
+        self.update_window(prefetch, lag, lead, depth, latency)
+
+        logger.debug("Controller: trend %.2f depth %.2f latency %.4f lead %d "
+                     "-> window %d..%d, %d runners", self.lag_trend, depth,
+                     latency, lead, prefetch.window_start, prefetch.window_stop,
+                     prefetch.active_runners)
+
+    def update_runners(self, prefetch, depth, latency):
+        active = prefetch.active_runners
+        saturated = self.base_latency and latency > 3 * self.base_latency
+        if saturated:
+            # Server slows down, more concurrency will only hurt
+            active -= 1
+        elif depth > 0.75:
+            # Runners can't keep up with what we queue
+            active += 1
+        elif depth < 0.1:
+            active -= 1
+        prefetch.active_runners = max(self.min_runners,
+                                      min(active, prefetch.runners))
+
+    def update_window(self, prefetch, lag, lead, depth, latency):
+        # Work queued now gets done after the queue drains,
+        # SQL thread must not get there before that
+        wait = depth * prefetch.queue.maxsize * latency / \
+            max(prefetch.active_runners, 1)
+        window_start = int(math.ceil(wait + latency)) + self.min_window
+
+        window_stop = prefetch.window_stop
+        if lead >= window_stop - 1 and depth < 0.5 and self.lag_trend >= 0:
+            # We reach end of window with time to spare, and lag grows
+            window_stop = int(window_stop * 1.5) + 1
+        elif depth > 0.9 or self.lag_trend < 0:
+            window_stop = int(window_stop * 0.9)
+        # There is nothing in relay log beyond the lag
+        window_stop = min(window_stop, max(lag, self.min_window * 2),
+                          self.max_window)
+
+        prefetch.window_start = max(self.min_window,
+                                    min(window_start, window_stop - 1))
+        prefetch.window_stop = max(window_stop, prefetch.window_start + 1)
@@ -4,15 +4,17 @@
 
 import re
 
+from myprefetch.rewriters import Lookup
+
 delete_re = re.compile(r"DELETE FROM `(\w+)` WHERE `id` = '(\d+)' AND `type` = '(\d+)' ")
 def delete_rewrite(event):
-    """ Rewrite DELETE query into few SELECTs on different indexes """
+    """ Rewrite DELETE query into lookups on different indexes,
+        runners batch them with lookups from other events """
     try:
         table, id_, type_ = delete_re.findall(event.query)[0]
         return (
-            "SELECT 1 FROM `%s`.`%s`  WHERE id = %s " % (event.db, table, id_),
-            "SELECT 1 FROM `%s`.`%s` FORCE INDEX (idtype) "\
-                "WHERE id = %s and type = %s" % (event.db, table, id_, type_),
+            Lookup(event.db, table, ("id", ), ((id_, ), ), None),
+            Lookup(event.db, table, ("id", "type"), ((id_, type_), ), "idtype"),
         )
     except Exception:
         return None
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Bounded cache of prefetch work recently done or in flight, so that rows
+updated over and over within the window get warmed up only once.
+"""
+
+import collections
+import hashlib
+import re
+import threading
+import time
+
+from myprefetch import metrics
+from myprefetch.fingerprint import key_literals, normalize
+
+hits = metrics.registry.counter(
+    "prefetch_dedup_hits_total", "Work skipped as already done or in flight",
+    "kind")
+misses = metrics.registry.counter(
+    "prefetch_dedup_misses_total", "Work not seen within dedup TTL", "kind")
+
+# Longer statements are hardly ever repeated, not worth normalizing
+MAX_QUERY_LENGTH = 4096
+# Position comments rewriters.replay() puts in, every event has its own
+POSITION_COMMENT = re.compile(r"/\* pos:\d+ \*/ ")
+
+
+def digest(*parts):
+    """Keys are kept as digests, so memory used does not depend on
+       statement sizes"""
+    return hashlib.md5(repr(parts)).digest()
+
+
+def event_key(event):
+    """Key of rows query event touches: schema, statement shape, literals
+       of its WHERE clause and auto-increment values it was logged with.
+       None if event should not be deduplicated."""
+    if event.type != 'query' or event.query_length > MAX_QUERY_LENGTH:
+        return None
+    shape, literals = normalize(event.query)
+    return ("event", digest(event.db, shape, key_literals(shape, literals),
+                            event.insert_id, event.last_insert_id))
+
+
+def query_key(query):
+    """Key of rewritten statement, as runners run it, less position
+       comments"""
+    if len(query) > MAX_QUERY_LENGTH:
+        return None
+    if "/* pos:" in query:
+        query = POSITION_COMMENT.sub("", query)
+    return ("query", digest(query))
+
+
+def lookup_key(lookup, key):
+    """Key of single row point lookup reads"""
+    return ("lookup", digest(lookup.db, lookup.table, lookup.columns,
+                             lookup.index, key))
+
+
+class DedupCache(object):
+    """LRU of up to `size` keys, each of them remembered for `ttl` seconds"""
+    # Replaced by replay with clock of its own
+    clock = staticmethod(time.time)
+
+    def __init__(self, size=100000, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def claim(self, key):
+        """True if caller should go ahead with work for key, False if it was
+           claimed within ttl already"""
+        now = self.clock()
+        with self.lock:
+            claimed = self.entries.pop(key, None)
+            if claimed is not None and now - claimed < self.ttl:
+                self.entries[key] = claimed
+                hit = True
+            else:
+                self.entries[key] = now
+                hit = False
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        if hit:
+            hits.inc(label=key[0])
+        else:
+            misses.inc(label=key[0])
+        return not hit
+
+    def release(self, key):
+        """Work for key failed, let the next one try again"""
+        with self.lock:
+            self.entries.pop(key, None)
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Statement classification for Prefetch.detect, looking only at the first
+few bytes of each query.
+"""
+
+import re
+
+# Statements worth prefetching
+VERBS = ("SELECT", "INSERT", "UPDATE", "REPLACE", "DELETE")
+VERB_WIDTH = max(len(verb) for verb in VERBS)
+# Statements changing table definitions
+DDL_VERBS = ("ALTER", "CREATE", "DROP", "RENAME")
+
+WHITESPACE = " \t\r\n\f\v"
+
+# Returned by Dispatcher.lookup when no custom prefix matches
+DEFAULT = object()
+
+
+def statement_start(query):
+    """Offset of first character after leading whitespace and comments"""
+    pos = 0
+    end = len(query)
+    while pos < end:
+        if query[pos] in WHITESPACE:
+            pos += 1
+        elif query.startswith("/*", pos):
+            close = query.find("*/", pos + 2)
+            if close < 0:
+                return end
+            pos = close + 2
+        else:
+            break
+    return pos
+
+
+def is_dml(query, start=0):
+    """Does statement at start begin with one of VERBS"""
+    return query[start:start + VERB_WIDTH].upper().startswith(VERBS)
+
+
+def is_ddl(query, start=0):
+    """Does statement at start begin with one of DDL_VERBS"""
+    return query[start:start + VERB_WIDTH].upper().startswith(DDL_VERBS)
+
+
+def event_is_ddl(event, width=256):
+    """is_ddl for query event, copying out only first width bytes of it
+       unless leading comments are longer"""
+    head = event.head(width)
+    start = statement_start(head)
+    if start + VERB_WIDTH > len(head) and len(head) < event.query_length:
+        head = event.query
+        start = statement_start(head)
+    return is_ddl(head, start)
+
+
+class Dispatcher(object):
+    """Matches statements against ordered (prefix, rewriter) list, prefix
+       being a string or compiled regex. Runs of string prefixes are folded
+       into single regex each. If there are only string prefixes, decisions
+       are cached by the statement head they depend on."""
+    def __init__(self, prefixes, cache_size=10000):
+        self.source = list(prefixes)
+        self.cache_size = cache_size
+        self.cache = {}
+        # Longest string prefix, all that lookup needs to look at
+        self.width = 0
+        # [(regex, rewriters or None, combined)]
+        self.matchers = []
+
+        strings = []
+        for prefix, rewriter in self.source:
+            if isinstance(prefix, str):
+                strings.append((prefix, rewriter))
+                self.width = max(self.width, len(prefix))
+                continue
+            self._fold(strings)
+            strings = []
+            self.matchers.append((prefix, rewriter, False))
+        self._fold(strings)
+        self.memoize = all(combined for _, _, combined in self.matchers)
+
+    def _fold(self, strings):
+        if not strings:
+            return
+        # Alternatives are tried left to right, first listed prefix wins
+        regex = re.compile("|".join("(%s)" % re.escape(prefix)
+                                    for prefix, _ in strings))
+        self.matchers.append((regex, [rewriter for _, rewriter in strings],
+                              True))
+
+    def lookup(self, query, start=0):
+        """Rewriter for statement at start of query, DEFAULT if none"""
+        if self.memoize:
+            head = query[start:start + self.width]
+            try:
+                return self.cache[head]
+            except KeyError:
+                pass
+            rewriter = self._match(head, 0, head)
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[head] = rewriter
+            return rewriter
+        return self._match(query, start, None)
+
+    def _match(self, query, start, stripped):
+        for regex, rewriter, combined in self.matchers:
+            if combined:
+                match = regex.match(query, start)
+                if match:
+                    return rewriter[match.lastindex - 1]
+            else:
+                # Custom regexes see statement as it was handed out before
+                if stripped is None:
+                    stripped = query[start:].strip()
+                if regex.match(stripped):
+                    return rewriter
+        return DEFAULT
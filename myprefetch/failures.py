@@ -0,0 +1,117 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Statement shapes that keep failing on the replica (fake changes not
+supported, missing tables, lock waits), suppressed for a while instead of
+costing a failed statement and a ROLLBACK every time they come up.
+"""
+
+import collections
+import threading
+import time
+
+from myprefetch import metrics
+from myprefetch.dedup import MAX_QUERY_LENGTH, digest
+from myprefetch.fingerprint import normalize
+
+failures = metrics.registry.counter(
+    "prefetch_failures_total", "Events that failed on server, by kind", "kind")
+suppressed = metrics.registry.counter(
+    "prefetch_failures_suppressed_total",
+    "Events skipped as their shape keeps failing, by kind", "kind")
+
+
+def failure_key(event):
+    """Key of statement shape of event, of all of its statements for
+       transactions. None if event should not be tracked."""
+    if event.type == 'rows':
+        return ("rows", digest(event.db, event.table))
+    if event.type == 'transaction':
+        keys = [failure_key(item) for item in event.events]
+        if None in keys:
+            return None
+        return ("transaction", digest(event.db, keys))
+    if event.query_length > MAX_QUERY_LENGTH:
+        return None
+    return ("query", digest(event.db, normalize(event.query)[0]))
+
+
+class FailureCache(object):
+    """LRU of up to `size` shapes that failed recently. Shape failing
+       `threshold` times in a row, each within `window` seconds of the
+       previous failure or suppression ending, is suppressed for `backoff`
+       seconds, twice as long on every further failure up to `max_backoff`.
+       Success of the shape ends the streak."""
+    def __init__(self, size=10000, threshold=2, window=60, backoff=10,
+                 max_backoff=600):
+        self.size = size
+        self.threshold = threshold
+        self.window = window
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # key -> [failures in a row, suppressed until]
+        self.entries = collections.OrderedDict()
+        # All entries are forgotten after this
+        self.horizon = 0
+        self.lock = threading.Lock()
+
+    def check(self, key):
+        """Should event with key be skipped"""
+        if not self.entries:
+            return False
+        now = time.time()
+        with self.lock:
+            if now > self.horizon:
+                self.entries.clear()
+                return False
+            entry = self.entries.get(key)
+            if entry is None or now >= entry[1]:
+                return False
+        suppressed.inc(label=key[0])
+        return True
+
+    def succeeded(self, key):
+        """Event with key ran fine, unless it is suppressed (one that was
+           in flight already), shape starts over"""
+        if not self.entries:
+            return
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now >= entry[1]:
+                del self.entries[key]
+
+    def failed(self, key):
+        """Event with key failed on server"""
+        failures.inc(label=key[0])
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or now > entry[1] + self.window:
+                entry = [0, now]
+            entry[0] += 1
+            if entry[0] >= self.threshold:
+                entry[1] = now + min(
+                    self.backoff * 2 ** (entry[0] - self.threshold),
+                    self.max_backoff)
+            else:
+                entry[1] = now
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+            self.horizon = max(self.horizon, entry[1] + self.window)
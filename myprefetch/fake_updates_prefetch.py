@@ -5,7 +5,7 @@ import logging
 import os
 
 from myprefetch import readahead
-from myprefetch.rewriters import fake_update
+from myprefetch.rewriters import IndexLookup, fake_update
 from myprefetch.mysql import Config
 
 def main():
@@ -34,6 +34,82 @@ so it can execute statements without much rewriting.""".strip(),
                              '--elapsed_limit on the master')
     parser.add_argument('--logpath', default="/var/lib/mysql",
                         help='How far into the future to prefetch.')
+    parser.add_argument('--relay_log_info', default='relay-log.info',
+                        help='File in --logpath SQL thread records its position in, '
+                             'watched instead of polling SHOW SLAVE STATUS')
+    parser.add_argument('--status_interval', default=1.0, type=float,
+                        help='Seconds between SHOW SLAVE STATUS checks while '
+                             '--relay_log_info is there')
+    parser.add_argument('--rewriter', default='fake_update',
+                        choices=('fake_update', 'index_lookup'),
+                        help='Execute statements with InnoDB fake changes, or turn them '
+                             'into read-only lookups on every index they modify')
+    parser.add_argument('--use_mmap', action='store_true',
+                        help='Memory map relay logs instead of reading them')
+    parser.add_argument('--verify_checksums', action='store_true',
+                        help='Check CRC32 checksums of relay log events, skipping '
+                             'events that fail')
+    parser.add_argument('--engine', default='threads',
+                        choices=('threads', 'async', 'processes'),
+                        help='Run statements from a thread per connection, '
+                             'multiplex pipelined connections from one thread, or '
+                             'run runner threads in worker processes')
+    parser.add_argument('--pipeline_depth', default=32, type=int,
+                        help='Statements in flight per connection with async engine')
+    parser.add_argument('--batch_size', default=1, type=int,
+                        help='Queued events each runner sends together as single '
+                             'multi-statement round trip (8 is a good start), '
+                             'threads and processes engines')
+    parser.add_argument('--workers', default=2, type=int,
+                        help='Worker processes with processes engine, each '
+                             'running --runners threads')
+    parser.add_argument('--ring_size', default=64, type=int,
+                        help='Size (MB) of shared memory ring feeding worker processes')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Retune windows and number of active runners while running, '
+                             'starting from the values given')
+    parser.add_argument('--dedup_size', default=0, type=int,
+                        help='Statements and rows remembered as recently prefetched, '
+                             'not to be prefetched again (100000 is a good start), '
+                             '0 disables deduplication')
+    parser.add_argument('--dedup_ttl', default=60, type=int,
+                        help='Seconds a prefetched statement or row is not prefetched again')
+    parser.add_argument('--coalesce_size', default=1, type=int,
+                        help='Keys batched into single lookup statement (100 is a '
+                             'good start), 1 disables batching')
+    parser.add_argument('--coalesce_delay', default=0.05, type=float,
+                        help='Seconds lookups may wait for others to batch with')
+    parser.add_argument('--affinity', default=None, choices=('db', 'table'),
+                        help='Give every runner (worker process with processes engine) '
+                             'queue of its own, routing events on one db or table '
+                             'to the same one')
+    parser.add_argument('--group_transactions', action='store_true',
+                        help='Dispatch whole transactions to single runner instead '
+                             'of statements one by one')
+    parser.add_argument('--prepared_size', default=0, type=int,
+                        help='Prepared statements each connection keeps for lookups, '
+                             '0 sends lookups as plain statements')
+    parser.add_argument('--failure_cache_size', default=10000, type=int,
+                        help='Statement shapes remembered as failing on the server, '
+                             '0 disables suppressing them')
+    parser.add_argument('--failure_backoff', default=10, type=int,
+                        help='Seconds a statement shape that keeps failing is not '
+                             'tried again, doubling while it still fails')
+    parser.add_argument('--max_threads_running', default=0, type=int,
+                        help='Run fewer runners, down to none, while server '
+                             'Threads_running is above this, 0 disables')
+    parser.add_argument('--max_pending_reads', default=0, type=int,
+                        help='Run fewer runners, down to none, while '
+                             'Innodb_data_pending_reads is above this, 0 disables')
+    parser.add_argument('--max_latency', default=0, type=float,
+                        help='Run fewer runners, down to none, while prefetch '
+                             'statements take longer (seconds) on average, 0 disables')
+    parser.add_argument('--throttle_interval', default=1.0, type=float,
+                        help='Seconds between checks of server load')
+    parser.add_argument('--metrics_port', default=None, type=int,
+                        help='Serve metrics as text over HTTP on this local port')
+    parser.add_argument('--metrics_interval', default=60, type=int,
+                        help='How often (seconds) to log metrics, 0 to disable')
     args = vars(parser.parse_args())
 
     if not os.path.isdir(args['logpath']):
@@ -41,10 +117,14 @@ so it can execute statements without much rewriting.""".strip(),
 
     config = Config(**{k: args.pop(k) for k in ('host', 'port', 'username', 'password')})
 
+    rewriter = args.pop('rewriter')
     prefetch = readahead.Prefetch(config, **args)
-    prefetch.worker_init_connect = "SET SESSION "\
-        "long_query_time=60, innodb_fake_changes=1, sql_log_bin=0"
-    prefetch.rewriter = fake_update
+    if rewriter == 'index_lookup':
+        prefetch.rewriter = IndexLookup()
+    else:
+        prefetch.worker_init_connect = "SET SESSION "\
+            "long_query_time=60, innodb_fake_changes=1, sql_log_bin=0"
+        prefetch.rewriter = fake_update
     prefetch.run()
 
 if __name__ == "__main__":
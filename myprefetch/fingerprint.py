@@ -0,0 +1,71 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Statement normalization, separating statement shape from its literals.
+"""
+
+import re
+
+from myprefetch.rewriters import Prepared
+
+# Runs of whitespace and comments, quoted strings and identifiers, numbers
+# and hex literals. Numbers glued to identifiers (t1, col_2) are left alone.
+token_re = re.compile(r"""
+    (?:\s+|/\*.*?\*/)+
+  | '(?:[^'\\]|\\.|'')*'
+  | "(?:[^"\\]|\\.|"")*"
+  | `(?:[^`]|``)*`
+  | (?<![\w.])(?:0x[0-9a-fA-F]+|[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)(?!\w)
+""", re.S | re.X)
+
+where_re = re.compile(r"\bWHERE\b", re.I)
+
+
+def normalize(query):
+    """Returns (shape, literals): query with comments dropped, whitespace
+       collapsed and each literal replaced by ?, and the literals in order"""
+    literals = []
+
+    def replace(match):
+        token = match.group()
+        first = token[0]
+        if first.isspace() or token.startswith("/*"):
+            return " "
+        if first == "`":
+            return token
+        literals.append(token)
+        return "?"
+
+    return token_re.sub(replace, query).strip(), literals
+
+
+def prepare(query):
+    """rewriters.Prepared running query, with its literals as params.
+       Numbers in ORDER BY or GROUP BY positions would become constants,
+       so this suits statements differing only in literal values."""
+    shape, literals = normalize(query)
+    return Prepared(shape, tuple(literals))
+
+
+def key_literals(shape, literals):
+    """Literals from WHERE clause on, those that select rows statement
+       touches. All of them if there is no WHERE."""
+    match = where_re.search(shape)
+    if not match:
+        return tuple(literals)
+    return tuple(literals[shape.count("?", 0, match.start()):])
@@ -0,0 +1,272 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Counters and histograms describing the prefetch pipeline. They are served
+as plain text (Prometheus exposition format) over HTTP and can be dumped
+into the log periodically.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _labels(label_name, label):
+    if label is None:
+        return ""
+    return '{%s="%s"}' % (label_name, str(label).replace('"', '\\"'))
+
+
+class Counter(object):
+    """Monotonic count, optionally split by single label.
+       If function is given, it is called for the value instead"""
+    kind = "counter"
+
+    def __init__(self, name, help, label_name=None, function=None):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.function = function
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, label=None):
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def get(self, label=None):
+        if self.function:
+            return self.function()
+        return self.values.get(label, 0)
+
+    def samples(self):
+        if self.function:
+            return [("", None, self.function())]
+        with self.lock:
+            return [("", label, value) for label, value
+                    in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    """Value that goes up and down"""
+    kind = "gauge"
+
+    def set(self, value, label=None):
+        with self.lock:
+            self.values[label] = value
+
+
+class Histogram(object):
+    """Distribution of observed values over fixed buckets"""
+    kind = "histogram"
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+    def __init__(self, name, help, label_name=None, buckets=None):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        if buckets:
+            self.buckets = tuple(buckets)
+        # label -> [bucket counts..., +Inf count, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, label=None):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(label)
+            if counts is None:
+                counts = self.values[label] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        ret = []
+        with self.lock:
+            items = sorted((label, list(counts))
+                           for label, counts in self.values.items())
+        for label, counts in items:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                ret.append(("_bucket", (label, bound), total))
+            ret.append(("_count", label, total))
+            ret.append(("_sum", label, counts[-1]))
+        return ret
+
+    def quantile(self, q, label=None):
+        """Upper bound of bucket holding q-th quantile"""
+        with self.lock:
+            counts = list(self.values.get(label, ()))
+        if not counts:
+            return None
+        target = q * sum(counts[:-1])
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= target:
+                return bound
+
+
+class Registry(object):
+    """Set of metrics exposed together"""
+    def __init__(self):
+        self.metrics = {}
+        self.order = []
+        self.last_summary = {}
+        self.last_summary_time = time.time()
+
+    def add(self, metric):
+        """Registers metric, replacing any other of same name"""
+        if metric.name not in self.metrics:
+            self.order.append(metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, label_name=None, function=None):
+        return self.add(Counter(name, help, label_name, function))
+
+    def gauge(self, name, help, label_name=None, function=None):
+        return self.add(Gauge(name, help, label_name, function))
+
+    def histogram(self, name, help, label_name=None, buckets=None):
+        return self.add(Histogram(name, help, label_name, buckets))
+
+    def take(self):
+        """Counter and histogram values since last take(), for merge() into
+           registry of another process. Computed metrics stay out"""
+        ret = {}
+        for name in self.order:
+            metric = self.metrics[name]
+            if metric.kind == "gauge" or getattr(metric, "function", None):
+                continue
+            with metric.lock:
+                values, metric.values = metric.values, {}
+            if values:
+                ret[name] = values
+        return ret
+
+    def merge(self, taken):
+        """Adds values from take() of another process to ours"""
+        for name, values in taken.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            with metric.lock:
+                for label, value in values.items():
+                    if metric.kind == "histogram":
+                        counts = metric.values.get(label)
+                        if counts is None:
+                            metric.values[label] = list(value)
+                        else:
+                            for i, count in enumerate(value):
+                                counts[i] += count
+                    else:
+                        metric.values[label] = \
+                            metric.values.get(label, 0) + value
+
+    def collect(self, queue):
+        """merge() whatever other processes put on queue, from a daemon
+           thread"""
+        def run():
+            while True:
+                self.merge(queue.get())
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for name in self.order:
+            metric = self.metrics[name]
+            lines.append("# HELP %s %s" % (name, metric.help))
+            lines.append("# TYPE %s %s" % (name, metric.kind))
+            for suffix, label, value in metric.samples():
+                if suffix == "_bucket":
+                    label, bound = label
+                    labels = _labels(metric.label_name, label)
+                    le = 'le="%s"' % bound
+                    labels = labels and labels[:-1] + "," + le + "}" or \
+                        "{" + le + "}"
+                else:
+                    labels = _labels(metric.label_name, label)
+                lines.append("%s%s%s %s" % (name, suffix, labels, value))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Human readable digest, counters as rates since last call"""
+        now = time.time()
+        elapsed = max(now - self.last_summary_time, 0.001)
+        self.last_summary_time = now
+        lines = []
+        for name in self.order:
+            metric = self.metrics[name]
+            if metric.kind == "histogram":
+                for label in sorted(metric.values):
+                    counts = metric.values[label]
+                    count = sum(counts[:-1])
+                    lines.append("%s%s count=%d avg=%.4f p50<=%s p99<=%s" % (
+                        name, _labels(metric.label_name, label), count,
+                        counts[-1] / max(count, 1),
+                        metric.quantile(0.5, label),
+                        metric.quantile(0.99, label)))
+                continue
+            for _, label, value in metric.samples():
+                key = (name, label)
+                line = "%s%s %s" % (name, _labels(metric.label_name, label),
+                                    value)
+                if metric.kind == "counter":
+                    rate = (value - self.last_summary.get(key, 0)) / elapsed
+                    self.last_summary[key] = value
+                    line += " (%.1f/s)" % rate
+                lines.append(line)
+        return "\n".join(lines)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve render() output over HTTP from a daemon thread"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logger.info("Serving metrics on %s:%d", host, port)
+        return server
+
+
+# Default registry all prefetcher components report to
+registry = Registry()
@@ -19,26 +19,56 @@ import collections
 import logging
 import time
 import sys
-import _mysql
-import MySQLdb
-import MySQLdb.constants.CLIENT as CL
+
+from myprefetch.prepared import StatementCache
+from myprefetch.rewriters import Prepared, quote_name
+
+try:
+    import _mysql
+    import MySQLdb
+    import MySQLdb.constants.CLIENT as CL
+    Error = MySQLdb.Error
+    OperationalError = MySQLdb.OperationalError
+except ImportError:
+    # Only connecting needs MySQLdb, benchmarks and replay run without it
+    _mysql = MySQLdb = CL = None
+
+    class Error(Exception):
+        pass
+
+    class OperationalError(Error):
+        pass
 
 logger = logging.getLogger(__name__)
 
-Error = MySQLdb.Error
+# CR_SERVER_GONE_ERROR and CR_SERVER_LOST
+CONNECTION_LOST = (2006, 2013)
+# Column name of marker selected after each pipeline item
+PIPELINE_MARK = "__prefetch_mark"
 
 Config = collections.namedtuple('Config', ['host', 'port', 'username', 'password'])
 
 class MySQL(object):
     _conn = None
+    # Seconds last q() took, from sending query to reading all results
+    last_query_time = None
+    # Default schema of connection, as set by q(schema=...). Anyone running
+    # USE on their own should reset it to None.
+    schema = None
 
-    def __init__(self, config, init_connect=None):
+    def __init__(self, config, init_connect=None, prepared_size=0):
         self.config = config
         self.init_connect = init_connect
+        # Statements execute() has prepared, up to prepared_size of them
+        self.prepared = StatementCache(prepared_size)
 
     """ Basic MySQL connection functionality """
     def reconnect(self):
+        if _mysql is None:
+            raise EnvironmentError("MySQLdb is needed to connect to MySQL")
         self._conn = None
+        self.schema = None
+        self.prepared.clear()
 
         while self._conn == None:
             try:
@@ -56,29 +86,68 @@ class MySQL(object):
             except MemoryError:
                 logger.exception("Failed to connect to %s", self.config)
                 sys.exit(1)
-            except MySQLdb.Error:
+            except Error:
                 logger.exception("Failed to connect to %s", self.config)
                 self._conn = None
                 time.sleep(1)
 
-    def q(self, query, use_result=True):
+    def close(self):
+        """Drops connection, next q() makes a new one"""
+        if self._conn:
+            self._conn.close()
+        self._conn = None
+        self.schema = None
+        self.prepared.clear()
+
+    def q(self, query, use_result=True, discard=False, schema=None,
+          rebuild=None):
+        """Runs query, returning list of row dicts from all result sets.
+           With discard, results are read off the wire and thrown away
+           without making rows, errors are still raised. With schema, query
+           runs in it, USE is sent along only if connection is elsewhere.
+           rebuild, if given, makes query text again after reconnecting."""
         # Establish connection if not existing or fails to ping
         if not self._conn:
             self.reconnect()
 
+        switched = schema and schema != self.schema
+        if switched:
+            query = "USE %s; %s" % (quote_name(schema), query)
+            # Not known where we are until all of it succeeds
+            self.schema = None
+
+        started = time.time()
         # We will retry just once - reconnect has infinite loop though
         for attempt in (True, False):
             try:
                 self._conn.query(query)
                 break  # if successful
-            except MySQLdb.OperationalError:
+            except OperationalError:
                 logger.exception("Failed to send query [%s], retrying", query)
                 if attempt:
                     self.reconnect()
+                    if rebuild:
+                        query = rebuild()
+                        switched = False
+                    if schema and not switched:
+                        query = "USE %s; %s" % (quote_name(schema), query)
+                        switched = True
                     continue
                 else:
                     return None
 
+        if discard:
+            while True:
+                # Unbuffered result skips remaining rows within
+                # libmysqlclient when freed, which happens right away
+                self._conn.use_result()
+                if self._conn.next_result() < 0:
+                    break
+            self.last_query_time = time.time() - started
+            if schema:
+                self.schema = schema
+            return None
+
         if use_result:
             ret = []
             while True:
@@ -100,10 +169,103 @@ class MySQL(object):
                     else:
                         break
 
+            self.last_query_time = time.time() - started
+            if schema:
+                self.schema = schema
             return ret
         else:
             return
 
+    def execute(self, prepared, comment="", schema=None):
+        """Runs rewriters.Prepared, discarding results. Statement gets
+           prepared on first use, plain text is sent if prepared_size is 0."""
+        def text():
+            query = self.prepared.sql(prepared)
+            if comment:
+                query = "%s %s" % (comment, query)
+            return query
+
+        try:
+            # Reconnecting drops statements prepared so far
+            return self.q(text(), discard=True, schema=schema, rebuild=text)
+        except Error:
+            self.prepared.forget(prepared.shape)
+            raise
+
+    def pipeline(self, items):
+        """Runs items, each a (queries, comment, schema) tuple, in single
+           multi-statement round trip, discarding results. Queries may be
+           rewriters.Prepared. Server stops at first failing statement,
+           returns (number of items that ran, error of the next one or
+           None)."""
+        if not self._conn:
+            self.reconnect()
+
+        started = time.time()
+        done = 0
+        error = None
+        # Retry just once, and only if nothing ran
+        for attempt in (True, False):
+            query, schema = self.pipeline_query(items)
+            # Not known where we are until all of it succeeds
+            self.schema = None
+            try:
+                self._conn.query(query)
+                while True:
+                    result = self._conn.use_result()
+                    if result is not None and \
+                            result.describe()[0][0] == PIPELINE_MARK:
+                        done = int(result.fetch_row()[0][0]) + 1
+                    # Freeing unbuffered result skips rest of its rows
+                    result = None
+                    if self._conn.next_result() < 0:
+                        break
+            except OperationalError as e:
+                if attempt and not done and e.args[0] in CONNECTION_LOST:
+                    logger.exception("Failed to send pipeline, retrying")
+                    self.reconnect()
+                    continue
+                error = e
+            except Error as e:
+                error = e
+            break
+        self.last_query_time = time.time() - started
+
+        if error is not None and done == len(items):
+            # Broke after last marker, everything ran. Lost connection
+            # shows up on next round trip.
+            logger.debug("Pipeline failed after all items ran: %s", error)
+            error = None
+        if error is None and done < len(items):
+            # Should not happen, but better not to report what did not run
+            error = Error("Pipeline ended after %d of %d items" %
+                          (done, len(items)))
+        if error is None:
+            self.schema = schema
+            return done, None
+        # Statements past failing one were never prepared
+        for queries, _, _ in items[done:]:
+            for query in queries:
+                if isinstance(query, Prepared):
+                    self.prepared.forget(query.shape)
+        return done, error
+
+    def pipeline_query(self, items):
+        """Text of pipeline() items, with schema connection ends up in"""
+        parts = []
+        schema = self.schema
+        for index, (queries, comment, item_schema) in enumerate(items):
+            if item_schema and item_schema != schema:
+                parts.append("USE %s" % quote_name(item_schema))
+                schema = item_schema
+            for query in queries:
+                if isinstance(query, Prepared):
+                    query = self.prepared.sql(query)
+                parts.append("%s %s" % (comment, query))
+            # Tells how far server got if something fails
+            parts.append("SELECT %d AS %s" % (index, PIPELINE_MARK))
+        return "; ".join(parts), schema
+
 if __name__ == "__main__":
     print MySQL(Config(sys.argv)).q("SELECT 'everything'; SET @a=1; "
                                     "SELECT 1 FROM dual WHERE NULL; SELECT 'is'; SELECT 'ok'")
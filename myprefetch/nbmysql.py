@@ -0,0 +1,403 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Minimal non-blocking MySQL client protocol implementation.
+Only what prefetching needs: authenticate, send queries and read through
+their responses without keeping any rows. Several queries may be in flight
+on a single connection, server answers them in order.
+"""
+
+from collections import deque
+import errno
+import hashlib
+import logging
+import socket
+import struct
+import time
+
+from myprefetch.prepared import StatementCache
+from myprefetch.rewriters import quote_name
+
+logger = logging.getLogger(__name__)
+
+CLIENT_LONG_PASSWORD = 0x1
+CLIENT_PROTOCOL_41 = 0x200
+CLIENT_TRANSACTIONS = 0x2000
+CLIENT_SECURE_CONNECTION = 0x8000
+CLIENT_MULTI_STATEMENTS = 0x10000
+CLIENT_MULTI_RESULTS = 0x20000
+CLIENT_PLUGIN_AUTH = 0x80000
+
+SERVER_MORE_RESULTS_EXISTS = 0x8
+
+COM_QUERY = 3
+
+MAX_PACKET = 0xffffff
+
+# Connection states
+CONNECTING, HANDSHAKE, AUTH, READY, CLOSED = range(5)
+
+# Response states of command in flight
+FIRST, COLUMNS, COLUMNS_EOF, ROWS = range(4)
+
+
+class Error(Exception):
+    """Server returned error packet, or connection broke"""
+    def __init__(self, code, message):
+        Exception.__init__(self, code, message)
+        self.code = code
+        self.message = message
+
+
+def _xor(left, right):
+    return "".join(chr(ord(a) ^ ord(b)) for a, b in zip(left, right))
+
+
+def scramble_native(password, salt):
+    """mysql_native_password authentication response"""
+    if not password:
+        return ""
+    stage1 = hashlib.sha1(password).digest()
+    stage2 = hashlib.sha1(stage1).digest()
+    return _xor(stage1, hashlib.sha1(salt + stage2).digest())
+
+
+def scramble_sha256(password, salt):
+    """caching_sha2_password fast authentication response"""
+    if not password:
+        return ""
+    stage1 = hashlib.sha256(password).digest()
+    stage2 = hashlib.sha256(hashlib.sha256(stage1).digest() + salt).digest()
+    return _xor(stage1, stage2)
+
+
+SCRAMBLES = {
+    "mysql_native_password": scramble_native,
+    "caching_sha2_password": scramble_sha256,
+}
+
+
+def _lenenc(data, pos):
+    first = ord(data[pos])
+    if first < 251:
+        return first, pos + 1
+    elif first == 252:
+        return struct.unpack_from("<H", data, pos + 1)[0], pos + 3
+    elif first == 253:
+        lo, hi = struct.unpack_from("<HB", data, pos + 1)
+        return lo | hi << 16, pos + 4
+    return struct.unpack_from("<Q", data, pos + 1)[0], pos + 9
+
+
+def _error(payload):
+    code = struct.unpack_from("<H", payload, 1)[0]
+    message = payload[3:]
+    if message.startswith("#"):
+        message = message[6:]
+    return Error(code, message)
+
+
+class Command(object):
+    """Query in flight, callback gets (command, error or None)"""
+    def __init__(self, query, callback=None, context=None):
+        self.query = query
+        self.callback = callback
+        self.context = context
+        # Shape of rewriters.Prepared statement runs, if any
+        self.shape = None
+        # Schema USE sent along switches to, if any
+        self.schema = None
+        self.state = FIRST
+        self.columns = 0
+        self.sent = None
+        self.elapsed = None
+
+
+class Connection(object):
+    """Single non-blocking server connection, driven by the owner's
+       select() loop through fileno(), wants_write(), readable() and
+       writable()"""
+    def __init__(self, config, init_commands=(), prepared_size=0):
+        self.config = config
+        self.init_commands = [c for c in init_commands if c]
+        self.sock = None
+        self.state = CLOSED
+        self.inbuf = ""
+        self.outbuf = ""
+        self.commands = deque()
+        self.continued = False
+        self.scramble = None
+        self.plugin = "mysql_native_password"
+        self.server_flags = 0
+        # Default schema connection is known to be in, as of last
+        # completed command
+        self.schema = None
+        # Commands in flight that switch schema
+        self.switches = 0
+        # Statements execute() has prepared, up to prepared_size of them
+        self.prepared = StatementCache(prepared_size)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    @property
+    def in_flight(self):
+        return len(self.commands)
+
+    def connect(self):
+        host = self.config.host
+        # We do not speak over unix sockets
+        if host == "localhost":
+            host = "127.0.0.1"
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(0)
+        self.inbuf = self.outbuf = ""
+        self.continued = False
+        self.schema = None
+        self.switches = 0
+        self.prepared.clear()
+        self.state = CONNECTING
+        ret = self.sock.connect_ex((host, self.config.port))
+        if ret not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.close(Error(ret, "Can't connect to %s:%d" %
+                             (host, self.config.port)))
+
+    def close(self, error=None):
+        """Drop connection, failing everything in flight"""
+        if self.sock:
+            self.sock.close()
+        self.sock = None
+        self.state = CLOSED
+        commands, self.commands = self.commands, deque()
+        self.switches = 0
+        error = error or Error(2013, "Lost connection to MySQL server")
+        for command in commands:
+            if command.callback:
+                command.callback(command, error)
+
+    def query(self, query, callback=None, context=None, schema=None):
+        """Queue query for sending, returns Command object. With schema,
+           query runs in it, USE is sent along unless connection is known
+           to be there. While another USE is in flight it is not known, as
+           that one may still fail."""
+        switch = schema and (schema != self.schema or self.switches)
+        if switch:
+            query = "USE %s; %s" % (quote_name(schema), query)
+        command = Command(query, callback, context)
+        if switch:
+            command.schema = schema
+            self.switches += 1
+        self.send_command(command)
+        return command
+
+    def execute(self, prepared, callback=None, context=None, schema=None,
+                comment=""):
+        """Same as query(), for rewriters.Prepared"""
+        query = self.prepared.sql(prepared)
+        if comment:
+            query = "%s %s" % (comment, query)
+        command = self.query(query, callback, context, schema)
+        command.shape = prepared.shape
+        return command
+
+    def send_command(self, command):
+        command.sent = time.time()
+        self.commands.append(command)
+        self.write_packet(chr(COM_QUERY) + command.query, 0)
+
+    def write_packet(self, payload, sequence):
+        while True:
+            chunk, payload = payload[:MAX_PACKET], payload[MAX_PACKET:]
+            self.outbuf += struct.pack("<I", len(chunk))[:3] + \
+                chr(sequence & 0xff) + chunk
+            sequence += 1
+            if len(chunk) < MAX_PACKET:
+                break
+
+    def wants_write(self):
+        return self.state == CONNECTING or bool(self.outbuf)
+
+    def writable(self):
+        if self.state == CONNECTING:
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self.close(Error(err, "Can't connect to %s:%d" %
+                                 (self.config.host, self.config.port)))
+                return
+            self.state = HANDSHAKE
+            return
+        try:
+            sent = self.sock.send(self.outbuf)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.close(Error(e.errno, str(e)))
+            return
+        self.outbuf = self.outbuf[sent:]
+
+    def readable(self):
+        try:
+            data = self.sock.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.close(Error(e.errno, str(e)))
+            return
+        if not data:
+            self.close()
+            return
+        self.inbuf += data
+
+        pos = 0
+        while self.state != CLOSED and len(self.inbuf) - pos >= 4:
+            length, = struct.unpack_from("<I", self.inbuf[pos:pos + 3] + "\0")
+            if len(self.inbuf) - pos - 4 < length:
+                break
+            sequence = ord(self.inbuf[pos + 3])
+            payload = self.inbuf[pos + 4:pos + 4 + length]
+            pos += 4 + length
+            # Tail of packet over 16M carries no meaning for us
+            continued, self.continued = self.continued, length == MAX_PACKET
+            if not continued:
+                self.packet(payload, sequence)
+        self.inbuf = self.inbuf[pos:]
+
+    def packet(self, payload, sequence):
+        if self.state == HANDSHAKE:
+            self.handshake(payload)
+        elif self.state == AUTH:
+            self.auth_result(payload, sequence)
+        elif self.state == READY and self.commands:
+            self.response(self.commands[0], payload)
+
+    def handshake(self, payload):
+        if payload[0] == "\xff":
+            self.close(_error(payload))
+            return
+        pos = payload.index("\0", 1) + 1
+        pos += 4    # connection id
+        salt = payload[pos:pos + 8]
+        pos += 9
+        flags = struct.unpack_from("<H", payload, pos)[0]
+        pos += 2
+        if len(payload) > pos:
+            pos += 3    # charset, status
+            flags |= struct.unpack_from("<H", payload, pos)[0] << 16
+            salt_length = ord(payload[pos + 2])
+            pos += 13
+            rest = max(13, salt_length - 8)
+            salt += payload[pos:pos + rest].rstrip("\0")[:12]
+            pos += rest
+            if flags & CLIENT_PLUGIN_AUTH:
+                self.plugin = payload[pos:].split("\0", 1)[0]
+        self.scramble = salt
+        self.server_flags = flags
+
+        client_flags = (CLIENT_LONG_PASSWORD | CLIENT_PROTOCOL_41 |
+                        CLIENT_TRANSACTIONS | CLIENT_SECURE_CONNECTION |
+                        CLIENT_MULTI_STATEMENTS | CLIENT_MULTI_RESULTS)
+        client_flags |= flags & CLIENT_PLUGIN_AUTH
+        if self.plugin not in SCRAMBLES:
+            self.plugin = "mysql_native_password"
+        auth = SCRAMBLES[self.plugin](self.config.password, salt)
+
+        response = struct.pack("<IIB23x", client_flags, MAX_PACKET, 33)
+        response += self.config.username + "\0"
+        response += chr(len(auth)) + auth
+        if client_flags & CLIENT_PLUGIN_AUTH:
+            response += self.plugin + "\0"
+        self.state = AUTH
+        self.write_packet(response, 1)
+
+    def auth_result(self, payload, sequence):
+        marker = payload[0]
+        if marker == "\x00":
+            self.state = READY
+            for command in self.init_commands:
+                self.query(command)
+        elif marker == "\xff":
+            self.close(_error(payload))
+        elif marker == "\xfe":
+            # Auth switch request
+            plugin, salt = payload[1:].split("\0", 1)
+            if plugin not in SCRAMBLES:
+                self.close(Error(2059, "Authentication plugin %s "
+                                       "is not supported" % plugin))
+                return
+            self.plugin = plugin
+            self.scramble = salt.rstrip("\0")
+            self.write_packet(
+                SCRAMBLES[plugin](self.config.password, self.scramble),
+                sequence + 1)
+        elif marker == "\x01":
+            # caching_sha2_password: 3 is fast auth success, OK follows
+            if payload[1:2] != "\x03":
+                self.close(Error(2061, "Full caching_sha2_password "
+                                       "authentication needs secure "
+                                       "connection"))
+
+    def response(self, command, payload):
+        marker = ord(payload[0])
+        if marker == 0xff:
+            self.finish(command, _error(payload))
+        elif command.state == FIRST:
+            if marker == 0x00:
+                pos = _lenenc(payload, 1)[1]
+                pos = _lenenc(payload, pos)[1]
+                status = struct.unpack_from("<H", payload, pos)[0]
+                if not status & SERVER_MORE_RESULTS_EXISTS:
+                    self.finish(command, None)
+            elif marker == 0xfb:
+                self.finish(command, Error(2027, "LOAD DATA LOCAL INFILE "
+                                                 "is not supported"))
+            else:
+                command.columns = _lenenc(payload, 0)[0]
+                command.state = COLUMNS
+        elif command.state == COLUMNS:
+            command.columns -= 1
+            if not command.columns:
+                command.state = COLUMNS_EOF
+        elif command.state == COLUMNS_EOF:
+            command.state = ROWS
+        elif marker == 0xfe and len(payload) < 9:
+            # End of rows
+            status = struct.unpack_from("<H", payload, 3)[0]
+            if status & SERVER_MORE_RESULTS_EXISTS:
+                command.state = FIRST
+            else:
+                self.finish(command, None)
+
+    def finish(self, command, error):
+        self.commands.popleft()
+        if command.schema:
+            self.switches -= 1
+            if not error:
+                self.schema = command.schema
+        if error:
+            # USE might not have gone through, next query sends it again
+            self.schema = None
+            if command.shape:
+                self.prepared.forget(command.shape)
+        command.elapsed = time.time() - command.sent
+        if command.callback:
+            command.callback(command, error)
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Where the SQL thread is, read from relay-log.info as the server updates it,
+with SHOW SLAVE STATUS polled only now and then to back it up.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+
+from myprefetch.relaylog import sequence
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0x80000
+IN_NONBLOCK = 0x800
+
+# wd, mask, cookie, length of name following
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def read_info(path):
+    """(relay log file name, position) from relay-log.info, None if it is
+       missing or being rewritten"""
+    try:
+        with open(path) as info:
+            lines = info.read().split("\n")
+    except IOError:
+        return None
+    # Since 5.6 first line tells number of lines
+    if lines[0].strip().isdigit():
+        lines = lines[1:]
+    try:
+        filename, position = lines[0].strip(), int(lines[1])
+    except (IndexError, ValueError):
+        return None
+    if not filename or position < 4:
+        return None
+    return os.path.basename(filename), position
+
+
+class InotifyWatch(object):
+    """Waits for changes of single file through inotify"""
+    def __init__(self, path):
+        self.path = path
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wd = -1
+
+    def wait(self, timeout):
+        """Returns False right away if file is not there to watch"""
+        if self.wd < 0:
+            self.wd = self.libc.inotify_add_watch(
+                self.fd, self.path, IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE |
+                IN_DELETE_SELF | IN_MOVE_SELF)
+            if self.wd < 0:
+                return False
+        if select.select([self.fd], [], [], timeout)[0]:
+            self.drain()
+        return True
+
+    def drain(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError:
+            return
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size + length
+            # File got replaced or removed, watch has to be added again
+            if mask & IN_IGNORED and wd == self.wd:
+                self.wd = -1
+
+
+class StatWatch(object):
+    """Polls file for changes where inotify is not available"""
+    interval = 0.01
+
+    def __init__(self, path):
+        self.path = path
+        self.last = self.stat()
+
+    def stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime
+
+    def wait(self, timeout):
+        """Returns False right away if file is not there to watch"""
+        if self.last is None:
+            self.last = self.stat()
+            if self.last is None:
+                return False
+        deadline = time.time() + timeout
+        while True:
+            current = self.stat()
+            if current != self.last:
+                self.last = current
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return True
+            time.sleep(min(self.interval, remaining))
+
+
+def watch(path):
+    try:
+        return InotifyWatch(path)
+    except (OSError, AttributeError, TypeError):
+        logger.info("No inotify, polling %s for changes", path)
+        return StatWatch(path)
+
+
+class PositionTracker(object):
+    """SHOW SLAVE STATUS lookalike. Relay log position comes from
+       relay-log.info whenever it is ahead of what SHOW SLAVE STATUS said,
+       which is asked every status_interval seconds, whether the file
+       moves or not. Without the file (relay_log_info_repository=TABLE)
+       this is plain polling."""
+    def __init__(self, slave, info_path=None, status_interval=1.0):
+        self.slave = slave
+        self.info_path = info_path
+        self.status_interval = status_interval
+        self.watch = info_path and watch(info_path) or None
+        self.last_status = None
+        self.refreshed = 0
+
+    def status(self):
+        info = self.watch and read_info(self.info_path)
+        now = time.time()
+        if not info or self.last_status is None or \
+                now - self.refreshed >= self.status_interval:
+            self.last_status = self.slave.slave_status()
+            self.refreshed = now
+        status = self.last_status
+        if status and info and (sequence(info[0]), info[1]) > \
+                (sequence(status["Relay_Log_File"]),
+                 int(status["Relay_Log_Pos"])):
+            status = dict(status, Relay_Log_File=info[0],
+                          Relay_Log_Pos=str(info[1]))
+        return status
+
+    def sleep(self, timeout, comment=None):
+        """Sleep timeout seconds, on server only if there is no file"""
+        if self.watch and os.path.exists(self.info_path):
+            time.sleep(timeout)
+        else:
+            self.slave.sleep(timeout, comment)
+
+    def wait(self, timeout, comment=None):
+        """Sleep timeout seconds, then on until SQL thread moves the file,
+           but no longer than until SHOW SLAVE STATUS is due again"""
+        if not self.watch or not os.path.exists(self.info_path):
+            self.slave.sleep(timeout, comment)
+            return
+        time.sleep(timeout)
+        self.watch.wait(max(self.refreshed + self.status_interval -
+                            time.time(), 0))
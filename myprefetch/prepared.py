@@ -0,0 +1,79 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Server side prepared statements of a connection, so that statements of
+same shape are parsed once. SQL level PREPARE and EXECUTE are used, they
+work the same over MySQLdb and nbmysql connections.
+"""
+
+import collections
+import itertools
+
+from myprefetch.rewriters import inline, quote
+
+
+class StatementCache(object):
+    """Names of statements prepared on one connection by shape. Once there
+       are `size` of them, name of least recently used one is prepared
+       again for the new shape - PREPARE deallocates what had that name,
+       so no more than `size` statements are ever left on the server,
+       even when statements fail halfway."""
+    def __init__(self, size=100):
+        self.size = size
+        self.names = collections.OrderedDict()
+        # Names of forgotten statements, free to prepare again
+        self.free = []
+        self.counter = itertools.count()
+
+    def sql(self, prepared):
+        """Text running rewriters.Prepared, preparing it along if needed"""
+        if not self.size:
+            return inline(prepared)
+        shape, params = prepared
+        parts = []
+        name = self.names.pop(shape, None)
+        if name is None:
+            if self.free:
+                name = self.free.pop()
+            elif len(self.names) >= self.size:
+                _, name = self.names.popitem(last=False)
+            else:
+                name = "prefetch_%d" % next(self.counter)
+            parts.append("PREPARE %s FROM %s" % (name, quote(shape)))
+        self.names[shape] = name
+
+        if params:
+            variables = ["@p%d" % i for i in range(len(params))]
+            parts.append("SET %s" % ", ".join(
+                "%s=%s" % pair for pair in zip(variables, params)))
+            parts.append("EXECUTE %s USING %s" % (name, ", ".join(variables)))
+        else:
+            parts.append("EXECUTE %s" % name)
+        return "; ".join(parts)
+
+    def forget(self, shape):
+        """Statement failed, prepare it again next time. Its name may still
+           be prepared on the server, it goes to the next new shape."""
+        name = self.names.pop(shape, None)
+        if name is not None:
+            self.free.append(name)
+
+    def clear(self):
+        """Connection was reset, nothing is prepared any more"""
+        self.names.clear()
+        del self.free[:]
@@ -15,25 +15,61 @@
 #   limitations under the License.
 #
 
+import collections
 import logging
+import multiprocessing
 import os
 import Queue
-import re
+import select
 import sys
 from threading import Thread
 import time
 
-from myprefetch import mysql, rewriters
-from myprefetch.binlog import Binlog
+from myprefetch import metrics, mysql, nbmysql, rewriters
+from myprefetch.binlog import Binlog, MappedBinlog
+from myprefetch.coalesce import Coalescer
+from myprefetch.controller import AdaptiveController
+from myprefetch.dedup import DedupCache, event_key, lookup_key, query_key
+from myprefetch.dispatch import DEFAULT, Dispatcher, event_is_ddl, is_dml, \
+    statement_start
+from myprefetch.failures import FailureCache, failure_key
+from myprefetch.relaylog import RelayLog, sequence
+from myprefetch.position import PositionTracker
+from myprefetch.ring import Ring
+from myprefetch.routing import KEYS, Router
+from myprefetch.scheduler import Scheduler
+from myprefetch.schema import SchemaCache
+from myprefetch.throttle import Throttle
 
-# Return whole string after multiple comment groups
-initial_comment_re = re.compile(r"^\s*(/\*.*?\*/\s*)*(.*)")
 def strip_initial_comment(query):
-    return initial_comment_re.findall(query)[-1][-1]
+    """Return whole string after multiple comment groups"""
+    return query[statement_start(query):]
 
 
 logger = logging.getLogger(__name__)
 
+detected = metrics.registry.counter(
+    "prefetch_detect_total", "Events classified, by rewriter chosen",
+    "rewriter")
+put_timeouts = metrics.registry.counter(
+    "prefetch_queue_put_timeouts_total", "Times queue stayed full for a second")
+skipped = metrics.registry.counter(
+    "prefetch_skipped_total", "Events passed over while reading relay log, "
+    "by reason", "reason")
+query_seconds = metrics.registry.histogram(
+    "prefetch_query_seconds", "Time spent running rewritten event",
+    "rewriter")
+lead_seconds = metrics.registry.histogram(
+    "prefetch_lead_seconds",
+    "How far ahead of SQL thread events are when runners pick them up",
+    buckets=(0, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600))
+
+
+def rewriter_name(rewriter):
+    if rewriter is None:
+        return "none"
+    return getattr(rewriter, "__name__", type(rewriter).__name__)
+
 
 class Executor (object):
     """Rewriters inheriting from Executor are given more freedom to execute"""
@@ -49,58 +85,472 @@ class Slave (mysql.MySQL):
 
     def sleep(self, threshold, comment=None):
         if comment:
-            self.q("/* %s */ SELECT SLEEP(%f)" % (comment, threshold))
+            self.q("/* %s */ SELECT SLEEP(%f)" % (comment, threshold),
+                   discard=True)
         else:
-            self.q("SELECT SLEEP(%f)" % threshold)
+            self.q("SELECT SLEEP(%f)" % threshold, discard=True)
+
+
+def rewrite(rewriter, event):
+    """Returns tuple of queries (or Lookups) rewriter produces for event,
+       or None"""
+    queries = rewriter(event)
+    if queries == None:
+        return None
+    if type(queries) in (str, rewriters.Lookup, rewriters.Prepared):
+        queries = (queries, )
+    return queries
 
 
 class Runner(Thread):
     """Worker thread that runs events placed on a queue"""
-    def __init__(self, db, prefetcher):
+    def __init__(self, db, prefetcher, index=0):
         self.db = db
-        self.queue = prefetcher.queue
+        self.prefetcher = prefetcher
+        self.queue = prefetcher.runner_queue(index)
         self.detect = prefetcher.detect
+        # Runners numbered above prefetcher.active_runners stay idle
+        self.index = index
+        # Wake up this often to send batched lookups when idle
+        coalescer = prefetcher.coalescer
+        self.timeout = coalescer and coalescer.delay or None
+        # Events sent together in single multi-statement round trip
+        self.batch_size = prefetcher.batch_size
         Thread.__init__(self)
         self.daemon = True
 
+    def execute(self, queries, comment, schema=None):
+        """Runs (query, dedup key) pairs"""
+        for query, key in queries:
+            try:
+                if isinstance(query, rewriters.Prepared):
+                    self.db.execute(query, comment, schema)
+                else:
+                    self.db.q("%s %s" % (comment, query), discard=True,
+                              schema=schema)
+            except mysql.Error:
+                self.prefetcher.release(key)
+                raise
+
+    def flush(self):
+        """Runs batched lookups that have waited long enough"""
+        queries = self.prefetcher.flush_lookups()
+        if not queries:
+            return
+        started = time.time()
+        try:
+            self.execute(queries, "/* prefetching batch */")
+        except mysql.Error:
+            logger.debug("Exception while running.", exc_info=True)
+            self.db.q("ROLLBACK", discard=True)
+        finally:
+            elapsed = time.time() - started
+            self.prefetcher.record_latency(elapsed)
+            query_seconds.observe(elapsed, "coalesced")
+
     def run(self):
         try:
             while True:
-                event = self.queue.get(block=True)
-                rewriter = self.detect(event)
-                if rewriter == None:
+                while self.index >= self.prefetcher.active_runners:
+                    time.sleep(0.1)
+
+                try:
+                    event = self.queue.get(block=True, timeout=self.timeout)
+                except Queue.Empty:
+                    self.flush()
                     continue
+                items = self.drain(event)
+                if self.batch_size > 1 and len(items) > 1:
+                    self.handle_batch(items)
+                else:
+                    for item in items:
+                        self.handle(item)
+                self.flush()
+        except Exception:
+            logger.exception("Exception while running.")
+            sys.stdout.flush()
+            os.kill(os.getpid(), 9)
+
+    def drain(self, event):
+        """Event and whatever else is queued, up to batch_size events,
+           split into what gets handled one by one"""
+        events = [event]
+        while len(events) < self.batch_size:
+            try:
+                events.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return [item for event in events
+                for item in self.prefetcher.split_transaction(event)]
+
+    def observe(self, name, elapsed):
+        self.prefetcher.record_latency(elapsed)
+        query_seconds.observe(elapsed, name)
 
+    def fail(self, event, keys=()):
+        """Event (None for batched lookups) failed on server, make sure
+           nothing is left open"""
+        for key in keys:
+            self.prefetcher.release(key)
+        if event is not None:
+            self.prefetcher.release_event(event)
+            self.prefetcher.record_failure(event)
+        self.db.q("ROLLBACK", discard=True)
+
+    def prepare(self, event):
+        """Returns (rewriter, [(query, dedup key)]) to run for event, None
+           if there is nothing to run. Executors get to run right away."""
+        rewriter = self.detect(event)
+        if rewriter == None:
+            return None
+
+        lead_seconds.observe(event.timestamp - self.prefetcher.sql_time)
+        started = time.time()
+        try:
+            # We give up full control to Executors
+            if isinstance(rewriter, Executor):
+                # They may well change default schema
+                self.db.schema = None
                 try:
-                    # We give up full control to Executors
-                    if isinstance(rewriter, Executor):
-                        rewriter.run(event, self.db)
-                        continue
+                    rewriter.run(event, self.db)
+                finally:
+                    self.observe(rewriter_name(rewriter),
+                                 time.time() - started)
+                self.prefetcher.record_success(event)
+                return None
+
+            queries = rewrite(rewriter, event)
+        except mysql.Error:
+            logger.debug("Exception while running.", exc_info=True)
+            self.fail(event)
+            return None
+        if queries == None:
+            return None
+        return rewriter, self.prefetcher.expand(queries)
+
+    def handle(self, event):
+        started = time.time()
+        prepared = self.prepare(event)
+        if prepared is None:
+            return
+        rewriter, queries = prepared
+        try:
+            self.execute(queries, "/* prefetching at %d */" % event.pos,
+                         event.db)
+            self.prefetcher.record_success(event)
+        except mysql.Error:
+            logger.debug("Exception while running.", exc_info=True)
+            self.fail(event)
+        finally:
+            self.observe(rewriter_name(rewriter), time.time() - started)
+
+    def handle_batch(self, events):
+        """Runs statements of all events, and batched lookups that are due,
+           in single round trip. Whatever follows failing event is sent
+           again."""
+        started = time.time()
+        # [(event, rewriter name, [(query, dedup key)])]
+        work = []
+        for event in events:
+            prepared = self.prepare(event)
+            if prepared and prepared[1]:
+                work.append((event, rewriter_name(prepared[0]), prepared[1]))
+        lookups = self.prefetcher.flush_lookups()
+        if lookups:
+            work.append((None, "coalesced", lookups))
+        if not work:
+            return
+        names = [name for _, name, _ in work]
+
+        while work:
+            done, error = self.db.pipeline([
+                ([query for query, _ in queries],
+                 event and "/* prefetching at %d */" % event.pos or
+                 "/* prefetching batch */",
+                 event and event.db)
+                for event, _, queries in work])
+            for event, _, _ in work[:done]:
+                if event is not None:
+                    self.prefetcher.record_success(event)
+            if error is None:
+                break
+            logger.debug("Exception while running: %s", error)
+            event, _, queries = work[done]
+            self.fail(event, [key for _, key in queries])
+            work = work[done + 1:]
 
-                    queries = rewriter(event)
-                    if queries == None:
-                        continue
+        elapsed = (time.time() - started) / len(names)
+        for name in names:
+            self.observe(name, elapsed)
 
-                    if type(queries) == str:
-                        queries = (queries, )
-                    for query in queries:
-                        self.db.q("/* prefetching at %d */ %s" %
-                                    (event.pos, query))
 
+class AsyncRunner(Thread):
+    """Single thread multiplexing non-blocking connections, each of them
+       with up to `depth` queries in flight"""
+    def __init__(self, prefetcher, connections, depth):
+        self.prefetcher = prefetcher
+        self.queue = prefetcher.queue
+        self.detect = prefetcher.detect
+        self.depth = depth
+        init_commands = ("SET SESSION wait_timeout=5",
+                         prefetcher.worker_init_connect)
+        self.pool = [nbmysql.Connection(prefetcher.config, init_commands,
+                                        prefetcher.prepared_size)
+                     for _ in range(connections)]
+        # Events for Executors, run from a thread of their own, started on
+        # first use, so that select loop does not wait for them
+        self.executors = None
+        self.reconnect_at = {}
+        Thread.__init__(self)
+        self.daemon = True
+
+    def done(self, command, error):
+        conn, name, key, event, outcome = command.context
+        if command.elapsed is not None:
+            self.prefetcher.record_latency(command.elapsed)
+            query_seconds.observe(command.elapsed, name)
+        if error:
+            logger.debug("Exception while running %s: %s", command.query, error)
+            self.prefetcher.release(key)
+            # Same as Runner, make sure nothing is left open
+            if conn and conn.ready:
+                conn.query("ROLLBACK")
+        if event:
+            outcome[1] -= 1
+            # Event counts as failed once, however many commands fail
+            if error and not outcome[0]:
+                outcome[0] = True
+                self.prefetcher.record_failure(event)
+            elif not outcome[1] and not outcome[0]:
+                self.prefetcher.record_success(event)
+
+    def dispatch(self, event, conn):
+        rewriter = self.detect(event)
+        if rewriter == None:
+            return
+
+        lead_seconds.observe(event.timestamp - self.prefetcher.sql_time)
+        if isinstance(rewriter, Executor):
+            if self.executors is None:
+                self.executors = Queue.Queue(self.depth)
+                thread = Thread(target=self.run_executors)
+                thread.daemon = True
+                thread.start()
+            try:
+                self.executors.put_nowait((event, rewriter))
+            except Queue.Full:
+                self.prefetcher.skip(event, "executor_busy")
+                self.prefetcher.release_event(event)
+            return
+
+        queries = rewrite(rewriter, event)
+        if queries == None:
+            return
+        queries = self.prefetcher.expand(queries)
+        # [failed, commands left], shared by commands of event
+        outcome = [False, len(queries)]
+        for query, key in queries:
+            self.send(conn, query, "/* prefetching at %d */" % event.pos,
+                      (conn, rewriter_name(rewriter), key, event, outcome),
+                      event.db)
+
+    def run_executors(self):
+        """Runs Executors one event at a time, on blocking connection of
+           their own"""
+        try:
+            db = self.prefetcher._connect()
+            while True:
+                event, rewriter = self.executors.get()
+                # They may well change default schema
+                db.schema = None
+                started = time.time()
+                try:
+                    rewriter.run(event, db)
+                    self.prefetcher.record_success(event)
                 except mysql.Error:
                     logger.debug("Exception while running.", exc_info=True)
-                    self.db.q("ROLLBACK")
+                    self.prefetcher.release_event(event)
+                    self.prefetcher.record_failure(event)
+                    db.q("ROLLBACK", discard=True)
+                finally:
+                    elapsed = time.time() - started
+                    self.prefetcher.record_latency(elapsed)
+                    query_seconds.observe(elapsed, rewriter_name(rewriter))
+        except Exception:
+            logger.exception("Exception while running.")
+            sys.stdout.flush()
+            os.kill(os.getpid(), 9)
+
+    def send(self, conn, query, comment, context, schema=None):
+        if isinstance(query, rewriters.Prepared):
+            conn.execute(query, self.done, context, schema, comment)
+        else:
+            conn.query("%s %s" % (comment, query), self.done, context, schema)
+
+    def flush(self):
+        """Sends batched lookups that have waited long enough"""
+        ready = [conn for conn in self.pool[:self.prefetcher.active_runners]
+                 if conn.ready]
+        if not ready:
+            return
+        for query, key in self.prefetcher.flush_lookups():
+            conn = min(ready, key=lambda c: c.in_flight)
+            self.send(conn, query, "/* prefetching batch */",
+                      (conn, "coalesced", key, None, None))
+
+    def fill(self, block):
+        """Hand out queued events to connections with spare depth"""
+        active = self.pool[:self.prefetcher.active_runners]
+        for conn in sorted(active, key=lambda c: c.in_flight):
+            while conn.ready and conn.in_flight < self.depth:
+                try:
+                    event = self.queue.get(block=block, timeout=0.1)
+                except Queue.Empty:
+                    return
+                block = False
+                # Whole transaction goes down the same connection
+                for item in self.prefetcher.split_transaction(event):
+                    self.dispatch(item, conn)
+
+    def run(self):
+        try:
+            while True:
+                now = time.time()
+                for conn in self.pool:
+                    if conn.state == nbmysql.CLOSED and \
+                            self.reconnect_at.get(conn, 0) <= now:
+                        logger.info("Connecting to server at %s",
+                                    self.prefetcher.config)
+                        conn.connect()
+                        self.reconnect_at[conn] = now + 1
+
+                busy = [conn for conn in self.pool if conn.in_flight]
+                # Nothing else to wait for, wait on queue instead
+                self.fill(block=not busy)
+                self.flush()
+
+                live = [conn for conn in self.pool
+                        if conn.state != nbmysql.CLOSED]
+                if not live:
+                    time.sleep(0.1)
+                    continue
+                writers = [conn for conn in live if conn.wants_write()]
+                readable, writable, _ = select.select(live, writers, [], 0.01)
+                for conn in writable:
+                    conn.writable()
+                for conn in readable:
+                    if conn.state != nbmysql.CLOSED:
+                        conn.readable()
         except Exception:
             logger.exception("Exception while running.")
             sys.stdout.flush()
             os.kill(os.getpid(), 9)
 
 
+class WorkerProcess(multiprocessing.Process):
+    """Process with runner threads and connections of its own, fed from
+       shared ring by the parsing process"""
+    def __init__(self, prefetcher, index):
+        self.prefetcher = prefetcher
+        self.index = index
+        self.parent = os.getpid()
+        multiprocessing.Process.__init__(self,
+                                         name="prefetch-worker-%d" % index)
+        self.daemon = True
+
+    def run(self):
+        prefetcher = self.prefetcher
+        status = prefetcher.status
+        if isinstance(prefetcher.queue, Router):
+            # Events routed to this worker
+            prefetcher.queue = prefetcher.queue.queues[self.index]
+        # Counts made by parser process before fork are reported there
+        metrics.registry.take()
+        # Dedup keys of events given up on here go back to parser process,
+        # which claimed them
+        prefetcher.worker_index = self.index
+        prefetcher.setup_rewriters()
+        generation = status[2]
+        for index in range(prefetcher.runners):
+            Runner(prefetcher._connect(), prefetcher, index).start()
+
+        metrics_sent = time.time()
+        while os.getppid() == self.parent:
+            # Parser process tells where SQL thread is, how many runners
+            # may work and when DDL got run, we tell it how long events take
+            prefetcher.sql_time = status[0]
+            prefetcher.active_runners = int(status[1])
+            if status[2] != generation:
+                generation = status[2]
+                prefetcher.schema.invalidate()
+            status[3 + self.index] = prefetcher.runner_latency or 0.0
+            # Parser process serves and logs metrics of all workers
+            if time.time() - metrics_sent >= 1:
+                metrics_sent = time.time()
+                taken = metrics.registry.take()
+                if taken:
+                    prefetcher.metrics_queue.put(taken)
+            time.sleep(0.1)
+        logger.info("Parser process is gone, worker %d exiting", self.index)
+        os._exit(0)
+
+
+class WorkerSupervisor(object):
+    """Process forking worker processes, and forking them again when they
+       die. Parser process forks it before starting any threads, so that
+       workers never inherit locks held by those, or sockets they listen
+       on."""
+    def __init__(self, prefetcher):
+        self.prefetcher = prefetcher
+        self.pid = None
+
+    def start(self):
+        parent = os.getpid()
+        self.pid = os.fork()
+        if self.pid:
+            return
+        try:
+            self.run(parent)
+        except Exception:
+            logger.exception("Exception while supervising workers.")
+        finally:
+            os._exit(0)
+
+    def is_alive(self):
+        return os.waitpid(self.pid, os.WNOHANG)[0] == 0
+
+    def spawn(self, index):
+        worker = WorkerProcess(self.prefetcher, index)
+        worker.start()
+        return worker
+
+    def run(self, parent):
+        workers = [self.spawn(index)
+                   for index in range(self.prefetcher.workers)]
+        while os.getppid() == parent:
+            for index, worker in enumerate(workers):
+                if not worker.is_alive():
+                    logger.error("Worker %d exited with %s, restarting",
+                                 index, worker.exitcode)
+                    workers[index] = self.spawn(index)
+            time.sleep(0.1)
+        logger.info("Parser process is gone, worker supervisor exiting")
+
+
 class Prefetch(object):
     """Main prefetching chassis"""
     def __init__(self, config, runners=4, threshold=1.0, window_start=1, window_stop=240,
                  elapsed_limit=4, logpath="/var/lib/mysql", frequency=10,
-                 strip_comments=False):
+                 strip_comments=False, use_mmap=False, engine="threads",
+                 pipeline_depth=32, adaptive=False, metrics_port=None,
+                 metrics_interval=60, workers=2, ring_size=64,
+                 dedup_size=0, dedup_ttl=60, coalesce_size=1,
+                 coalesce_delay=0.05, group_transactions=False, affinity=None,
+                 prepared_size=0, relay_log_info="relay-log.info",
+                 status_interval=1.0, max_threads_running=0,
+                 max_pending_reads=0, max_latency=0, throttle_interval=1.0,
+                 failure_cache_size=10000, failure_backoff=10, batch_size=1,
+                 verify_checksums=False):
         # The mysql Config object to use for connection
         self.config = config
         # Number of runner threads
@@ -118,64 +568,468 @@ class Prefetch(object):
         self.logpath = logpath
         # How often should checks run (hz)
         self.frequency = frequency
+        # File in logpath SQL thread keeps its position in. Checks run no
+        # more than frequency times a second, sooner rather than later
+        # when it changes, and SHOW SLAVE STATUS is only asked every
+        # status_interval seconds. None polls SHOW SLAVE STATUS every check.
+        self.relay_log_info = relay_log_info
+        self.status_interval = status_interval
         # Should comments be stripped from query inside event
         self.strip_comments = strip_comments
+        # Should relay logs be memory mapped instead of read
+        self.use_mmap = use_mmap
+        # Should CRC32 checksums of relay log events be checked, events
+        # failing the check are skipped
+        self.verify_checksums = verify_checksums
+        # "threads" runs a thread per connection, "async" multiplexes
+        # runners connections from single thread, "processes" runs
+        # runners threads in each of workers processes
+        self.engine = engine
+        # Queries in flight per connection with async engine
+        self.pipeline_depth = pipeline_depth
+        # Events runners of other engines send in single round trip, 1
+        # sends them one by one
+        self.batch_size = batch_size
+        # Worker processes with processes engine
+        self.workers = workers
+        # Shared ring size (MB) events pass through to worker processes
+        self.ring_size = ring_size
+        # Runners (connections for async engine) currently allowed to work
+        self.active_runners = runners
+        # Moving average of time spent running single event, None until
+        # first one is done
+        self.runner_latency = None
+        # Retunes windows and active runners every cycle if set
+        self.controller = adaptive and AdaptiveController() or None
+        # Fewer runners, down to none, while Threads_running, InnoDB
+        # pending reads or runner latency (seconds) are over limits,
+        # checked every throttle_interval seconds. 0 disables a limit.
+        self.throttle = (max_threads_running or max_pending_reads or
+                         max_latency) and \
+            Throttle(max_threads_running, max_pending_reads, max_latency,
+                     throttle_interval) or None
+        # Local port serving metrics over HTTP, if any
+        self.metrics_port = metrics_port
+        # How often (seconds) metrics get logged, 0 disables
+        self.metrics_interval = metrics_interval
+        # Timestamp of event SQL thread is executing
+        self.sql_time = 0
+        # Events queued so far, every 10000th ends the cycle
+        self.cycles_count = 0
+        # Seconds to wait for room in full queue before ending the cycle
+        self.put_timeout = 1
+        # (reason, position, timestamp) of event last pushed back, so that
+        # it is counted once however many cycles it ends
+        self.pushed_back = None
+        # Up to dedup_size recently prefetched rows and statements, not to
+        # be repeated within dedup_ttl seconds. 0 disables.
+        self.dedup = dedup_size and DedupCache(dedup_size, dedup_ttl) or None
+        # Statement shapes failing over and over are not tried for
+        # failure_backoff seconds, longer if they keep failing after
+        self.failures = failure_cache_size and \
+            FailureCache(failure_cache_size, backoff=failure_backoff) or None
+        # Point lookups get batched up to coalesce_size keys, waiting no
+        # longer than coalesce_delay seconds. 1 disables.
+        self.coalescer = coalesce_size > 1 and \
+            Coalescer(coalesce_size, coalesce_delay, prepared_size > 0) or None
+        # Lookups run as prepared statements, each connection keeping up
+        # to prepared_size of them. 0 sends them as plain statements.
+        self.prepared_size = prepared_size
         # Custom rewriters for specific queries
         self.prefixes = [
           # ("INSERT INTO customtable", rewriters.custom_table_rewriter),
         ]
         self.rewriter = rewriters.rollback
+        # Rewriter for row based replication events, primary key lookups
+        # backed by information_schema are used if left as None
+        self.row_rewriter = None
+        # Table definitions for rewriters.SchemaRewriter, made on start
+        self.schema = None
+        # (relay log sequence, position) of DDL SQL thread has yet to run
+        self.schema_changes = collections.deque()
         self.wait_for_replication = True
         self.worker_init_connect = "SET SESSION long_query_time=60"
 
+        # Runs statements of a transaction self.rewriter was chosen for
+        # together, in single round trip. Left as None, the one matching
+        # self.rewriter in rewriters.TRANSACTION_REWRITERS does, if any.
+        self.transaction_rewriter = None
+        # Should events of each transaction be dispatched to single runner
+        self.group_transactions = group_transactions
+        # "db" or "table": with threads engine every runner (worker process
+        # with processes engine) gets queue of its own, events on one db
+        # or table keep going to the same one. Single shared queue if None.
+        self.affinity = affinity
+
+        # Compiled from prefixes, rebuilt whenever they change
+        self.dispatcher = Dispatcher(self.prefixes)
+
         # Better not to override this from outside
         self.queue = None
+        # Processes engine: WorkerSupervisor forking worker processes, and
+        # state shared with them, [SQL thread timestamp, active runners,
+        # DDL count, latency of each worker]
+        self.supervisor = None
+        self.status = None
+        # Processes engine: worker metrics on their way to parser process
+        self.metrics_queue = None
+        # Processes engine: dedup keys of events workers gave up on, on
+        # their way to be released by parser process
+        self.release_queue = None
+        # Set in worker processes to their number
+        self.worker_index = None
+
+    def record_latency(self, elapsed):
+        """Runners report time spent on each event"""
+        if self.runner_latency is None:
+            self.runner_latency = elapsed
+        else:
+            self.runner_latency += 0.05 * (elapsed - self.runner_latency)
 
     def detect(self, event):
         """Return rewriting method for event"""
-        query = strip_initial_comment(event.query).strip()
-        if not query or not any(query.upper().startswith(x)
-                                for x in ("SELECT", "INSERT", "UPDATE", "REPLACE", "DELETE")):
+        rewriter = self.find_rewriter(event)
+        detected.inc(label=rewriter_name(rewriter))
+        if rewriter is not None and self.suppressed(event):
+            return None
+        return rewriter
+
+    def suppressed(self, event):
+        """Has statement shape of event been failing lately"""
+        if not self.failures or not self.failures.entries:
+            return False
+        key = failure_key(event)
+        return key is not None and self.failures.check(key)
+
+    def record_success(self, event):
+        """Ends failure streak of statement shape of event"""
+        if not self.failures or not self.failures.entries:
+            return
+        key = failure_key(event)
+        if key is not None:
+            self.failures.succeeded(key)
+
+    def record_failure(self, event):
+        if self.failures:
+            key = failure_key(event)
+            if key is not None:
+                self.failures.failed(key)
+
+    def find_rewriter(self, event):
+        if event.type == 'rows':
+            return self.row_rewriter
+        if event.type == 'transaction':
+            return self.grouped_rewriter()
+
+        query = event.query
+        start = statement_start(query)
+        if not is_dml(query, start):
             return None
 
         # Allow custom per-prefix rewriter
         if self.prefixes:
             if self.strip_comments:
-                event.query = query
-            for prefix, rewriter in self.prefixes:
-                if isinstance(prefix, str):
-                    if query.startswith(prefix):
-                        return rewriter
-                elif prefix.match(query):
-                    return rewriter
+                event.query = query = query[start:].strip()
+                start = 0
+            dispatcher = self.dispatcher
+            if dispatcher.source != self.prefixes:
+                dispatcher = self.dispatcher = Dispatcher(self.prefixes)
+            rewriter = dispatcher.lookup(query, start)
+            if rewriter is not DEFAULT:
+                return rewriter
 
         return self.rewriter
 
-    def binlog_from_status(self, status):
-        """ Open binlog object based on SHOW SLAVE STATUS """
-        filepath = self.logpath + status["Relay_Log_File"]
-        pos = int(status["Relay_Log_Pos"])
-        binlog = Binlog(filepath)
-        binlog.seek(pos)
-        return binlog
+    def open_binlog(self, filepath):
+        """ Open binlog object of configured kind """
+        if self.use_mmap:
+            return MappedBinlog(filepath, self.verify_checksums)
+        return Binlog(filepath, self.verify_checksums)
 
     def _connect(self):
-        return Slave(self.config, init_connect=self.worker_init_connect)
+        return Slave(self.config, init_connect=self.worker_init_connect,
+                     prepared_size=self.prepared_size)
+
+    def claim(self, key):
+        """Should work for key go ahead, or was it done recently"""
+        return not self.dedup or key is None or self.dedup.claim(key)
+
+    def release(self, key):
+        if self.dedup and key is not None:
+            self.dedup.release(key)
+
+    def skip(self, event, reason):
+        """Event is not queued this cycle. window_stop, queue_full and
+           cycle_cap end the cycle, event is read again on the next one
+           (there is no event for cycle_cap). Returns False if event was
+           counted for reason on an earlier cycle already."""
+        if reason in ("window_stop", "queue_full"):
+            key = (reason, event.pos, event.timestamp)
+            if key == self.pushed_back:
+                return False
+            self.pushed_back = key
+        logger.debug("Skipping, %s", reason)
+        skipped.inc(label=reason)
+        return True
+
+    def admit(self, event):
+        """Is event worth queueing, claims its dedup key if so"""
+        if event.type == 'query' and event.query_length < 10:
+            self.skip(event, "short")
+            return False
+
+        if event.elapsed > self.elapsed_limit:
+            self.skip(event, "elapsed_limit")
+            return False
+
+        if not self.claim(self.dedup and event_key(event)):
+            self.skip(event, "dedup")
+            return False
+        return True
+
+    def release_event(self, event):
+        """Release dedup keys admit() claimed, in parser process which
+           claimed them"""
+        if not self.dedup:
+            return
+        keys = [event_key(item)
+                for item in getattr(event, 'events', (event, ))]
+        if self.worker_index is not None:
+            self.release_queue.put(keys)
+            return
+        for key in keys:
+            self.release(key)
+
+    def release_returned(self):
+        """Release dedup keys worker processes sent back"""
+        while True:
+            try:
+                keys = self.release_queue.get_nowait()
+            except Queue.Empty:
+                return
+            for key in keys:
+                self.release(key)
+
+    def grouped_rewriter(self):
+        """Rewriter for transactions, None if they are not grouped"""
+        return self.transaction_rewriter or \
+            rewriters.TRANSACTION_REWRITERS.get(self.rewriter)
+
+    def split_transaction(self, event):
+        """Returns events to handle one by one in place of event. Statements
+           of transaction that self.rewriter was chosen for stay together
+           if there is transaction_rewriter to run them."""
+        if event.type != 'transaction':
+            return (event, )
+        ret = []
+        together = []
+        grouping = self.rewriter is not None and self.grouped_rewriter()
+        for item in event.events:
+            # All of them run in db of transaction
+            if grouping and item.db == event.db and \
+                    self.find_rewriter(item) is self.rewriter:
+                together.append(item)
+            else:
+                ret.append(item)
+        if len(together) > 1:
+            event.events = together
+            ret.append(event)
+        else:
+            ret.extend(together)
+        return ret
+
+    def expand(self, queries):
+        """Queries to run right away as (query, dedup key) pairs, Lookups
+           go to coalescer and come back from flush_lookups() or along with
+           later ones"""
+        ret = []
+        for query in queries:
+            if not isinstance(query, rewriters.Lookup):
+                key = query_key(query if isinstance(query, str)
+                                else repr(query))
+                if self.claim(key):
+                    ret.append((query, key))
+                continue
+            if self.dedup:
+                query = query._replace(values=tuple(
+                    key for key in query.values
+                    if self.claim(lookup_key(query, key))))
+                if not query.values:
+                    continue
+            if self.coalescer:
+                ret.extend((batch, None) for batch in self.coalescer.add(query))
+            else:
+                ret.append((rewriters.lookup_query(
+                    *query, prepared=self.prepared_size > 0), None))
+        return ret
+
+    def flush_lookups(self):
+        if not self.coalescer:
+            return []
+        return [(query, None) for query in self.coalescer.flush()]
+
+    def setup_rewriters(self):
+        """Hand schema cache to rewriters needing one"""
+        self.schema = SchemaCache(self._connect())
+        if self.row_rewriter is None:
+            self.row_rewriter = rewriters.PrimaryKeyLookup()
+        for rewriter in [self.rewriter, self.row_rewriter] + \
+                [rewriter for _, rewriter in self.prefixes]:
+            if isinstance(rewriter, rewriters.SchemaRewriter) and \
+                    rewriter.schema is None:
+                rewriter.schema = self.schema
+
+    def apply_schema_changes(self, position):
+        """Forget table definitions once SQL thread has run DDL"""
+        changed = False
+        while self.schema_changes and self.schema_changes[0] < position:
+            self.schema_changes.popleft()
+            changed = True
+        if not changed:
+            return
+        logger.info("Schema changed, reloading table definitions")
+        if self.schema:
+            self.schema.invalidate()
+        if self.status:
+            self.status[2] += 1
+
+    def runner_queue(self, index):
+        """Queue runner number index gets events from"""
+        if isinstance(self.queue, Router):
+            return self.queue.queues[index]
+        return self.queue
+
+    def sync_workers(self):
+        """Share state with worker processes"""
+        status = self.status
+        status[0] = self.sql_time
+        status[1] = self.active_runners
+        latencies = [latency for latency in status[3:] if latency]
+        if latencies:
+            self.runner_latency = sum(latencies) / len(latencies)
+        self.release_returned()
+        if not self.supervisor.is_alive():
+            raise EnvironmentError("Worker supervisor exited")
+
+    def fill_window(self, relaylog, sql_time):
+        """Queue events between window_start and window_stop seconds ahead
+           of sql_time, returns timestamp of last one queued, if any"""
+        queued_time = None
+        for event in relaylog:
+            if event.type == 'query' and event_is_ddl(event):
+                self.schema_changes.append(
+                    (sequence(relaylog.filename), event.pos))
+
+            # Skip few entries, leave them for SQL thread
+            if event.timestamp < sql_time + self.window_start:
+                self.skip(event, "window_start")
+                continue
+
+            if event.timestamp > sql_time + self.window_stop:
+                self.skip(event, "window_stop")
+                relaylog.push_back(event)
+                break
+
+            if event.type == 'transaction':
+                event.events = [item for item in event.events
+                                if self.admit(item)]
+                if not event.events:
+                    continue
+            elif not self.admit(event):
+                continue
+
+            try:
+                self.queue.put(event, block=True, timeout=self.put_timeout,
+                               position=(sequence(relaylog.filename),
+                                         event.pos))
+            except Queue.Full:
+                put_timeouts.inc()
+                self.skip(event, "queue_full")
+                self.release_event(event)
+                relaylog.push_back(event)
+                break
+            queued_time = event.timestamp
+            self.cycles_count += 1
+            if not self.cycles_count % 10000:
+                self.skip(None, "cycle_cap")
+                break
+        return queued_time
 
     def prefetch(self):
         """Main service routine to glue everything together"""
         slave = self._connect()
-        prefetched = None
-        cycles_count = 0
+        tracker = PositionTracker(
+            slave, self.relay_log_info and
+            os.path.join(self.logpath, self.relay_log_info),
+            self.status_interval)
+        relaylog = RelayLog(self.logpath, self.open_binlog,
+                            self.group_transactions)
+        # Timestamp of last event we have queued
+        queued_time = 0
+        metrics_logged = time.time()
+
+        if self.engine == "processes":
+            # Workers make their own connections, schema lookups included.
+            # They are forked before slave runs its first query, so none
+            # is shared with them
+            if self.affinity:
+                self.queue = Router(
+                    [Ring((self.ring_size << 20) // self.workers,
+                          self.runners * 4, self.release_event)
+                     for _ in range(self.workers)],
+                    KEYS[self.affinity])
+            else:
+                self.queue = Ring(self.ring_size << 20,
+                                  self.runners * self.workers * 4,
+                                  self.release_event)
+            self.status = multiprocessing.RawArray('d', 3 + self.workers)
+            self.status[1] = self.active_runners
+            self.metrics_queue = multiprocessing.Queue()
+            self.release_queue = multiprocessing.Queue()
+            rings = isinstance(self.queue, Router) and self.queue.queues or \
+                [self.queue]
+            metrics.registry.counter(
+                "prefetch_queue_rejected_total",
+                "Events too large for shared ring",
+                function=lambda: sum(ring.rejected for ring in rings))
+            # Before any thread of ours is started
+            self.supervisor = WorkerSupervisor(self)
+            self.supervisor.start()
+            metrics.registry.collect(self.metrics_queue)
+        elif self.engine == "async":
+            self.setup_rewriters()
+            self.queue = Scheduler(self.runners * self.pipeline_depth,
+                                   self.release_event)
+            AsyncRunner(self, self.runners, self.pipeline_depth).start()
+        else:
+            self.setup_rewriters()
+            if self.affinity:
+                self.queue = Router([Scheduler(4, self.release_event)
+                                     for _ in range(self.runners)],
+                                    KEYS[self.affinity],
+                                    lambda: self.active_runners)
+            else:
+                self.queue = Scheduler(self.runners * 4, self.release_event)
+            for index in range(self.runners):
+                Runner(self._connect(), self, index).start()
 
-        self.queue = Queue.Queue(self.runners * 4)
-        for _ in range(self.runners):
-            Runner(self._connect(), self).start()
+        metrics.registry.counter("binlog_events_total",
+                                 "Events decoded from relay logs",
+                                 function=relaylog.events_read)
+        metrics.registry.gauge("prefetch_queue_depth", "Events waiting for runners",
+                               function=self.queue.qsize)
+        metrics.registry.counter("prefetch_queue_dropped_total",
+                                 "Queued events SQL thread got to first",
+                                 function=lambda: self.queue.dropped)
+        metrics.registry.gauge("prefetch_active_runners", "Runners allowed to work",
+                               function=lambda: self.active_runners)
+        if self.metrics_port:
+            metrics.registry.serve(self.metrics_port)
 
         while True:
             logger.debug("Running prefetch check")
 
-            st = slave.slave_status()
+            st = tracker.status()
             if not st or st['Slave_SQL_Running'] != "Yes":
                 if not self.wait_for_replication:
                     raise EnvironmentError("Replication not running! Bye")
@@ -185,7 +1039,7 @@ class Prefetch(object):
 
             lag = 0
             if st['Seconds_Behind_Master'] is None:
-                slave.sleep(1.0 / self.frequency, "Slave not running")
+                tracker.sleep(1.0 / self.frequency, "Slave not running")
                 continue
 
             # We compensate for negative lag here
@@ -193,58 +1047,53 @@ class Prefetch(object):
 
             if lag <= self.threshold:
                 logger.info("Skipping for now, lag is below threshold")
-                slave.sleep(1.0 / self.frequency,
-                            "Lag (%d) is below threshold (%d)" % \
+                tracker.sleep(1.0 / self.frequency,
+                              "Lag (%d) is below threshold (%d)" % \
                                 (lag, self.threshold))
                 continue
 
-            binlog = self.binlog_from_status(st)
+            relay_file = st["Relay_Log_File"]
+            relay_pos = int(st["Relay_Log_Pos"])
+            # Anything queued behind SQL thread is useless by now
+            self.queue.advance((sequence(relay_file), relay_pos))
+            self.apply_schema_changes((sequence(relay_file), relay_pos))
             # Look at where we are
-            event = binlog.next()
+            event = relaylog.sql_event(relay_file, relay_pos)
 
             # Though this should not happen usually...
             if not event:
-                slave.sleep(1.0 / self.frequency, "Reached the end of binlog")
+                tracker.sleep(1.0 / self.frequency, "Reached the end of binlog")
                 continue
 
-            sql_time = event.timestamp
-
-            # Jump ahead if we have already prefetched on this file
-            if prefetched and prefetched['file'] == binlog.filename and \
-                    prefetched['pos'] > event.pos:
-
-                logger.debug("Jump to %d", prefetched['pos'])
-                binlog.seek(prefetched['pos'])
-
-            # Iterate through the stuff in front
-            for event in binlog:
-                if len(event.query) < 10:
-                    continue
-                # Skip few entries, leave them for SQL thread
-                if event.timestamp < sql_time + self.window_start:
-                    logger.debug("Skipping, too close to SQL thread")
-                    continue
+            sql_time = self.sql_time = event.timestamp
+            if self.throttle:
+                self.throttle.update(self, slave)
+            if self.supervisor:
+                self.sync_workers()
+            if self.throttle and self.throttle.paused:
+                tracker.sleep(1.0 / self.frequency, "Paused, server is busy")
+                continue
 
-                if event.timestamp > sql_time + self.window_stop:
-                    logger.debug("Breaking, too far from SQL thread")
-                    break
+            # Carry on from previous cycle, unless SQL thread passed us
+            relaylog.sync(relay_file, relay_pos)
+            # Whatever we have read before does not need scanning again
+            relaylog.skip_to(sql_time + self.window_start)
 
-                if event.elapsed > self.elapsed_limit:
-                    logger.debug("Skipping, elapsed too long")
-                    continue
+            queued_time = self.fill_window(relaylog, sql_time) or queued_time
 
-                try:
-                    self.queue.put(event, block=True, timeout=1)
-                except Queue.Full:
-                    logger.debug("Queue full, breaking out of binlog")
-                    break
-                cycles_count += 1
-                if not cycles_count % 10000:
-                    break
-
-            logger.info("Currently %d seconds behind, prefetch up to %d", lag, binlog.position)
-            prefetched = {'pos': binlog.position, 'file': binlog.filename}
-            slave.sleep(1.0 / self.frequency, "Got ahead to %d" % binlog.position)
+            logger.info("Currently %d seconds behind, prefetch up to %s:%d, "
+                        "%d stale events dropped", lag, relaylog.filename,
+                        relaylog.position, self.queue.dropped)
+            if self.controller:
+                self.controller.update(self, lag, max(queued_time - sql_time, 0))
+            if self.throttle:
+                self.throttle.limit(self)
+            if self.metrics_interval and \
+                    time.time() - metrics_logged >= self.metrics_interval:
+                metrics_logged = time.time()
+                logger.info("Metrics:\n%s", metrics.registry.summary())
+            tracker.wait(1.0 / self.frequency, "Got ahead to %s:%d" %
+                        (relaylog.filename, relaylog.position))
 
     def run(self):
         try:
@@ -0,0 +1,279 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Long-lived reader of relay logs, keeps files open between prefetch cycles
+and carries on into the next relay log once the current one is finished.
+"""
+
+from array import array
+from bisect import bisect_left
+import logging
+import os
+
+from myprefetch.binlog import Binlog, Transaction, begins_transaction, \
+    ends_transaction
+
+logger = logging.getLogger(__name__)
+
+
+def sequence(filename):
+    """Numeric suffix of log file name, orders files of one log"""
+    try:
+        return int(filename.rsplit('.', 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+class TimeIndex(object):
+    """Maps event timestamps to offsets within one relay log, built by
+       Binlog.scan() ahead of the reader. Covers single contiguous range,
+       keeping running maximum of timestamps - everything before an offset
+       returned by find() is older than asked for."""
+    def __init__(self, start):
+        self.timestamps = array('L')
+        self.positions = array('L')
+        self.start = start
+        self.end = start
+
+    def extend(self, groups, end):
+        """Record (timestamp, position) of event groups found past the
+           covered range, which now reaches end"""
+        for timestamp, position in groups:
+            if not self.timestamps or timestamp > self.timestamps[-1]:
+                self.timestamps.append(timestamp)
+                self.positions.append(position)
+        self.end = max(self.end, end)
+
+    def covers(self, position):
+        return self.start <= position <= self.end
+
+    def find(self, timestamp):
+        """Offset of first event at least timestamp old, end of covered
+           range if all are older"""
+        i = bisect_left(self.timestamps, timestamp)
+        if i < len(self.positions):
+            return self.positions[i]
+        return self.end
+
+
+class RelayLog(object):
+    """Follows relay logs from SQL thread position onwards"""
+    def __init__(self, logpath, open_binlog=Binlog, group_transactions=True,
+                 max_transaction_events=100):
+        self.logpath = logpath
+        # Callable returning Binlog object for file path
+        self.open_binlog = open_binlog
+        # Hand out events of each transaction as single Transaction,
+        # events past max_transaction_events of it come one by one
+        self.group_transactions = group_transactions
+        self.max_transaction_events = max_transaction_events
+        # Reader we prefetch from, stays open across cycles
+        self.binlog = None
+        # Reader used to look at SQL thread position
+        self.sql_binlog = None
+        # Event read but not consumed yet
+        self.pending = None
+        # TimeIndex objects by file name
+        self.indexes = {}
+        # Events decoded by readers we have closed already
+        self.closed_events_read = 0
+
+    @property
+    def filename(self):
+        return self.binlog and os.path.basename(self.binlog.filename)
+
+    @property
+    def position(self):
+        if self.pending:
+            return self.pending.pos
+        return self.binlog and self.binlog.position
+
+    def path(self, filename):
+        return os.path.join(self.logpath, os.path.basename(filename))
+
+    def sql_event(self, filename, pos):
+        """Returns event SQL thread is about to execute"""
+        path = self.path(filename)
+        if not self.sql_binlog or self.sql_binlog.filename != path:
+            if self.sql_binlog:
+                self.sql_binlog.close()
+            self.sql_binlog = self.open_binlog(path)
+        self.sql_binlog.seek(pos)
+        return self.sql_binlog.next()
+
+    def sync(self, filename, pos):
+        """Make sure we are not reading behind SQL thread position"""
+        filename = os.path.basename(filename)
+        # Nobody will look at files SQL thread is done with
+        for name in self.indexes.keys():
+            if sequence(name) < sequence(filename):
+                del self.indexes[name]
+
+        if self.binlog:
+            ours = (sequence(self.filename), self.position)
+            if ours >= (sequence(filename), pos):
+                return
+            logger.debug("Fell behind SQL thread, jump to %s:%d",
+                         filename, pos)
+        if filename != self.filename:
+            self.open(filename)
+        self.seek(pos)
+
+    def seek(self, pos):
+        """Reposition within current file, keeping index contiguous"""
+        self.pending = None
+        self.binlog.seek(pos)
+        index = self.indexes.get(self.filename)
+        if not index or not index.covers(pos):
+            self.indexes[self.filename] = TimeIndex(pos)
+
+    def skip_to(self, timestamp):
+        """Jump over events older than timestamp, finding where they end
+           from event headers instead of decoding them"""
+        position = self.position
+        index = self.indexes.get(self.filename)
+        if not index or not index.covers(position):
+            index = self.indexes[self.filename] = TimeIndex(position)
+        if index.find(timestamp) >= index.end:
+            # All of it is older, see what lies beyond
+            groups, end = self.binlog.scan(index.end, timestamp)
+            index.extend(groups, end)
+        pos = index.find(timestamp)
+        if pos > position:
+            logger.debug("Index jump to %s:%d", self.filename, pos)
+            self.seek(pos)
+
+    def events_read(self):
+        """Number of events decoded while following"""
+        if self.binlog:
+            return self.closed_events_read + self.binlog.events_read
+        return self.closed_events_read
+
+    def open(self, filename):
+        if self.binlog:
+            self.closed_events_read += self.binlog.events_read
+            self.binlog.close()
+        self.binlog = self.open_binlog(self.path(filename))
+        self.pending = None
+        index = self.indexes.get(filename)
+        if not index or not index.covers(self.binlog.position):
+            self.indexes[filename] = TimeIndex(self.binlog.position)
+
+    def push_back(self, event):
+        """Event will be returned again by next events() call"""
+        self.pending = event
+
+    def next_file(self):
+        """Returns name of relay log following the current one,
+           if it exists already"""
+        base = self.filename.rsplit('.', 1)[0]
+        rotate_to = self.binlog.rotate_to
+        # Rotate events from master name master logs, not ours
+        if rotate_to and os.path.basename(rotate_to).startswith(base + '.'):
+            if os.path.exists(self.path(rotate_to)):
+                return os.path.basename(rotate_to)
+
+        try:
+            index = open(self.path(base + '.index'))
+        except IOError:
+            return None
+        with index:
+            names = [os.path.basename(line.strip()) for line in index]
+        try:
+            return names[names.index(self.filename) + 1]
+        except (ValueError, IndexError):
+            return None
+
+    def events(self):
+        """Iterator over events in front of us, crossing file boundaries"""
+        # Transaction being collected, and where its BEGIN starts
+        transaction = None
+        start = None
+        while True:
+            if self.pending:
+                event, self.pending = self.pending, None
+                yield event
+                continue
+
+            event = self.binlog.read_event()
+            if event == False:
+                continue
+            elif event == None:
+                # Relay log is complete once next one shows up
+                next_file = self.next_file()
+                if transaction and not next_file:
+                    # Rest of it is not written yet, read it again next time
+                    self.seek(start)
+                    return
+                elif transaction:
+                    # Relay log rotated in the middle, go with what we have
+                    event = self.finish(transaction)
+                    transaction = None
+                    if event:
+                        yield event
+                if not next_file:
+                    return
+                logger.debug("Moving on to %s", next_file)
+                self.open(next_file)
+                continue
+
+            if not self.group_transactions:
+                if event.type == 'xid':
+                    continue
+            elif begins_transaction(event):
+                if transaction:
+                    # Previous one never ended, go with what we have. BEGIN
+                    # gets read again after it, in case we stop there.
+                    previous = self.finish(transaction)
+                    transaction = None
+                    self.seek(self.binlog.event_start)
+                    if previous:
+                        yield previous
+                    continue
+                transaction = Transaction(event)
+                start = self.binlog.event_start
+                continue
+            elif ends_transaction(event):
+                if transaction:
+                    event = self.finish(transaction)
+                    transaction = None
+                    if event:
+                        yield event
+                # Otherwise we started in the middle of transaction
+                continue
+            elif transaction:
+                transaction.events.append(event)
+                if len(transaction.events) >= self.max_transaction_events:
+                    event = self.finish(transaction)
+                    transaction = None
+                    yield event
+                continue
+
+            yield event
+
+    def finish(self, transaction):
+        """Returns what to hand out for collected transaction: itself, its
+           only event or None if it had none"""
+        if not transaction.events:
+            return None
+        if len(transaction.events) == 1:
+            return transaction.events[0]
+        return transaction
+
+    def __iter__(self):
+        return self.events()
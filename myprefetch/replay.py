@@ -0,0 +1,402 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Offline run of the prefetch loop over recorded relay logs and a trace of
+SQL thread positions, on a clock of its own. Window logic, detect and
+rewriters run as they would on a replica, but no queries are sent, and
+the report tells what would have been prefetched, how far ahead of the
+SQL thread, and what was skipped for which reason.
+"""
+
+import argparse
+from bisect import bisect_left, bisect_right
+import glob
+import logging
+import os
+import Queue
+import sys
+
+from myprefetch import readahead, rewriters, synthetic
+from myprefetch.mysql import Config
+from myprefetch.relaylog import RelayLog, sequence
+from myprefetch.routing import KEYS, Router
+from myprefetch.scheduler import Scheduler
+
+logger = logging.getLogger(__name__)
+
+# Final outcome of events that were queued but never handled
+STALE = "stale"
+
+
+def relay_logs(logpath):
+    """Names of relay logs listed in index file of logpath"""
+    indexes = sorted(glob.glob(os.path.join(logpath, "*.index")))
+    if not indexes:
+        return []
+    with open(indexes[0]) as index:
+        names = [os.path.basename(line.strip()) for line in index]
+    return [name for name in names
+            if name and os.path.exists(os.path.join(logpath, name))]
+
+
+class Clock(object):
+    """Simulated time, seconds since start of trace"""
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class Trace(object):
+    """SQL thread positions over time, from (seconds, relay log file,
+       position) samples"""
+    def __init__(self, samples):
+        samples = sorted(samples)
+        start = samples and samples[0][0] or 0
+        self.times = [seconds - start for seconds, _, _ in samples]
+        self.names = [name for _, name, _ in samples]
+        self.positions = [(sequence(name), pos) for _, name, pos in samples]
+        self.duration = self.times and self.times[-1] or 0
+
+    @classmethod
+    def load(cls, path):
+        """Reads "seconds relay-log-file position" lines, as made by
+           sampling relay-log.info or SHOW SLAVE STATUS"""
+        samples = []
+        with open(path) as trace:
+            for line in trace:
+                fields = line.split()
+                if not fields or fields[0].startswith("#"):
+                    continue
+                samples.append((float(fields[0]), os.path.basename(fields[1]),
+                                int(fields[2])))
+        return cls(samples)
+
+    @classmethod
+    def synthetic(cls, directory, names, apply_rate):
+        """SQL thread applying apply_rate transactions a second, as
+           synthetic.FakeServer does"""
+        server = synthetic.FakeServer(directory, names, apply_rate)
+        return cls([(float(index) / apply_rate, name, pos)
+                    for index, (name, pos, _) in enumerate(server.positions)])
+
+    def position(self, seconds):
+        """(relay log file, position) of SQL thread at seconds"""
+        index = max(bisect_right(self.times, seconds) - 1, 0)
+        return self.names[index], self.positions[index][1]
+
+    def reached(self, position):
+        """Seconds SQL thread got to (sequence, position) at, None if it
+           did not within trace"""
+        index = bisect_left(self.positions, position)
+        if index >= len(self.times):
+            return None
+        return self.times[index]
+
+
+class ReplayScheduler(Scheduler):
+    """Scheduler telling replay which events got queued"""
+    def __init__(self, maxsize, queued, on_drop=None):
+        Scheduler.__init__(self, maxsize, on_drop)
+        self.queued = queued
+
+    def put(self, item, block=True, timeout=None, position=None):
+        Scheduler.put(self, item, block, timeout, position)
+        self.queued(item)
+
+
+class ReplayRunner(object):
+    """Runner taking latency seconds of simulated time per query, which
+       rewrites events but does not run what it gets"""
+    def __init__(self, prefetcher, index):
+        self.prefetcher = prefetcher
+        self.queue = prefetcher.runner_queue(index)
+        self.index = index
+        # Simulated time runner is done with what it had
+        self.busy_until = 0.0
+
+    def work(self, now, until):
+        """Take events from queue until simulated time until"""
+        prefetcher = self.prefetcher
+        self.busy_until = max(self.busy_until, now)
+        while self.busy_until < until and \
+                self.index < prefetcher.active_runners:
+            try:
+                event = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            filename = prefetcher.files.pop(id(event))
+            queries = 0
+            for item in prefetcher.split_transaction(event):
+                queries += prefetcher.dry_run(item, filename, self.busy_until)
+            queries += len(prefetcher.flush_lookups())
+            self.busy_until += queries * prefetcher.latency
+
+
+class ReplayPrefetch(readahead.Prefetch):
+    """Prefetch following trace instead of replica. Table definitions
+       are not available, row events get lookups only where table map
+       metadata tells primary key."""
+    def __init__(self, trace, latency=0.001, **kwargs):
+        readahead.Prefetch.__init__(self, Config("localhost", 0, "", ""),
+                                    metrics_interval=0, **kwargs)
+        self.trace = trace
+        # Simulated seconds each rewritten query would take
+        self.latency = latency
+        self.clock = Clock()
+        if self.dedup:
+            self.dedup.clock = self.clock.time
+        if self.coalescer:
+            self.coalescer.clock = self.clock.time
+        self.row_rewriter = rewriters.PrimaryKeyLookup()
+        # Full queue gives up right away, time does not pass in between
+        self.put_timeout = 0
+        self.relaylog = None
+        # id() of queued event -> relay log file it came from
+        self.files = {}
+        # Reason -> times it came up
+        self.skips = {}
+        # (relay log file, position) -> what last happened to event
+        self.outcomes = {}
+        # (relay log file, position, rewriter, queries, relay log seconds
+        #  ahead, wall seconds ahead or None) of every event handled
+        self.prefetched = []
+        self.queries = 0
+
+    def _connect(self):
+        raise EnvironmentError("Replay does not connect to MySQL")
+
+    def skip(self, event, reason):
+        if not readahead.Prefetch.skip(self, event, reason):
+            return False
+        self.skips[reason] = self.skips.get(reason, 0) + 1
+        if event is not None:
+            self.outcomes[(self.relaylog.filename, event.pos)] = reason
+        return True
+
+    def queued(self, event):
+        filename = self.files[id(event)] = self.relaylog.filename
+        for item in getattr(event, 'events', (event, )):
+            self.outcomes[(filename, item.pos)] = STALE
+
+    def dry_run(self, event, filename, now):
+        """Handle event from relay log filename like Runner.handle would at
+           simulated time now, returns number of queries it would run"""
+        rewriter = self.detect(event)
+        queries = None
+        if rewriter is None:
+            outcome = "no_rewriter"
+        elif isinstance(rewriter, readahead.Executor):
+            # They run statements of their own, nothing to go by offline
+            outcome = "executor"
+        else:
+            queries = readahead.rewrite(rewriter, event)
+            if queries is None:
+                outcome = "not_rewritten"
+            else:
+                queries = self.expand(queries)
+                outcome = "prefetched"
+        count = queries and len(queries) or 0
+        for item in getattr(event, 'events', (event, )):
+            self.outcomes[(filename, item.pos)] = outcome
+        if queries is None:
+            return 0
+
+        lead = event.timestamp - self.sql_time
+        reached = self.trace.reached((sequence(filename), event.pos))
+        wall_lead = None if reached is None else reached - now
+        readahead.lead_seconds.observe(lead)
+        self.prefetched.append((filename, event.pos,
+                                readahead.rewriter_name(rewriter), count,
+                                lead, wall_lead))
+        self.queries += count
+        return count
+
+    def replay(self, duration=None):
+        """Runs prefetch loop over trace, or its first duration seconds"""
+        self.relaylog = relaylog = RelayLog(self.logpath, self.open_binlog,
+                                            self.group_transactions)
+        if self.affinity:
+            self.queue = Router([ReplayScheduler(4, self.queued,
+                                                 self.release_event)
+                                 for _ in range(self.runners)],
+                                KEYS[self.affinity],
+                                lambda: self.active_runners)
+        else:
+            self.queue = ReplayScheduler(self.runners * 4, self.queued,
+                                         self.release_event)
+        runners = [ReplayRunner(self, index) for index in range(self.runners)]
+
+        interval = 1.0 / self.frequency
+        end = self.trace.duration
+        if duration is not None:
+            end = min(end, duration)
+        clock = self.clock
+        while clock.now <= end:
+            relay_file, relay_pos = self.trace.position(clock.now)
+            self.queue.advance((sequence(relay_file), relay_pos))
+            self.apply_schema_changes((sequence(relay_file), relay_pos))
+            event = relaylog.sql_event(relay_file, relay_pos)
+            if event:
+                self.sql_time = event.timestamp
+                relaylog.sync(relay_file, relay_pos)
+                relaylog.skip_to(self.sql_time + self.window_start)
+                self.fill_window(relaylog, self.sql_time)
+            for runner in runners:
+                runner.work(clock.now, clock.now + interval)
+            clock.now += interval
+        return end
+
+
+def quantiles(values, points=(0.5, 0.9, 0.99)):
+    values = sorted(values)
+    if not values:
+        return [None] * len(points)
+    return [values[min(int(point * len(values)), len(values) - 1)]
+            for point in points]
+
+
+def report(prefetch, duration, out=sys.stdout):
+    outcomes = {}
+    for outcome in prefetch.outcomes.values():
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    print >> out, "Replayed %.1f seconds of SQL thread, %d events seen" % (
+        duration, len(prefetch.outcomes))
+    print >> out, "Prefetched %d events (%d statements) with %d queries" % (
+        len(prefetch.prefetched), outcomes.get("prefetched", 0),
+        prefetch.queries)
+
+    print >> out, "\nSeconds ahead of SQL thread   p50      p90      p99"
+    for title, column in (("relay log time:", 4), ("wall time:", 5)):
+        values = [entry[column] for entry in prefetch.prefetched
+                  if entry[column] is not None]
+        print >> out, "  %-26s %s" % (title, "  ".join(
+            "%7s" % ("-" if value is None else "%.2f" % value)
+            for value in quantiles(values)))
+
+    print >> out, "\nLast outcome of each event:"
+    for outcome, count in sorted(outcomes.items(), key=lambda item: -item[1]):
+        print >> out, "  %-16s %8d" % (outcome, count)
+    print >> out, "\nTimes skipped, by reason:"
+    for reason, count in sorted(prefetch.skips.items(),
+                                key=lambda item: -item[1]):
+        print >> out, "  %-16s %8d" % (reason, count)
+
+
+def write_events(prefetch, path):
+    """Tab separated listing of every event seen and what became of it"""
+    handled = dict(((entry[0], entry[1]), entry) for entry in
+                   prefetch.prefetched)
+    with open(path, "w") as out:
+        out.write("file\tposition\toutcome\trewriter\tqueries\tlead\t"
+                  "wall_lead\n")
+        for (name, pos), outcome in sorted(
+                prefetch.outcomes.items(),
+                key=lambda item: (sequence(item[0][0]), item[0][1])):
+            entry = handled.get((name, pos))
+            if entry:
+                out.write("%s\t%d\t%s\t%s\t%d\t%.3f\t%s\n" % (
+                    name, pos, outcome, entry[2], entry[3], entry[4],
+                    "" if entry[5] is None else "%.3f" % entry[5]))
+            else:
+                out.write("%s\t%d\t%s\t\t\t\t\n" % (name, pos, outcome))
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="""
+Replays prefetching over recorded relay logs and a trace of SQL thread
+positions without a MySQL server, reporting what would have been prefetched,
+how far ahead of SQL thread, and what was skipped why.""".strip(),
+                                     fromfile_prefix_chars='@',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('logpath', help='Directory with relay logs and their index')
+    parser.add_argument('--trace', default=None,
+                        help='File of "seconds relay-log-file position" lines, '
+                             'SQL thread applies --apply_rate transactions a '
+                             'second from first relay log if not given')
+    parser.add_argument('--apply_rate', default=1000, type=int,
+                        help='Transactions a second simulated SQL thread applies')
+    parser.add_argument('--duration', default=None, type=float,
+                        help='Replay only this many seconds of trace')
+    parser.add_argument('--latency', default=0.001, type=float,
+                        help='Seconds each prefetch query is taken to run')
+    parser.add_argument('--runners', default=4, type=int,
+                        help='Number of statement runners')
+    parser.add_argument('--frequency', default=10, type=int,
+                        help='Prefetch checks a second')
+    parser.add_argument('--window_start', default=1, type=int,
+                        help='Prefetch window start (seconds)')
+    parser.add_argument('--window_stop', default=240, type=int,
+                        help='Prefetch window stop (seconds)')
+    parser.add_argument('--elapsed_limit', default=4, type=int,
+                        help='Statements that took longer on master are not prefetched')
+    parser.add_argument('--rewriter', default='rollback',
+                        choices=('rollback', 'fake_update'),
+                        help='Rewriter statements are given to')
+    parser.add_argument('--dedup_size', default=0, type=int,
+                        help='Statements and rows remembered as recently prefetched, '
+                             'not to be prefetched again (100000 is a good start), '
+                             '0 disables deduplication')
+    parser.add_argument('--dedup_ttl', default=60, type=int,
+                        help='Seconds a prefetched statement or row is not prefetched again')
+    parser.add_argument('--coalesce_size', default=1, type=int,
+                        help='Keys batched into single lookup statement (100 is a '
+                             'good start), 1 disables batching')
+    parser.add_argument('--coalesce_delay', default=0.05, type=float,
+                        help='Seconds lookups may wait for others to batch with')
+    parser.add_argument('--affinity', default=None, choices=('db', 'table'),
+                        help='Route events to runners by db or table')
+    parser.add_argument('--group_transactions', action='store_true',
+                        help='Dispatch whole transactions to single runner instead '
+                             'of statements one by one')
+    parser.add_argument('--use_mmap', action='store_true',
+                        help='Memory map relay logs instead of reading them')
+    parser.add_argument('--verify_checksums', action='store_true',
+                        help='Check CRC32 checksums of relay log events')
+    parser.add_argument('--events_file', default=None,
+                        help='Write outcome of every event seen to this file')
+    args = vars(parser.parse_args())
+
+    logpath = args['logpath']
+    if not os.path.isdir(logpath):
+        raise Exception("%s is not a valid directory" % (logpath,))
+    trace_path = args.pop('trace')
+    apply_rate = args.pop('apply_rate')
+    if trace_path:
+        trace = Trace.load(trace_path)
+    else:
+        trace = Trace.synthetic(logpath, relay_logs(logpath), apply_rate)
+    if not trace.times:
+        raise Exception("No SQL thread positions to replay")
+
+    duration = args.pop('duration')
+    events_file = args.pop('events_file')
+    rewriter = args.pop('rewriter')
+    prefetch = ReplayPrefetch(trace, **args)
+    if rewriter == 'fake_update':
+        prefetch.rewriter = rewriters.fake_update
+
+    report(prefetch, prefetch.replay(duration))
+    if events_file:
+        write_events(prefetch, events_file)
+
+if __name__ == "__main__":
+    main()
@@ -18,15 +18,93 @@
 
 """
 Methods turn binlog events into preheating activities
-all of them can return a string query, list of strings or None
+all of them can return a string query, list of strings or None.
+Lookup tuples can be returned in place of strings, runners batch
+lookups on same index from many events into single statement.
+Prepared tuples run as server side prepared statements.
 """
 
-def rollback(event):
-    """ Default method which executes statements with a rollback at the end """
-    query = ""
-    if event.db:
-        query += "USE %s;" % event.db
+import collections
+from decimal import Decimal
+import itertools
+import re
+
+from myprefetch import statements
+from myprefetch.rows import UnixTime, unsigned
+
+_escapes = {
+    "\0": "\\0", "\n": "\\n", "\r": "\\r", "\032": "\\Z",
+    "'": "\\'", '"': '\\"', "\\": "\\\\",
+}
+_escape_re = re.compile("[%s]" % re.escape("".join(_escapes)))
+
+def quote(value):
+    """ Format python value as SQL literal """
+    if value is None:
+        return "NULL"
+    elif isinstance(value, UnixTime):
+        return "FROM_UNIXTIME(%r)" % float(value)
+    elif isinstance(value, (int, long, Decimal)):
+        return str(value)
+    elif isinstance(value, float):
+        return repr(value)
+    return "'%s'" % _escape_re.sub(lambda m: _escapes[m.group()], value)
+
+def quote_name(name):
+    """ Format identifier for SQL """
+    return "`%s`" % name.replace("`", "``")
+
+# Point lookups of rows by key. values is a tuple of keys, each of them
+# a tuple of SQL literals (as returned by quote()) matching columns
+Lookup = collections.namedtuple('Lookup',
+                                ['db', 'table', 'columns', 'values', 'index'])
+
+# Statement to run as server side prepared statement, shape has ? in place
+# of each of params, which are SQL literals (as returned by quote())
+Prepared = collections.namedtuple('Prepared', ['shape', 'params'])
+
+_placeholder_re = re.compile(r"`(?:[^`]|``)*`|\?")
+
+def inline(prepared):
+    """ Prepared as plain statement, params in place of placeholders """
+    params = iter(prepared.params)
+    return _placeholder_re.sub(
+        lambda m: m.group() == "?" and next(params) or m.group(),
+        prepared.shape)
 
+def lookup_query(db, table, columns, values, index=None, prepared=False):
+    """ SELECT touching rows with any of the given keys, Prepared with keys
+        as params if prepared """
+    table = "%s.%s" % (quote_name(db), quote_name(table))
+    if index:
+        table += " FORCE INDEX (%s)" % quote_name(index)
+    params = ()
+    if prepared:
+        # Padding key list to power of two by repeating last key keeps
+        # number of distinct shapes low
+        size = 1
+        while size < len(values):
+            size <<= 1
+        values = list(values) + [values[-1]] * (size - len(values))
+        params = tuple(literal for key in values for literal in key)
+        values = [("?", ) * len(columns)] * size
+    names = [quote_name(name) for name in columns]
+    if len(names) == 1:
+        condition = "%s IN (%s)" % (names[0],
+                                    ",".join(key[0] for key in values))
+    else:
+        condition = " OR ".join(
+            "(%s)" % " AND ".join("%s=%s" % pair for pair in zip(names, key))
+            for key in values)
+    query = "SELECT 1 FROM %s WHERE %s" % (table, condition)
+    if prepared:
+        return Prepared(query, params)
+    return query
+
+def replay(event):
+    """ Statement as SQL thread will run it, with its insert ids. Runners
+        run it in event.db. """
+    query = ""
     if event.insert_id != None:
         query += "SET INSERT_ID=%d; " % event.insert_id
     if event.last_insert_id != None:
@@ -34,21 +112,201 @@ def rollback(event):
 
     query += "/* pos:%d */ " % event.pos
     query += event.query
-    return "ROLLBACK; BEGIN; %s; ROLLBACK" % query
+    return query
+
+def rollback(event):
+    """ Default method which executes statements with a rollback at the end """
+    return "ROLLBACK; BEGIN; %s; ROLLBACK" % replay(event)
+
+def rollback_transaction(transaction):
+    """ Executes all statements of a binlog.Transaction with single rollback
+        at the end, later statements see what earlier ones did """
+    return "ROLLBACK; BEGIN; %s; ROLLBACK" % "; ".join(
+        replay(event) for event in transaction.events)
 
 def fake_update(event):
     """ Execute queries, assuming that server won't do anything,
         needs fake updates support in server """
-    query = ""
-    if event.db:
-        query += "USE %s;" % event.db
+    return replay(event)
 
-    if event.insert_id != None:
-        query += "SET INSERT_ID=%d; " % event.insert_id
-    if event.last_insert_id != None:
-        query += "SET LAST_INSERT_ID=%d; " % event.last_insert_id
+def fake_update_transaction(transaction):
+    """ fake_update for all statements of a binlog.Transaction at once """
+    return "; ".join(replay(event) for event in transaction.events)
 
-    query += "/* pos:%d */ " % event.pos
-    query += event.query
-    return query
+# Transaction rewriters running statements the way the rewriter does
+TRANSACTION_REWRITERS = {
+    rollback: rollback_transaction,
+    fake_update: fake_update_transaction,
+}
+
+
+class SchemaRewriter(object):
+    """ Rewriter needing table definitions from a schema.SchemaCache,
+        Prefetch hands its own to rewriters created without one """
+    schema = None
+
+class PrimaryKeyLookup(SchemaRewriter):
+    """ Turn row events into point lookups on primary key of affected rows,
+        key columns come from table map metadata or a schema.SchemaCache """
+    def __init__(self, schema=None):
+        self.schema = schema
+
+    def key_columns(self, event):
+        table_map = event.table_map
+        if table_map.primary_key and table_map.column_names:
+            unsigned_columns = table_map.unsigned or ()
+            return [(column, table_map.column_names[column],
+                     column in unsigned_columns)
+                    for column in table_map.primary_key]
+        if self.schema:
+            return self.schema.primary_key(event.db, event.table)
+        return None
+
+    def row_key(self, row, columns, column_types):
+        """Quoted key values of row, None if image lacks any of them"""
+        key = []
+        for column, name, is_unsigned in columns:
+            if column >= len(row) or row[column] is None:
+                # Minimal row images do not carry unchanged keys
+                return None
+            value = row[column]
+            if is_unsigned:
+                value = unsigned(value, column_types[column])
+            key.append(quote(value))
+        return tuple(key)
+
+    def __call__(self, event):
+        columns = self.key_columns(event)
+        if not columns:
+            return None
+
+        column_types = event.table_map.column_types
+        row_keys = [self.row_key(row, columns, column_types)
+                    for row in event.rows]
+        if event.action == 'update':
+            # Before images locate the rows, after images add anything only
+            # when the key itself was changed
+            befores, afters = row_keys[::2], row_keys[1::2]
+            row_keys = befores + [after for before, after
+                                  in zip(befores, afters) if after != before]
+        keys = []
+        seen = set()
+        for key in row_keys:
+            if key is not None and key not in seen:
+                seen.add(key)
+                keys.append(key)
+
+        if not keys:
+            return None
+
+        return Lookup(event.db, event.table,
+                      tuple(name for _, name, _ in columns), tuple(keys), None)
+
+class IndexLookup(SchemaRewriter):
+    """ Turn simple single table UPDATE, DELETE and INSERT statements into
+        read-only lookups on primary key and every secondary index they
+        modify, instead of executing them """
+    # Most keys made of combinations of IN lists in WHERE clause
+    max_keys = 100
+
+    def __init__(self, schema=None):
+        self.schema = schema
+
+    def __call__(self, event):
+        if not self.schema:
+            return None
+        statement = statements.parse(event.query)
+        if statement is None:
+            return None
+        db = statement.db or event.db
+        if not db:
+            return None
+        table = self.schema.table(db, statement.table)
+        if not table:
+            return None
+        if statement.kind == "insert":
+            return self.insert_lookups(db, statement, table)
+        return self.write_lookups(db, statement, table)
+
+    def lookup(self, db, statement, index, columns, values):
+        """ Lookup on all index columns, None unless every one of them has
+            known values, or if there are too many keys. Leading columns
+            alone would make it a range scan. """
+        if not all(column in values for column in columns):
+            return None
+        keys = tuple(itertools.islice(
+            itertools.product(*[values[column] for column in columns]),
+            self.max_keys + 1))
+        if len(keys) > self.max_keys:
+            return None
+        return Lookup(db, statement.table, tuple(columns), keys,
+                      index != "PRIMARY" and index or None)
+
+    def insert_lookups(self, db, statement, table):
+        """ Every index gets new entries, unique ones are checked first.
+            Indexes are only looked up when all their columns are known. """
+        columns = statement.columns or table.columns
+        if any(len(row) != len(columns) for row in statement.rows):
+            return None
+        ret = []
+        for index, index_columns in table.indexes.items():
+            if not all(column in columns for column in index_columns):
+                continue
+            positions = [columns.index(column) for column in index_columns]
+            # Auto increment NULLs, DEFAULT and expressions are unknown
+            if not all(statements.is_literal(row[position])
+                       for row in statement.rows for position in positions):
+                continue
+            keys = []
+            for row in statement.rows:
+                key = tuple(row[position] for position in positions)
+                if key not in keys:
+                    keys.append(key)
+            ret.append(Lookup(db, statement.table, tuple(index_columns),
+                              tuple(keys),
+                              index != "PRIMARY" and index or None))
+        return ret or None
+
+    def write_lookups(self, db, statement, table):
+        """ Rows found by WHERE clause, and entries of each secondary index
+            holding modified columns, for both old and new values """
+        name = "%s.%s" % (quote_name(db), quote_name(statement.table))
+        equalities = statement.equalities
+        # Known column values after update
+        updated = dict(equalities)
+        for column, value in statement.assignments.items():
+            if statements.is_literal(value):
+                updated[column] = (value.strip(), )
+            else:
+                updated.pop(column, None)
 
+        ret = []
+        primary = table.indexes.get("PRIMARY")
+        lookup = primary and self.lookup(db, statement, "PRIMARY", primary,
+                                         equalities)
+        ret.append(lookup or "SELECT 1 FROM %s WHERE %s" %
+                   (name, statement.where))
+        for index, columns in table.indexes.items():
+            if index == "PRIMARY":
+                continue
+            if statement.kind == "update" and \
+                    not set(columns) & set(statement.assignments):
+                continue
+            old = self.lookup(db, statement, index, columns, equalities)
+            if not old:
+                # Null-safe comparisons, so that NULL entries get read too
+                names = ", ".join(quote_name(column) for column in columns)
+                matches = " AND ".join(
+                    "old.%s <=> cur.%s" % (quote_name(column),
+                                           quote_name(column))
+                    for column in columns)
+                old = "SELECT 1 FROM (SELECT %s FROM %s WHERE %s) AS old " \
+                      "JOIN %s AS cur FORCE INDEX (%s) ON %s" % (
+                          names, name, statement.where, name,
+                          quote_name(index), matches)
+            ret.append(old)
+            if statement.kind == "update":
+                new = self.lookup(db, statement, index, columns, updated)
+                if new and new != old:
+                    ret.append(new)
+        return ret
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Bounded queue of event records in anonymous shared memory, so that relay
+log parsing and statement runners can live in separate processes.
+"""
+
+import cPickle
+import logging
+import marshal
+import mmap
+import multiprocessing
+import Queue
+import struct
+
+from myprefetch.binlog import Event
+from myprefetch.scheduler import wait_for
+
+logger = logging.getLogger(__name__)
+
+# Record header: length including header, relay log sequence, position, kind
+RECORD = struct.Struct("<IiQB")
+# Length of record header telling readers to continue from buffer start
+WRAP = 0xffffffff
+
+# Record kinds
+QUERY = 0
+PICKLED = 1
+
+# Slots of shared state array: records dropped for being stale, and ones
+# rejected for being too large, are counted apart
+HEAD, TAIL, USED, COUNT, MARK_SEQUENCE, MARK_POSITION, DROPPED, REJECTED = \
+    range(8)
+
+
+def pack(event):
+    """Returns (kind, data) record for event. Query events, which are most
+       of the traffic, are sent as bare fields."""
+    if event.type == 'query':
+        return QUERY, marshal.dumps((event.pos, event.timestamp, event.elapsed,
+                                     event.db, event.query, event.insert_id,
+                                     event.last_insert_id))
+    return PICKLED, cPickle.dumps(event, 2)
+
+
+def unpack(kind, data):
+    if kind == QUERY:
+        pos, timestamp, elapsed, db, query, insert_id, last_insert_id = \
+            marshal.loads(data)
+        return Event(pos, 'query', db, query, timestamp, elapsed,
+                     insert_id, last_insert_id)
+    return cPickle.loads(data)
+
+
+class Ring(object):
+    """Scheduler lookalike passing events between processes through ring
+       buffer of `size` bytes, holding at most `maxsize` events. Must be
+       created before worker processes are forked. Events are handed out
+       in order they were put, ones the SQL thread has reached while they
+       were waiting are dropped and handed to on_drop, in the process
+       that dropped them."""
+    def __init__(self, size=64 << 20, maxsize=0, on_drop=None):
+        self.size = size
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        # Anonymous mappings are shared with forked children
+        self.buf = mmap.mmap(-1, size)
+        self.mutex = multiprocessing.Lock()
+        self.not_empty = multiprocessing.Condition(self.mutex)
+        self.not_full = multiprocessing.Condition(self.mutex)
+        self.state = multiprocessing.RawArray('l', 8)
+        self.state[MARK_SEQUENCE] = -1
+
+    def qsize(self):
+        return self.state[COUNT]
+
+    def full(self):
+        return 0 < self.maxsize <= self.state[COUNT]
+
+    @property
+    def dropped(self):
+        return self.state[DROPPED]
+
+    @property
+    def rejected(self):
+        return self.state[REJECTED]
+
+    @property
+    def watermark(self):
+        if self.state[MARK_SEQUENCE] < 0:
+            return None
+        return (self.state[MARK_SEQUENCE], self.state[MARK_POSITION])
+
+    def advance(self, position):
+        """SQL thread has moved to position, readers skip what is behind it"""
+        with self.mutex:
+            self.state[MARK_SEQUENCE], self.state[MARK_POSITION] = position
+
+    def _needed(self, length):
+        """Bytes record of length takes up when written at head"""
+        rest = self.size - self.state[HEAD]
+        if rest < length:
+            return rest + length
+        return length
+
+    def _full(self, length):
+        state = self.state
+        if 0 < self.maxsize <= state[COUNT]:
+            return True
+        return state[USED] + self._needed(length) > self.size
+
+    def put(self, item, block=True, timeout=None, position=None):
+        """Same as Scheduler.put, item gets serialized right away"""
+        if position is None:
+            position = (0, item.pos)
+        kind, data = pack(item)
+        length = RECORD.size + len(data)
+        if length > self.size // 4:
+            logger.debug("Event at %d too large for ring, skipping", item.pos)
+            with self.mutex:
+                self.state[REJECTED] += 1
+            if self.on_drop:
+                self.on_drop(item)
+            return
+
+        state = self.state
+        with self.not_full:
+            wait_for(self.not_full, lambda: self._full(length),
+                     block, timeout, Queue.Full)
+            head = state[HEAD]
+            needed = self._needed(length)
+            if needed > length:
+                if self.size - head >= RECORD.size:
+                    RECORD.pack_into(self.buf, head, WRAP, 0, 0, 0)
+                head = 0
+            RECORD.pack_into(self.buf, head, length, position[0],
+                             position[1], kind)
+            self.buf[head + RECORD.size:head + length] = data
+            state[HEAD] = head + length
+            state[USED] += needed
+            state[COUNT] += 1
+            self.not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        state = self.state
+        # Stale records, unpacked for on_drop once the lock is released
+        stale = []
+        try:
+            with self.not_empty:
+                while True:
+                    wait_for(self.not_empty, lambda: not state[COUNT],
+                             block, timeout, Queue.Empty)
+                    tail = state[TAIL]
+                    if self.size - tail < RECORD.size:
+                        state[USED] -= self.size - tail
+                        tail = 0
+                    length, sequence, pos, kind = \
+                        RECORD.unpack_from(self.buf, tail)
+                    if length == WRAP:
+                        state[USED] -= self.size - tail
+                        tail = 0
+                        length, sequence, pos, kind = \
+                            RECORD.unpack_from(self.buf, tail)
+                    data = self.buf[tail + RECORD.size:tail + length]
+                    state[USED] -= length
+                    state[COUNT] -= 1
+                    if state[COUNT]:
+                        state[TAIL] = tail + length
+                    else:
+                        # Empty, start over to avoid wrapping
+                        state[HEAD] = state[TAIL] = state[USED] = 0
+                    self.not_full.notify()
+                    if state[MARK_SEQUENCE] < 0 or (sequence, pos) > \
+                            (state[MARK_SEQUENCE], state[MARK_POSITION]):
+                        break
+                    state[DROPPED] += 1
+                    if self.on_drop:
+                        stale.append((kind, data))
+        finally:
+            for record in stale:
+                self.on_drop(unpack(*record))
+        return unpack(kind, data)
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def put_nowait(self, item, position=None):
+        return self.put(item, False, position=position)
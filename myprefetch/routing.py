@@ -0,0 +1,126 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Consistent hashing of events to runner queues, so that statements on one
+schema (or table) keep going through the same connection.
+"""
+
+from bisect import bisect
+import hashlib
+import struct
+
+from myprefetch.statements import target
+
+# Points each runner gets on hash ring
+REPLICAS = 64
+
+
+def point(key):
+    return struct.unpack("<I", hashlib.md5(repr(key)).digest()[:4])[0]
+
+
+def db_key(event):
+    return event.db
+
+
+def table_key(event):
+    """(db, table) of event, of first event for transactions"""
+    if event.type == 'transaction':
+        event = event.events[0]
+    if event.type == 'rows':
+        return event.db, event.table
+    name = target(event.query)
+    if not name:
+        return event.db, None
+    return name[0] or event.db, name[1]
+
+
+KEYS = {
+    "db": db_key,
+    "table": table_key,
+}
+
+
+class HashRing(object):
+    """Maps keys to range(nodes). Ring for fewer nodes is a subset of the
+       one for more, so only keys of added or removed nodes move."""
+    def __init__(self, nodes, replicas=REPLICAS):
+        points = sorted((point((node, replica)), node)
+                        for node in range(nodes)
+                        for replica in range(replicas))
+        self.points = [hashed for hashed, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def node(self, key):
+        return self.nodes[bisect(self.points, point(key)) % len(self.points)]
+
+
+class Router(object):
+    """Queue lookalike putting each event on one of `queues`, by
+       consistent hash of key(event) among first active() of them.
+       Runners get from their own queue."""
+    def __init__(self, queues, key, active=None, cache_size=10000):
+        self.queues = queues
+        self.key = key
+        self.active = active or (lambda: len(queues))
+        self.cache_size = cache_size
+        # Number of queues -> HashRing
+        self.rings = {}
+        # (number of queues, key) -> queue index
+        self.routes = {}
+
+    @property
+    def maxsize(self):
+        return sum(queue.maxsize for queue in self.queues)
+
+    @property
+    def dropped(self):
+        return sum(queue.dropped for queue in self.queues)
+
+    def qsize(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    def full(self):
+        return all(queue.full() for queue in self.queues)
+
+    def advance(self, position):
+        for queue in self.queues:
+            queue.advance(position)
+
+    def route(self, item):
+        """Index of queue item goes to"""
+        nodes = max(min(self.active(), len(self.queues)), 1)
+        key = (nodes, self.key(item))
+        try:
+            return self.routes[key]
+        except KeyError:
+            pass
+        ring = self.rings.get(nodes)
+        if ring is None:
+            ring = self.rings[nodes] = HashRing(nodes)
+        if len(self.routes) >= self.cache_size:
+            self.routes.clear()
+        index = self.routes[key] = ring.node(key[1])
+        return index
+
+    def put(self, item, block=True, timeout=None, position=None):
+        self.queues[self.route(item)].put(item, block, timeout,
+                                          position=position)
+
+    def put_nowait(self, item, position=None):
+        return self.put(item, False, position=position)
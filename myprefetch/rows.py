@@ -0,0 +1,472 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Decoding of table maps and row images carried by row-based replication
+events. Values come back as plain python objects that rewriters can turn
+into SQL literals.
+"""
+
+import struct
+from decimal import Decimal
+
+MYSQL_TYPE_DECIMAL = 0
+MYSQL_TYPE_TINY = 1
+MYSQL_TYPE_SHORT = 2
+MYSQL_TYPE_LONG = 3
+MYSQL_TYPE_FLOAT = 4
+MYSQL_TYPE_DOUBLE = 5
+MYSQL_TYPE_NULL = 6
+MYSQL_TYPE_TIMESTAMP = 7
+MYSQL_TYPE_LONGLONG = 8
+MYSQL_TYPE_INT24 = 9
+MYSQL_TYPE_DATE = 10
+MYSQL_TYPE_TIME = 11
+MYSQL_TYPE_DATETIME = 12
+MYSQL_TYPE_YEAR = 13
+MYSQL_TYPE_NEWDATE = 14
+MYSQL_TYPE_VARCHAR = 15
+MYSQL_TYPE_BIT = 16
+MYSQL_TYPE_TIMESTAMP2 = 17
+MYSQL_TYPE_DATETIME2 = 18
+MYSQL_TYPE_TIME2 = 19
+MYSQL_TYPE_JSON = 245
+MYSQL_TYPE_NEWDECIMAL = 246
+MYSQL_TYPE_ENUM = 247
+MYSQL_TYPE_SET = 248
+MYSQL_TYPE_TINY_BLOB = 249
+MYSQL_TYPE_MEDIUM_BLOB = 250
+MYSQL_TYPE_LONG_BLOB = 251
+MYSQL_TYPE_BLOB = 252
+MYSQL_TYPE_VAR_STRING = 253
+MYSQL_TYPE_STRING = 254
+MYSQL_TYPE_GEOMETRY = 255
+
+# Optional table map metadata (binlog_row_metadata, 8.0+)
+SIGNEDNESS = 1
+COLUMN_NAME = 4
+SIMPLE_PRIMARY_KEY = 8
+PRIMARY_KEY_WITH_PREFIX = 9
+
+INTEGER_SIZES = {
+    MYSQL_TYPE_TINY: 1,
+    MYSQL_TYPE_SHORT: 2,
+    MYSQL_TYPE_INT24: 3,
+    MYSQL_TYPE_LONG: 4,
+    MYSQL_TYPE_LONGLONG: 8,
+}
+
+# Columns SIGNEDNESS metadata has a flag for, same as is_numeric_type() of
+# MySQL. YEAR and BIT are left out there, so are they here.
+NUMERIC_TYPES = frozenset(INTEGER_SIZES.keys() + [
+    MYSQL_TYPE_DECIMAL, MYSQL_TYPE_NEWDECIMAL, MYSQL_TYPE_FLOAT,
+    MYSQL_TYPE_DOUBLE,
+])
+
+BLOB_TYPES = frozenset([
+    MYSQL_TYPE_TINY_BLOB, MYSQL_TYPE_MEDIUM_BLOB, MYSQL_TYPE_LONG_BLOB,
+    MYSQL_TYPE_BLOB, MYSQL_TYPE_GEOMETRY, MYSQL_TYPE_JSON,
+])
+
+DIG2BYTES = (0, 1, 1, 2, 2, 3, 3, 4, 4, 4)
+
+
+class UnixTime(float):
+    """TIMESTAMP column value, seconds since epoch"""
+    pass
+
+
+class TableMap(object):
+    """Table definition as announced by TABLE_MAP_EVENT"""
+    def __init__(self, table_id, schema, table, column_types, column_meta):
+        self.table_id = table_id
+        self.schema = schema
+        self.table = table
+        self.column_types = column_types
+        self.column_meta = column_meta
+        # Only known when master runs with binlog_row_metadata=FULL
+        self.column_names = None
+        self.primary_key = None
+        self.unsigned = None
+
+    def __str__(self):
+        return "%s.%s (%d columns)" % (self.schema, self.table,
+                                       len(self.column_types))
+
+
+def unsigned(value, column_type):
+    """Reinterpret signed integer as unsigned one of column size"""
+    if value < 0 and column_type in INTEGER_SIZES:
+        return value + (1 << (8 * INTEGER_SIZES[column_type]))
+    return value
+
+
+def packed_int(data, pos):
+    """Read length-encoded integer, returns (value, new position)"""
+    first = struct.unpack_from("<B", data, pos)[0]
+    if first < 251:
+        return first, pos + 1
+    elif first == 252:
+        return struct.unpack_from("<H", data, pos + 1)[0], pos + 3
+    elif first == 253:
+        lo, hi = struct.unpack_from("<HB", data, pos + 1)
+        return lo | hi << 16, pos + 4
+    return struct.unpack_from("<Q", data, pos + 1)[0], pos + 9
+
+
+def _bitmap(data, pos, count):
+    """Returns list of set bit indexes of bitmap with count bits"""
+    size = (count + 7) // 8
+    bits = struct.unpack_from("%dB" % size, data, pos)
+    return [i for i in xrange(count) if bits[i >> 3] & (1 << (i & 7))]
+
+
+def _uint_be(raw, start, end):
+    value = 0
+    for byte in raw[start:end]:
+        value = value << 8 | byte
+    return value
+
+
+def parse_table_map(table_id, data, pos, end):
+    """Decode TABLE_MAP_EVENT body starting after the post-header"""
+    schema_len = struct.unpack_from("<B", data, pos)[0]
+    schema = data[pos + 1:pos + 1 + schema_len]
+    pos += schema_len + 2
+    table_len = struct.unpack_from("<B", data, pos)[0]
+    table = data[pos + 1:pos + 1 + table_len]
+    pos += table_len + 2
+
+    column_count, pos = packed_int(data, pos)
+    column_types = struct.unpack_from("%dB" % column_count, data, pos)
+    pos += column_count
+
+    meta_len, pos = packed_int(data, pos)
+    column_meta = _read_metadata(column_types, data, pos)
+    pos += meta_len
+    # Skip NULL-ability bitmap
+    pos += (column_count + 7) // 8
+
+    table_map = TableMap(table_id, schema, table, column_types, column_meta)
+    if pos < end:
+        _read_optional_metadata(table_map, data, pos, end)
+    return table_map
+
+
+def _read_metadata(column_types, data, pos):
+    meta = []
+    for column_type in column_types:
+        if column_type in BLOB_TYPES or column_type in (
+                MYSQL_TYPE_FLOAT, MYSQL_TYPE_DOUBLE, MYSQL_TYPE_TIMESTAMP2,
+                MYSQL_TYPE_DATETIME2, MYSQL_TYPE_TIME2):
+            meta.append(struct.unpack_from("<B", data, pos)[0])
+            pos += 1
+        elif column_type in (MYSQL_TYPE_VARCHAR, MYSQL_TYPE_VAR_STRING):
+            meta.append(struct.unpack_from("<H", data, pos)[0])
+            pos += 2
+        elif column_type in (MYSQL_TYPE_NEWDECIMAL, MYSQL_TYPE_BIT):
+            meta.append(struct.unpack_from("<BB", data, pos))
+            pos += 2
+        elif column_type in (MYSQL_TYPE_STRING, MYSQL_TYPE_ENUM,
+                             MYSQL_TYPE_SET):
+            byte0, byte1 = struct.unpack_from("<BB", data, pos)
+            pos += 2
+            # Lengths above 255 steal two bits from the real type byte
+            if byte0 & 0x30 != 0x30:
+                meta.append((byte0 | 0x30, byte1 | (((byte0 & 0x30) ^ 0x30) << 4)))
+            else:
+                meta.append((byte0, byte1))
+        else:
+            meta.append(None)
+    return meta
+
+
+def _read_optional_metadata(table_map, data, pos, end):
+    numeric = [i for i, t in enumerate(table_map.column_types)
+               if t in NUMERIC_TYPES]
+    while pos < end:
+        field_type = struct.unpack_from("<B", data, pos)[0]
+        length, pos = packed_int(data, pos + 1)
+        field_end = pos + length
+        if field_type == SIGNEDNESS:
+            flags = _bitmap_msb(data, pos, len(numeric))
+            table_map.unsigned = frozenset(column for column, flag
+                                           in zip(numeric, flags) if flag)
+        elif field_type == COLUMN_NAME:
+            names = []
+            while pos < field_end:
+                name_len, pos = packed_int(data, pos)
+                names.append(data[pos:pos + name_len])
+                pos += name_len
+            table_map.column_names = names
+        elif field_type == SIMPLE_PRIMARY_KEY:
+            key = []
+            while pos < field_end:
+                column, pos = packed_int(data, pos)
+                key.append(column)
+            table_map.primary_key = key
+        elif field_type == PRIMARY_KEY_WITH_PREFIX:
+            key = []
+            while pos < field_end:
+                column, pos = packed_int(data, pos)
+                prefix, pos = packed_int(data, pos)
+                key.append(column)
+            table_map.primary_key = key
+        pos = field_end
+
+
+def _bitmap_msb(data, pos, count):
+    """Optional metadata bitmaps are stored most significant bit first"""
+    size = (count + 7) // 8
+    bits = struct.unpack_from("%dB" % size, data, pos)
+    return [bool(bits[i >> 3] & (0x80 >> (i & 7))) for i in xrange(count)]
+
+
+def decode_rows(table_map, data, pos, end, update=False):
+    """Decode row images of ROWS event body.
+       Returns list of row tuples, update events produce before and after
+       image for each row. Columns not present in image are None as well."""
+    column_count, pos = packed_int(data, pos)
+    present = _bitmap(data, pos, column_count)
+    pos += (column_count + 7) // 8
+    if update:
+        present_after = _bitmap(data, pos, column_count)
+        pos += (column_count + 7) // 8
+
+    rows = []
+    while pos < end:
+        row, pos = decode_row(table_map, present, data, pos)
+        rows.append(row)
+        if update:
+            row, pos = decode_row(table_map, present_after, data, pos)
+            rows.append(row)
+    return rows
+
+
+def decode_row(table_map, present, data, pos):
+    """Decode single row image, returns (values, new position)"""
+    values = [None] * len(table_map.column_types)
+    nulls = _bitmap(data, pos, len(present))
+    pos += (len(present) + 7) // 8
+    nulls = set(present[i] for i in nulls)
+
+    column_types = table_map.column_types
+    column_meta = table_map.column_meta
+    for column in present:
+        if column in nulls:
+            continue
+        column_type = column_types[column]
+        values[column], size = DECODERS[column_type](data, pos,
+                                                     column_meta[column])
+        pos += size
+    return tuple(values), pos
+
+
+def _integer(fmt):
+    size = struct.calcsize(fmt)
+    def decode(data, pos, meta):
+        return struct.unpack_from(fmt, data, pos)[0], size
+    return decode
+
+
+def _int24(data, pos, meta):
+    lo, hi = struct.unpack_from("<Hb", data, pos)
+    return lo | hi << 16, 3
+
+
+def _null(data, pos, meta):
+    return None, 0
+
+
+def _varchar(data, pos, meta):
+    if meta < 256:
+        length = struct.unpack_from("<B", data, pos)[0]
+        return data[pos + 1:pos + 1 + length], length + 1
+    length = struct.unpack_from("<H", data, pos)[0]
+    return data[pos + 2:pos + 2 + length], length + 2
+
+
+def _string(data, pos, meta):
+    real_type, length = meta
+    if real_type == MYSQL_TYPE_ENUM:
+        return _uint_le(data, pos, length), length
+    elif real_type == MYSQL_TYPE_SET:
+        return _uint_le(data, pos, length), length
+    return _varchar(data, pos, length)
+
+
+def _uint_le(data, pos, size):
+    value = 0
+    for byte in reversed(struct.unpack_from("%dB" % size, data, pos)):
+        value = value << 8 | byte
+    return value
+
+
+def _blob(data, pos, meta):
+    length = _uint_le(data, pos, meta)
+    return data[pos + meta:pos + meta + length], meta + length
+
+
+def _bit(data, pos, meta):
+    bits, size = meta
+    if bits:
+        size += 1
+    raw = bytearray(data[pos:pos + size])
+    return _uint_be(raw, 0, size), size
+
+
+def _year(data, pos, meta):
+    year = struct.unpack_from("<B", data, pos)[0]
+    return year and year + 1900, 1
+
+
+def _date(data, pos, meta):
+    value = _uint_le(data, pos, 3)
+    return "%04d-%02d-%02d" % (value >> 9, (value >> 5) & 15, value & 31), 3
+
+
+def _time(data, pos, meta):
+    value = _int24(data, pos, meta)[0]
+    sign = value < 0 and "-" or ""
+    value = abs(value)
+    return "%s%02d:%02d:%02d" % (sign, value // 10000, value // 100 % 100,
+                                 value % 100), 3
+
+
+def _datetime(data, pos, meta):
+    value = struct.unpack_from("<Q", data, pos)[0]
+    date, time = divmod(value, 1000000)
+    return "%04d-%02d-%02d %02d:%02d:%02d" % (
+        date // 10000, date // 100 % 100, date % 100,
+        time // 10000, time // 100 % 100, time % 100), 8
+
+
+def _timestamp(data, pos, meta):
+    return UnixTime(struct.unpack_from("<I", data, pos)[0]), 4
+
+
+def _fraction(raw, start, fsp):
+    """Microseconds stored in (fsp+1)/2 big-endian bytes"""
+    size = (fsp + 1) // 2
+    if not size:
+        return None
+    return _uint_be(raw, start, start + size) * 100 ** (3 - size)
+
+
+def _timestamp2(data, pos, meta):
+    size = 4 + (meta + 1) // 2
+    raw = bytearray(data[pos:pos + size])
+    value = _uint_be(raw, 0, 4)
+    fraction = _fraction(raw, 4, meta)
+    if fraction:
+        return UnixTime(value + fraction / 1000000.0), size
+    return UnixTime(value), size
+
+
+def _datetime2(data, pos, meta):
+    size = 5 + (meta + 1) // 2
+    raw = bytearray(data[pos:pos + size])
+    value = _uint_be(raw, 0, 5) - 0x8000000000
+    ymd, hms = value >> 17, value & 0x1FFFF
+    year_month = ymd >> 5
+    ret = "%04d-%02d-%02d %02d:%02d:%02d" % (
+        year_month // 13, year_month % 13, ymd & 31,
+        hms >> 12, (hms >> 6) & 63, hms & 63)
+    fraction = _fraction(raw, 5, meta)
+    if fraction is not None:
+        ret += ".%06d" % fraction
+    return ret, size
+
+
+def _time2(data, pos, meta):
+    frac_size = (meta + 1) // 2
+    size = 3 + frac_size
+    raw = bytearray(data[pos:pos + size])
+    value = _uint_be(raw, 0, size) - (0x800000 << (8 * frac_size))
+    sign = value < 0 and "-" or ""
+    value = abs(value)
+    hms = value >> (8 * frac_size)
+    ret = "%s%02d:%02d:%02d" % (sign, (hms >> 12) & 0x3FF, (hms >> 6) & 63,
+                                hms & 63)
+    if frac_size:
+        fraction = value & ((1 << (8 * frac_size)) - 1)
+        ret += ".%06d" % (fraction * 100 ** (3 - frac_size))
+    return ret, size
+
+
+def _newdecimal(data, pos, meta):
+    precision, scale = meta
+    intg0, intg0x = divmod(precision - scale, 9)
+    frac0, frac0x = divmod(scale, 9)
+    size = (intg0 * 4 + DIG2BYTES[intg0x] +
+            frac0 * 4 + DIG2BYTES[frac0x])
+
+    raw = bytearray(data[pos:pos + size])
+    negative = not raw[0] & 0x80
+    raw[0] ^= 0x80
+    if negative:
+        raw = bytearray(byte ^ 0xFF for byte in raw)
+
+    offset = DIG2BYTES[intg0x]
+    integral = str(_uint_be(raw, 0, offset))
+    for _ in xrange(intg0):
+        integral += "%09d" % _uint_be(raw, offset, offset + 4)
+        offset += 4
+    fractional = ""
+    for _ in xrange(frac0):
+        fractional += "%09d" % _uint_be(raw, offset, offset + 4)
+        offset += 4
+    if frac0x:
+        end = offset + DIG2BYTES[frac0x]
+        fractional += "%0*d" % (frac0x, _uint_be(raw, offset, end))
+
+    value = integral.lstrip("0") or "0"
+    if fractional:
+        value += "." + fractional
+    if negative:
+        value = "-" + value
+    return Decimal(value), size
+
+
+DECODERS = {
+    MYSQL_TYPE_TINY: _integer("<b"),
+    MYSQL_TYPE_SHORT: _integer("<h"),
+    MYSQL_TYPE_INT24: _int24,
+    MYSQL_TYPE_LONG: _integer("<i"),
+    MYSQL_TYPE_LONGLONG: _integer("<q"),
+    MYSQL_TYPE_FLOAT: _integer("<f"),
+    MYSQL_TYPE_DOUBLE: _integer("<d"),
+    MYSQL_TYPE_NULL: _null,
+    MYSQL_TYPE_YEAR: _year,
+    MYSQL_TYPE_DATE: _date,
+    MYSQL_TYPE_NEWDATE: _date,
+    MYSQL_TYPE_TIME: _time,
+    MYSQL_TYPE_DATETIME: _datetime,
+    MYSQL_TYPE_TIMESTAMP: _timestamp,
+    MYSQL_TYPE_TIMESTAMP2: _timestamp2,
+    MYSQL_TYPE_DATETIME2: _datetime2,
+    MYSQL_TYPE_TIME2: _time2,
+    MYSQL_TYPE_VARCHAR: _varchar,
+    MYSQL_TYPE_VAR_STRING: _varchar,
+    MYSQL_TYPE_STRING: _string,
+    MYSQL_TYPE_ENUM: _string,
+    MYSQL_TYPE_SET: _string,
+    MYSQL_TYPE_BIT: _bit,
+    MYSQL_TYPE_NEWDECIMAL: _newdecimal,
+}
+for _type in BLOB_TYPES:
+    DECODERS[_type] = _blob
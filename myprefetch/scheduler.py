@@ -0,0 +1,125 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Work queue for runners, ordered by how close events are to the SQL thread.
+"""
+
+import heapq
+import itertools
+import Queue
+import threading
+import time
+
+
+def wait_for(condition, predicate, block, timeout, exception):
+    """Wait on condition (held) while predicate is true, raising exception
+       if we would have to wait without block or longer than timeout"""
+    if not block:
+        if predicate():
+            raise exception
+    elif timeout is None:
+        while predicate():
+            condition.wait()
+    else:
+        deadline = time.time() + timeout
+        while predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise exception
+            condition.wait(remaining)
+
+
+class Scheduler(object):
+    """Queue.Queue lookalike handing out events closest to the SQL thread
+       first. Events the SQL thread has reached while they were waiting
+       are dropped instead of being prefetched, and handed to on_drop."""
+    def __init__(self, maxsize=0, on_drop=None):
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self.heap = []
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+        # (relay log sequence, position) of SQL thread
+        self.watermark = None
+        # Keeps insertion order among events at same position
+        self.counter = itertools.count()
+        # Number of events dropped for being stale
+        self.dropped = 0
+
+    def qsize(self):
+        with self.mutex:
+            return len(self.heap)
+
+    def full(self):
+        with self.mutex:
+            return 0 < self.maxsize <= len(self.heap)
+
+    def advance(self, position):
+        """SQL thread has moved to position, forget what is behind it"""
+        with self.mutex:
+            self.watermark = position
+            fresh = [entry for entry in self.heap if entry[0] > position]
+            stale = []
+            if len(fresh) < len(self.heap):
+                stale = [entry for entry in self.heap if entry[0] <= position]
+                self.dropped += len(stale)
+                heapq.heapify(fresh)
+                self.heap = fresh
+                self.not_full.notify_all()
+        self.drop(item for _, _, item in stale)
+
+    def drop(self, items):
+        if self.on_drop:
+            for item in items:
+                self.on_drop(item)
+
+    def put(self, item, block=True, timeout=None, position=None):
+        """Same as Queue.put, position orders items and defaults to
+           item.pos within single relay log"""
+        if position is None:
+            position = (0, item.pos)
+        with self.not_full:
+            if self.maxsize > 0:
+                wait_for(self.not_full,
+                         lambda: len(self.heap) >= self.maxsize,
+                         block, timeout, Queue.Full)
+            heapq.heappush(self.heap, (position, next(self.counter), item))
+            self.not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        stale = []
+        try:
+            with self.not_empty:
+                while True:
+                    wait_for(self.not_empty, lambda: not self.heap,
+                             block, timeout, Queue.Empty)
+                    position, _, item = heapq.heappop(self.heap)
+                    self.not_full.notify()
+                    if self.watermark is None or position > self.watermark:
+                        return item
+                    self.dropped += 1
+                    stale.append(item)
+        finally:
+            self.drop(stale)
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def put_nowait(self, item, position=None):
+        return self.put(item, False, position=position)
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Table definitions needed by rewriters, loaded from information_schema
+and cached until DDL replicates.
+"""
+
+import collections
+import logging
+import threading
+
+from myprefetch.rewriters import quote
+
+logger = logging.getLogger(__name__)
+
+
+class Table(object):
+    """Columns and indexes of a table"""
+    def __init__(self, columns, unsigned, indexes, unique):
+        # Column names (lowercase) in table order
+        self.columns = columns
+        # Names of unsigned integer columns
+        self.unsigned = unsigned
+        # Index name -> column names (lowercase), PRIMARY first
+        self.indexes = indexes
+        # Names of unique indexes, PRIMARY included
+        self.unique = unique
+
+    def primary_key(self):
+        """List of (column index, column name, unsigned) tuples"""
+        return [(self.columns.index(name), name, name in self.unsigned)
+                for name in self.indexes.get("PRIMARY", ())]
+
+
+class SchemaCache(object):
+    """Caches column and index definitions per table"""
+    def __init__(self, db):
+        # mysql.MySQL connection used only for information_schema lookups
+        self.db = db
+        self.lock = threading.Lock()
+        # (schema, table) -> Table, False for tables that do not exist
+        self.tables = {}
+
+    def table(self, schema, table):
+        """Returns Table, None if table does not exist or lookup failed"""
+        key = (schema, table)
+        try:
+            return self.tables[key] or None
+        except KeyError:
+            pass
+
+        # Runners come here concurrently, but share single connection
+        with self.lock:
+            if key not in self.tables:
+                definition = self.load_table(schema, table)
+                if definition is None:
+                    # Lookup failed, we will retry on next event
+                    return None
+                self.tables[key] = definition
+        return self.tables[key] or None
+
+    def primary_key(self, schema, table):
+        """Returns list of (column index, column name, unsigned) tuples,
+           None if table has no primary key or does not exist"""
+        definition = self.table(schema, table)
+        return definition and definition.primary_key() or None
+
+    def load_table(self, schema, table):
+        logger.debug("Loading definition of %s.%s", schema, table)
+        where = "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s" % (
+            quote(schema), quote(table))
+        columns = self.db.q(
+            "SELECT COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS "
+            "%s ORDER BY ORDINAL_POSITION" % where)
+        if columns is None:
+            return None
+        if not columns:
+            return False
+        statistics = self.db.q(
+            "SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME "
+            "FROM information_schema.STATISTICS "
+            "%s ORDER BY INDEX_NAME != 'PRIMARY', INDEX_NAME, SEQ_IN_INDEX" %
+            where)
+        if statistics is None:
+            return None
+
+        indexes = collections.OrderedDict()
+        unique = set()
+        for row in statistics:
+            name = row['INDEX_NAME']
+            indexes.setdefault(name, []).append(row['COLUMN_NAME'].lower())
+            if str(row['NON_UNIQUE']) == '0':
+                unique.add(name)
+        return Table([row['COLUMN_NAME'].lower() for row in columns],
+                     set(row['COLUMN_NAME'].lower() for row in columns
+                         if 'unsigned' in row['COLUMN_TYPE']),
+                     indexes, unique)
+
+    def invalidate(self, schema=None, table=None):
+        """Forget cached definitions, for whole schema if table is None,
+           everything if schema is None too"""
+        with self.lock:
+            for key in self.tables.keys():
+                if schema is None or (key[0] == schema and
+                                      (table is None or key[1] == table)):
+                    del self.tables[key]
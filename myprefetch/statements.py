@@ -0,0 +1,255 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Just enough SQL parsing to tell which rows and index entries simple
+single table UPDATE, DELETE and INSERT statements touch.
+"""
+
+import re
+
+from myprefetch.dispatch import statement_start
+
+# Quoted strings, identifiers and comments, blanked out before parsing
+quoted_re = re.compile(r"""'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|"""
+                       r"""`(?:[^`]|``)*`|/\*.*?\*/""", re.S)
+
+literal_re = re.compile(r"""^(?:'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|"""
+                        r"""[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|"""
+                        r"""0x[0-9a-fA-F]+)$""", re.S)
+
+NAME = r"(?:`[^`]*`|\w+)"
+TABLE = r"(?P<table>%s(?:\s*\.\s*%s)?)" % (NAME, NAME)
+
+update_re = re.compile(r"UPDATE\s+(?:LOW_PRIORITY\s+)?(?:IGNORE\s+)?" +
+                       TABLE + r"\s+SET\s+", re.I)
+delete_re = re.compile(r"DELETE\s+(?:LOW_PRIORITY\s+)?(?:QUICK\s+)?"
+                       r"(?:IGNORE\s+)?FROM\s+" + TABLE + r"\s+WHERE\s+", re.I)
+insert_re = re.compile(r"(?:INSERT|REPLACE)\s+"
+                       r"(?:(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY)\s+)?"
+                       r"(?:IGNORE\s+)?(?:INTO\s+)?" + TABLE +
+                       r"\s*(?:\((?P<columns>[^()]*)\)\s*)?VALUES?\s*", re.I)
+# Table statement reads or writes first, cheaper than parse()
+target_re = re.compile(r"(?:UPDATE|INSERT|REPLACE|DELETE|SELECT\b.*?\bFROM)\s+"
+                       r"(?:(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY|QUICK|IGNORE|"
+                       r"INTO|FROM)\s+)*" + TABLE, re.I | re.S)
+where_re = re.compile(r"\bWHERE\b", re.I)
+and_re = re.compile(r"\bAND\b", re.I)
+or_re = re.compile(r"\b(?:OR|XOR)\b|\|\|", re.I)
+duplicate_re = re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.I)
+equals_re = re.compile(r"^(%s(?:\s*\.\s*%s)?)\s*=\s*(.*)$" % (NAME, NAME),
+                       re.S)
+in_re = re.compile(r"^(%s(?:\s*\.\s*%s)?)\s+IN\s*\((.*)\)$" % (NAME, NAME),
+                   re.S | re.I)
+
+
+class Statement(object):
+    """Parsed write statement"""
+    def __init__(self, kind, db, table):
+        # "update", "delete" or "insert"
+        self.kind = kind
+        # db is None unless statement names it
+        self.db = db
+        self.table = table
+        # Column (lowercase) -> new value expression, from UPDATE ... SET
+        # or INSERT ... ON DUPLICATE KEY UPDATE
+        self.assignments = {}
+        # WHERE clause, including any ORDER BY and LIMIT
+        self.where = None
+        # Column (lowercase) -> tuple of literals it is compared to in
+        # WHERE clause with = or IN
+        self.equalities = {}
+        # INSERT column list and value expressions of each row
+        self.columns = None
+        self.rows = []
+
+
+def mask(query):
+    """Blank out contents of strings, quoted identifiers and comments,
+       leaving offsets as they were"""
+    return quoted_re.sub(
+        lambda m: m.group()[0] + " " * (len(m.group()) - 2) + m.group()[-1],
+        query)
+
+
+def unquote_name(name):
+    """Last part of possibly qualified and quoted identifier"""
+    name = re.findall(NAME, name)[-1]
+    if name.startswith("`"):
+        return name[1:-1].replace("``", "`")
+    return name
+
+
+def split_name(name):
+    """(db, table) from db.table, db is None if not given"""
+    parts = [unquote_name(part) for part in re.findall(NAME, name)]
+    if len(parts) == 1:
+        return None, parts[0]
+    return parts[0], parts[1]
+
+
+def target(query):
+    """(db, table) statement works on, db is None if not given. None if
+       statement is not DML on a named table."""
+    match = target_re.match(query, statement_start(query))
+    if not match:
+        return None
+    return split_name(match.group("table"))
+
+
+def is_literal(value):
+    return bool(literal_re.match(value.strip()))
+
+
+def depths(masked, start, end):
+    """Parenthesis depth at each offset in masked[start:end]"""
+    ret = []
+    depth = 0
+    for char in masked[start:end]:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        ret.append(depth)
+    return ret
+
+
+def find_top(regex, query, masked, start, end):
+    """First match of regex in masked[start:end] outside parentheses"""
+    levels = depths(masked, start, end)
+    for match in regex.finditer(masked, start, end):
+        if not levels[match.start() - start]:
+            return match
+    return None
+
+
+def split_top(regex, query, masked, start, end):
+    """query[start:end] split on regex matches outside parentheses"""
+    levels = depths(masked, start, end)
+    parts = []
+    last = start
+    for match in regex.finditer(masked, start, end):
+        if not levels[match.start() - start]:
+            parts.append(query[last:match.start()].strip())
+            last = match.end()
+    parts.append(query[last:end].strip())
+    return parts
+
+
+comma_re = re.compile(",")
+
+
+def parse_assignments(query, masked, start, end):
+    """Column -> expression map of `col = expr, ...` list"""
+    assignments = {}
+    for part in split_top(comma_re, query, masked, start, end):
+        match = equals_re.match(part)
+        if not match:
+            return None
+        assignments[unquote_name(match.group(1)).lower()] = \
+            match.group(2).strip()
+    return assignments
+
+
+def parse_equalities(where):
+    """Column -> literals map of top level `col = literal` and
+       `col IN (literals)` conditions joined by AND"""
+    masked = mask(where)
+    # Only ORDER BY or LIMIT can follow conditions in single table writes
+    tail = re.search(r"\b(?:ORDER\s+BY|LIMIT)\b", masked, re.I)
+    end = tail and tail.start() or len(where)
+    if find_top(or_re, where, masked, 0, end):
+        return {}
+
+    equalities = {}
+    for condition in split_top(and_re, where, masked, 0, end):
+        condition = condition.strip()
+        while condition.startswith("(") and condition.endswith(")"):
+            condition = condition[1:-1].strip()
+        match = equals_re.match(condition)
+        if match and is_literal(match.group(2)):
+            values = (match.group(2).strip(), )
+        else:
+            match = in_re.match(condition)
+            if not match:
+                continue
+            inner = match.group(2)
+            values = tuple(split_top(comma_re, inner, mask(inner),
+                                     0, len(inner)))
+            if not all(is_literal(value) for value in values):
+                continue
+        column = unquote_name(match.group(1)).lower()
+        equalities[column] = values
+    return equalities
+
+
+def parse(query):
+    """Statement for simple single table UPDATE, DELETE, INSERT or REPLACE,
+       None for anything else"""
+    masked = mask(query)
+    if "(SELECT" in masked.upper().replace(" ", ""):
+        # Subqueries, INSERT ... SELECT
+        return None
+
+    start = statement_start(query)
+    match = update_re.match(masked, start) or delete_re.match(masked, start)
+    if match:
+        db, table = split_name(query[match.start("table"):match.end("table")])
+        if match.re is update_re:
+            statement = Statement("update", db, table)
+            where = find_top(where_re, query, masked, match.end(), len(query))
+            if not where:
+                return None
+            assignments = parse_assignments(query, masked, match.end(),
+                                            where.start())
+            if not assignments:
+                return None
+            statement.assignments = assignments
+            statement.where = query[where.end():].strip()
+        else:
+            statement = Statement("delete", db, table)
+            statement.where = query[match.end():].strip()
+        if not statement.where:
+            return None
+        statement.equalities = parse_equalities(statement.where)
+        return statement
+
+    match = insert_re.match(masked, start)
+    if not match:
+        return None
+    db, table = split_name(query[match.start("table"):match.end("table")])
+    statement = Statement("insert", db, table)
+    if match.group("columns") is not None:
+        columns = query[match.start("columns"):match.end("columns")]
+        statement.columns = [unquote_name(column).lower()
+                             for column in columns.split(",")]
+
+    end = len(query)
+    duplicate = find_top(duplicate_re, query, masked, match.end(), end)
+    if duplicate:
+        statement.assignments = parse_assignments(
+            query, masked, duplicate.end(), end) or {}
+        end = duplicate.start()
+    for row in split_top(comma_re, query, masked, match.end(), end):
+        if not (row.startswith("(") and row.endswith(")")):
+            return None
+        inner = row[1:-1]
+        values = split_top(comma_re, inner, mask(inner), 0, len(inner))
+        if statement.columns and len(values) != len(statement.columns):
+            return None
+        statement.rows.append(values)
+    return statement
@@ -0,0 +1,358 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Synthetic relay logs and a local stand-in for the replica, so that parser
+and prefetcher performance can be measured without a MySQL server.
+"""
+
+import multiprocessing
+import os
+import random
+import struct
+import time
+import zlib
+
+from myprefetch import binlog
+from myprefetch import rows
+
+# Post-header lengths by event type, as written by 5.6 servers
+POST_HEADER_LENGTHS = {
+    binlog.START_EVENT_V3: 56,
+    binlog.QUERY_EVENT: 13,
+    binlog.ROTATE_EVENT: 8,
+    binlog.LOAD_EVENT: 18,
+    binlog.CREATE_FILE_EVENT: 4,
+    binlog.APPEND_BLOCK_EVENT: 4,
+    binlog.EXEC_LOAD_EVENT: 4,
+    binlog.DELETE_FILE_EVENT: 4,
+    binlog.NEW_LOAD_EVENT: 18,
+    binlog.FORMAT_DESCRIPTION_EVENT: 84,
+    binlog.BEGIN_LOAD_QUERY_EVENT: 4,
+    binlog.EXECUTE_LOAD_QUERY_EVENT: 26,
+    binlog.TABLE_MAP_EVENT: 8,
+    binlog.WRITE_ROWS_EVENT: 8,
+    binlog.UPDATE_ROWS_EVENT: 8,
+    binlog.DELETE_ROWS_EVENT: 8,
+    binlog.INCIDENT_EVENT: 2,
+    binlog.WRITE_ROWS_EVENT_V2: 10,
+    binlog.UPDATE_ROWS_EVENT_V2: 10,
+    binlog.DELETE_ROWS_EVENT_V2: 10,
+    binlog.GTID_LOG_EVENT: 42,
+    binlog.ANONYMOUS_GTID_LOG_EVENT: 42,
+}
+EVENT_TYPES = 35
+
+# Server UUID of GTIDs in generated logs
+SERVER_UUID = "3e11fa47-71ca-11e1-9e33-c80aa9429562"
+
+DEFAULT_MIX = {
+    "insert": 40,
+    "update": 30,
+    "delete": 10,
+    "rows": 20,
+}
+
+
+class RelayLogWriter(object):
+    """Writes binlog format 4 file event by event. With checksum, events
+       get CRC32 trailers, if server_version is one to know about them."""
+    def __init__(self, path, server_id=1, server_version="5.5.62-log",
+                 timestamp=0, checksum=False):
+        self.path = path
+        self.server_id = server_id
+        self.file = open(path, "wb")
+        self.file.write("\xfebin")
+        self.position = 4
+        self.checksum = False
+        self.format_description(timestamp, server_version, checksum)
+
+    def event(self, timestamp, event_type, body, server_id=None,
+              checksum=None):
+        """Append raw event, returns its position"""
+        if checksum is None:
+            checksum = self.checksum
+        position = self.position
+        length = 19 + len(body) + (checksum and binlog.CHECKSUM_LENGTH or 0)
+        data = struct.pack("<IBIIIH", timestamp, event_type,
+                           server_id or self.server_id, length,
+                           position + length, 0) + body
+        if checksum:
+            data += struct.pack("<I", zlib.crc32(data) & 0xffffffff)
+        self.file.write(data)
+        self.position += length
+        return position
+
+    def format_description(self, timestamp, server_version, checksum=False,
+                           server_id=None):
+        """FDE, events after it follow its checksum setting. Relay logs
+           have one of master after their own."""
+        lengths = "".join(chr(POST_HEADER_LENGTHS.get(event_type, 0))
+                          for event_type in range(1, EVENT_TYPES + 1))
+        body = struct.pack("<H50sIB", 4, server_version, timestamp, 19) + \
+            lengths
+        has_alg = binlog.has_checksum_alg(server_version)
+        if has_alg:
+            body += chr(checksum and binlog.BINLOG_CHECKSUM_ALG_CRC32 or
+                        binlog.BINLOG_CHECKSUM_ALG_OFF)
+        # Checksum aware servers always checksum FDE
+        position = self.event(timestamp, binlog.FORMAT_DESCRIPTION_EVENT,
+                              body, server_id, has_alg)
+        self.checksum = has_alg and checksum
+        return position
+
+    def previous_gtids(self, timestamp):
+        """Empty set of GTIDs"""
+        return self.event(timestamp, binlog.PREVIOUS_GTIDS_LOG_EVENT,
+                          struct.pack("<Q", 0))
+
+    def gtid(self, timestamp, gno, uuid=SERVER_UUID):
+        """GTID of transaction following it, anonymous if gno is None"""
+        if gno is None:
+            return self.event(timestamp, binlog.ANONYMOUS_GTID_LOG_EVENT,
+                              "\x01" + "\0" * 41)
+        return self.event(timestamp, binlog.GTID_LOG_EVENT,
+                          struct.pack("<B16sQBQQ", 1,
+                                      uuid.replace("-", "").decode("hex"),
+                                      gno, 2, 0, 0))
+
+    def rows_query(self, timestamp, query):
+        """Statement row events following it came from"""
+        return self.event(timestamp, binlog.ROWS_QUERY_LOG_EVENT,
+                          chr(min(len(query), 255)) + query)
+
+    def query(self, timestamp, db, query, elapsed=0, insert_id=None):
+        if insert_id is not None:
+            self.event(timestamp, binlog.INTVAR_EVENT,
+                       struct.pack("<BQ", 2, insert_id))
+        return self.event(timestamp, binlog.QUERY_EVENT,
+                          struct.pack("<IIBHH", 1, elapsed, len(db), 0, 0) +
+                          db + "\0" + query)
+
+    def xid(self, timestamp, xid):
+        return self.event(timestamp, binlog.XID_EVENT, struct.pack("<Q", xid))
+
+    def table_map(self, timestamp, table_id, db, table):
+        """Maps (id INT, name VARCHAR(255)) table"""
+        body = struct.pack("<IHH", table_id & 0xffffffff, table_id >> 32, 1)
+        body += chr(len(db)) + db + "\0" + chr(len(table)) + table + "\0"
+        body += "\x02" + chr(rows.MYSQL_TYPE_LONG) + \
+            chr(rows.MYSQL_TYPE_VARCHAR)
+        body += "\x02" + struct.pack("<H", 255) + "\x00"
+        return self.event(timestamp, binlog.TABLE_MAP_EVENT, body)
+
+    def rows(self, timestamp, table_id, action, images):
+        """Row images of table written by table_map(), (id, name) tuples"""
+        event_type = {
+            "insert": binlog.WRITE_ROWS_EVENT_V2,
+            "update": binlog.UPDATE_ROWS_EVENT_V2,
+            "delete": binlog.DELETE_ROWS_EVENT_V2,
+        }[action]
+        body = struct.pack("<IHHH", table_id & 0xffffffff, table_id >> 32,
+                           1, 2)
+        body += "\x02\x03"
+        if action == "update":
+            body += "\x03"
+        for id_, name in images:
+            body += "\x00" + struct.pack("<i", id_) + chr(len(name)) + name
+        return self.event(timestamp, event_type, body)
+
+    def rotate(self, timestamp, filename):
+        return self.event(timestamp, binlog.ROTATE_EVENT,
+                          struct.pack("<Q", 4) + filename)
+
+    def close(self):
+        self.file.close()
+
+
+def generate(directory, events=100000, mix=None, query_size=100,
+             density=1000, start_time=1300000000, file_size=64 << 20,
+             basename="relay-bin", seed=0, transaction_size=1,
+             server_version="5.5.62-log", checksum=False):
+    """Write synthetic relay logs and their index file into directory.
+       density is events per second of master time, query_size is mean
+       statement length, mix maps statement kinds to relative weights,
+       transaction_size is number of statements between BEGIN and XID.
+       Logs of servers from 5.6 on are laid out like their relay logs,
+       with GTID and ROWS_QUERY events, CRC32 checksummed with checksum.
+       Returns list of file names."""
+    modern = binlog.has_checksum_alg(server_version)
+    rand = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = []
+    for kind, weight in sorted(mix.items()):
+        kinds.extend([kind] * weight)
+
+    names = []
+    writer = None
+    next_id = 1
+    # Statements written in currently open transaction
+    pending = 0
+    for n in xrange(events):
+        timestamp = start_time + n // density
+        if writer is None or writer.position >= file_size and not pending:
+            name = "%s.%06d" % (basename, len(names) + 1)
+            if writer:
+                writer.rotate(timestamp, name)
+                writer.close()
+            names.append(name)
+            writer = RelayLogWriter(os.path.join(directory, name),
+                                    server_version=server_version,
+                                    timestamp=timestamp, checksum=checksum)
+            if modern:
+                writer.previous_gtids(timestamp)
+                writer.rotate(timestamp, "mysql-bin.%06d" % len(names))
+                writer.format_description(timestamp, server_version,
+                                          checksum, server_id=2)
+
+        kind = rand.choice(kinds)
+        table = "t%d" % rand.randint(1, 10)
+        key = rand.randint(1, max(next_id, 2))
+        padding = "x" * max(rand.randint(query_size // 2, query_size * 3 // 2)
+                            - 60, 0)
+        elapsed = rand.random() < 0.01 and 10 or 0
+        if kind == "ddl":
+            # DDL commits whatever is open and runs on its own
+            if pending:
+                writer.xid(timestamp, n)
+                pending = 0
+            if modern:
+                writer.gtid(timestamp, n + 1)
+            writer.query(timestamp, "bench",
+                         "ALTER TABLE %s ADD KEY (name)" % table)
+            continue
+
+        if not pending:
+            if modern:
+                writer.gtid(timestamp, n + 1)
+            writer.query(timestamp, "bench", binlog.BEGIN)
+        pending += 1
+        if kind == "insert":
+            writer.query(timestamp, "bench",
+                         "INSERT INTO %s (id, name) VALUES (NULL, '%s')" %
+                         (table, padding), elapsed, insert_id=next_id)
+            next_id += 1
+        elif kind == "update":
+            writer.query(timestamp, "bench",
+                         "UPDATE %s SET name = '%s' WHERE id = %d" %
+                         (table, padding, key), elapsed)
+        elif kind == "delete":
+            writer.query(timestamp, "bench",
+                         "/* app:bench */ DELETE FROM %s WHERE id = %d" %
+                         (table, key), elapsed)
+        elif kind == "select":
+            writer.query(timestamp, "bench",
+                         "SELECT name FROM %s WHERE id = %d" % (table, key))
+        elif kind == "rows":
+            table_id = int(table[1:])
+            action = rand.choice(("insert", "update", "delete"))
+            images = [(key, padding[:200])]
+            if action == "update":
+                images.append((key, padding[:100]))
+            if modern:
+                writer.rows_query(timestamp, "%s %s /* id %d */" %
+                                  (action.upper(), table, key))
+            writer.table_map(timestamp, table_id, "bench", table)
+            writer.rows(timestamp, table_id, action, images)
+        if pending >= transaction_size:
+            writer.xid(timestamp, n)
+            pending = 0
+    if pending:
+        writer.xid(timestamp, events)
+    writer.close()
+
+    with open(os.path.join(directory, basename + ".index"), "w") as index:
+        for name in names:
+            index.write("./%s\n" % name)
+    return names
+
+
+class FakeServer(object):
+    """Replica simulation shared by FakeSlave connections. SQL thread
+       walks through relay logs applying `apply_rate` events a second,
+       each round trip of prefetch queries takes `latency` seconds."""
+    def __init__(self, directory, names, apply_rate=1000, latency=0.0):
+        self.directory = directory
+        self.names = names
+        self.apply_rate = apply_rate
+        self.latency = latency
+        # Shared, so that queries from worker processes count as well
+        self.queries = multiprocessing.Value('l', 0)
+        self.started = None
+        # (file name, position, timestamp) of every transaction and event
+        # outside of transactions, SQL thread steps through these
+        self.positions = []
+        for name in names:
+            log = binlog.Binlog(os.path.join(directory, name))
+            pending = False
+            for event in log:
+                if not pending and event.type != 'xid':
+                    self.positions.append((name, event.pos, event.timestamp))
+                if binlog.begins_transaction(event):
+                    pending = True
+                elif binlog.ends_transaction(event):
+                    pending = False
+            log.close()
+        self.master_time = self.positions and self.positions[-1][2] or 0
+
+    def sql_position(self):
+        if self.started is None:
+            self.started = time.time()
+        applied = int((time.time() - self.started) * self.apply_rate)
+        return self.positions[min(applied, len(self.positions) - 1)]
+
+    def slave_status(self):
+        name, pos, timestamp = self.sql_position()
+        return {
+            "Slave_SQL_Running": "Yes",
+            "Seconds_Behind_Master": str(self.master_time - timestamp),
+            "Relay_Log_File": name,
+            "Relay_Log_Pos": str(pos),
+        }
+
+    def query(self, query, statements=1):
+        with self.queries.get_lock():
+            self.queries.value += statements
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeSlave(object):
+    """Stand-in for mysql.MySQL and readahead.Slave connections"""
+    def __init__(self, server, init_connect=None):
+        self.server = server
+        self.init_connect = init_connect
+
+    def q(self, query, use_result=True, discard=False, schema=None):
+        self.server.query(query)
+        return use_result and not discard and [] or None
+
+    def execute(self, prepared, comment="", schema=None):
+        self.server.query(prepared.shape)
+
+    def pipeline(self, items):
+        self.server.query(None, sum(len(queries) for queries, _, _ in items))
+        return len(items), None
+
+    def slave_status(self):
+        return self.server.slave_status()
+
+    def sleep(self, threshold, comment=None):
+        time.sleep(threshold)
+
+    def close(self):
+        pass
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Backs off when the replica is busy, so that prefetch queries do not
+compete with the SQL thread for a saturated server.
+"""
+
+import logging
+import time
+
+from myprefetch import metrics
+
+logger = logging.getLogger(__name__)
+
+# SHOW GLOBAL STATUS variables sampled, by signal name
+STATUS_VARIABLES = {
+    "threads_running": "Threads_running",
+    "pending_reads": "Innodb_data_pending_reads",
+}
+
+over_limit = metrics.registry.counter(
+    "prefetch_throttle_over_limit_total",
+    "Samples with server signal over its limit", "signal")
+signals = metrics.registry.gauge(
+    "prefetch_throttle_signal", "Last sampled server signals", "signal")
+
+
+class Throttle(object):
+    """Caps active_runners of a Prefetch while server signals are over
+       their limits, halving the cap on every sample over and raising it
+       by one on every sample below resume fraction of all of them. With
+       one runner left and signals still over, prefetching pauses.
+       Limits of 0 are not checked."""
+    def __init__(self, max_threads_running=0, max_pending_reads=0,
+                 max_latency=0, interval=1.0, resume=0.8):
+        # signal -> limit
+        self.limits = dict((signal, limit) for signal, limit in (
+            ("threads_running", max_threads_running),
+            ("pending_reads", max_pending_reads),
+            ("latency", max_latency)) if limit)
+        # How often (seconds) server gets asked
+        self.interval = interval
+        # Signals must fall below this fraction of limits to add runners
+        self.resume = resume
+
+        self.last_sample = 0
+        # Runners allowed to work, None until first sample
+        self.allowed = None
+        # Nothing should be queued while set
+        self.paused = False
+
+    def sample(self, prefetch, db):
+        """signal -> value, None if server could not be asked"""
+        values = {}
+        variables = [STATUS_VARIABLES[signal] for signal in self.limits
+                     if signal in STATUS_VARIABLES]
+        if variables:
+            rows = db.q("SHOW GLOBAL STATUS WHERE Variable_name IN (%s)" %
+                        ", ".join("'%s'" % name for name in variables))
+            if rows is None:
+                return None
+            status = dict((row['Variable_name'].lower(), row['Value'])
+                          for row in rows)
+            for signal, name in STATUS_VARIABLES.items():
+                if signal in self.limits and name.lower() in status:
+                    values[signal] = float(status[name.lower()])
+        # Nothing runs to measure while paused
+        if "latency" in self.limits and not self.paused and \
+                prefetch.runner_latency is not None:
+            values["latency"] = prefetch.runner_latency
+        return values
+
+    def update(self, prefetch, db):
+        """Called every prefetch cycle with connection to sample server
+           signals through"""
+        now = time.time()
+        if self.limits and now - self.last_sample >= self.interval:
+            self.last_sample = now
+            values = self.sample(prefetch, db)
+            if values is not None:
+                self.adjust(prefetch, values)
+        self.limit(prefetch)
+
+    def adjust(self, prefetch, values):
+        if self.allowed is None:
+            self.allowed = prefetch.runners
+        over = []
+        for signal, value in values.items():
+            signals.set(value, signal)
+            if value > self.limits[signal]:
+                over_limit.inc(label=signal)
+                over.append(signal)
+
+        if over:
+            # Controller or earlier cap may keep fewer at work already
+            allowed = min(self.allowed, prefetch.active_runners)
+            if allowed > 1:
+                self.allowed = allowed // 2
+            elif not self.paused:
+                self.allowed = 0
+                self.paused = True
+            logger.info("Server busy (%s), allowing %d runners",
+                        ", ".join("%s=%s" % (signal, values[signal])
+                                  for signal in sorted(over)), self.allowed)
+        elif all(value < self.limits[signal] * self.resume
+                 for signal, value in values.items()):
+            # Paused on latency alone, one runner gets to try again
+            if self.allowed < prefetch.runners:
+                self.allowed += 1
+                self.paused = False
+                logger.info("Server recovered, allowing %d runners",
+                            self.allowed)
+
+    def limit(self, prefetch):
+        """Apply cap to active_runners. Unless something else (like
+           AdaptiveController) tunes them, they are brought back up to
+           the cap as well."""
+        if self.allowed is None:
+            return
+        active = prefetch.active_runners
+        if not prefetch.controller:
+            active = prefetch.runners
+        prefetch.active_runners = min(active, self.allowed)
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Reading binlogs of servers before and after CRC32 checksums, with both
+readers.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from myprefetch import binlog
+from myprefetch.synthetic import RelayLogWriter
+
+QUERY = "UPDATE t SET a = 1 WHERE id = 5"
+
+
+class ChecksumVersionTest(unittest.TestCase):
+    def test_has_checksum_alg(self):
+        self.assertFalse(binlog.has_checksum_alg("5.5.62-log"))
+        self.assertFalse(binlog.has_checksum_alg("5.6.0"))
+        self.assertTrue(binlog.has_checksum_alg("5.6.1"))
+        self.assertTrue(binlog.has_checksum_alg("8.0.30"))
+        self.assertTrue(binlog.has_checksum_alg("5.5.5-10.3.39-MariaDB"))
+        self.assertFalse(binlog.has_checksum_alg("5.2.14-MariaDB"))
+        self.assertFalse(binlog.has_checksum_alg("unknown"))
+
+
+class BinlogTest(unittest.TestCase):
+    reader = binlog.Binlog
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "relay-bin.000001")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, **kwargs):
+        writer = RelayLogWriter(self.path, **kwargs)
+        writer.previous_gtids(1)
+        writer.gtid(1, 7)
+        writer.query(1, "db", "BEGIN")
+        query = writer.query(1, "db", QUERY, insert_id=3)
+        writer.table_map(1, 5, "db", "t")
+        writer.rows(1, 5, "delete", [(5, "a")])
+        writer.xid(1, 1)
+        writer.close()
+        return query
+
+    def read(self, verify_checksums=False):
+        log = self.reader(self.path, verify_checksums)
+        try:
+            return log, [event for event in log
+                         if event.type in ('query', 'rows')]
+        finally:
+            log.close()
+
+    def check(self, events):
+        begin, update, delete = events
+        self.assertEqual((update.db, update.query), ("db", QUERY))
+        self.assertEqual(update.insert_id, 3)
+        self.assertEqual(delete.rows, [(5, "a")])
+
+    def test_without_checksum_alg(self):
+        self.write()
+        log, events = self.read()
+        self.assertFalse(log.checksum)
+        self.check(events)
+
+    def test_checksum_stripped(self):
+        self.write(server_version="5.7.44-log", checksum=True)
+        log, events = self.read(verify_checksums=True)
+        self.assertTrue(log.checksum)
+        self.check(events)
+        self.assertEqual(log.checksum_errors, 0)
+
+    def test_checksum_off(self):
+        self.write(server_version="8.0.30", checksum=False)
+        log, events = self.read(verify_checksums=True)
+        self.assertFalse(log.checksum)
+        self.check(events)
+
+    def test_relay_log_with_master_fde(self):
+        # Own events checksummed, those of master are not
+        writer = RelayLogWriter(self.path, server_version="5.7.44-log",
+                                checksum=True)
+        writer.rotate(0, "master-bin.000001")
+        writer.format_description(0, "5.5.62-log", server_id=2)
+        writer.query(1, "db", QUERY)
+        writer.close()
+        log, events = self.read(verify_checksums=True)
+        self.assertFalse(log.checksum)
+        self.assertEqual([event.query for event in events], [QUERY])
+
+    def test_corrupted_event_skipped(self):
+        position = self.write(server_version="5.7.44-log", checksum=True)
+        with open(self.path, "r+b") as f:
+            f.seek(position + 19 + 13 + len("db\0"))
+            f.write("X")
+        log, events = self.read(verify_checksums=True)
+        self.assertEqual([event.query for event in events if
+                          event.type == 'query'], ["BEGIN"])
+        self.assertEqual(log.checksum_errors, 1)
+        # Not looked at unless asked for
+        log, events = self.read()
+        self.assertEqual(events[1].query, "X" + QUERY[1:])
+        self.assertEqual(log.checksum_errors, 0)
+
+
+class MappedBinlogTest(BinlogTest):
+    reader = binlog.MappedBinlog
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Deduplication of prefetch work: cache, keys, and keys claimed and released
+by Prefetch.
+"""
+
+import Queue
+import unittest
+
+from myprefetch.binlog import Event, Transaction
+from myprefetch.dedup import DedupCache, event_key, query_key
+from myprefetch.mysql import Config
+from myprefetch.readahead import Prefetch
+from myprefetch.ring import Ring
+
+
+def query(text, pos=100, insert_id=None, db='db'):
+    return Event(pos, 'query', db, text, 0, 0, insert_id, None)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class DedupCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = DedupCache(size=2, ttl=10)
+        self.cache.clock = self.clock = Clock()
+
+    def test_claim_once_within_ttl(self):
+        self.assertTrue(self.cache.claim(("event", "a")))
+        self.assertFalse(self.cache.claim(("event", "a")))
+        self.clock.now = 10
+        self.assertTrue(self.cache.claim(("event", "a")))
+
+    def test_release(self):
+        self.cache.claim(("event", "a"))
+        self.cache.release(("event", "a"))
+        self.assertTrue(self.cache.claim(("event", "a")))
+        # Releasing what is not there is fine
+        self.cache.release(("event", "b"))
+
+    def test_least_recently_claimed_evicted(self):
+        for key in ("a", "b", "c"):
+            self.cache.claim(("event", key))
+        self.assertTrue(self.cache.claim(("event", "a")))
+        self.assertFalse(self.cache.claim(("event", "c")))
+
+
+class KeyTest(unittest.TestCase):
+    def test_event_key_follows_where_literals(self):
+        self.assertEqual(
+            event_key(query("UPDATE t SET a = 1 WHERE id = 5")),
+            event_key(query("UPDATE  t SET a = 2 /* c */ WHERE id = 5")))
+        self.assertNotEqual(
+            event_key(query("UPDATE t SET a = 1 WHERE id = 5")),
+            event_key(query("UPDATE t SET a = 1 WHERE id = 6")))
+        self.assertNotEqual(
+            event_key(query("UPDATE t SET a = 1 WHERE id = 5")),
+            event_key(query("UPDATE t SET a = 1 WHERE id = 5", db='other')))
+
+    def test_event_key_includes_insert_id(self):
+        insert = "INSERT INTO t (id, a) VALUES (NULL, 1)"
+        self.assertNotEqual(event_key(query(insert, insert_id=1)),
+                            event_key(query(insert, insert_id=2)))
+
+    def test_no_event_key(self):
+        self.assertEqual(event_key(Event(100, 'xid', None, '', 0, 0, None,
+                                         None)), None)
+        self.assertEqual(event_key(query("UPDATE t SET a = '%s' WHERE id = 1"
+                                         % ("x" * 5000))), None)
+
+    def test_query_key_ignores_position(self):
+        self.assertEqual(query_key("/* pos:100 */ SELECT 1"),
+                         query_key("/* pos:200 */ SELECT 1"))
+
+
+class PrefetchDedupTest(unittest.TestCase):
+    def setUp(self):
+        self.prefetch = Prefetch(Config("localhost", 3306, "", ""),
+                                 dedup_size=10)
+        self.update = query("UPDATE t SET a = 1 WHERE id = 5")
+
+    def test_empty_cache_deduplicates(self):
+        self.assertTrue(self.prefetch.admit(self.update))
+        self.assertFalse(self.prefetch.admit(self.update))
+
+    def test_disabled(self):
+        prefetch = Prefetch(Config("localhost", 3306, "", ""))
+        self.assertEqual(prefetch.dedup, None)
+        self.assertTrue(prefetch.admit(self.update))
+        self.assertTrue(prefetch.admit(self.update))
+
+    def test_release_transaction(self):
+        transaction = Transaction(query("BEGIN"))
+        other = query("DELETE FROM t WHERE id = 7")
+        transaction.events = [self.update, other]
+        for item in transaction.events:
+            self.prefetch.admit(item)
+        self.prefetch.release_event(transaction)
+        self.assertTrue(self.prefetch.admit(self.update))
+        self.assertTrue(self.prefetch.admit(other))
+
+    def test_release_from_worker(self):
+        prefetch = self.prefetch
+        prefetch.release_queue = Queue.Queue()
+        prefetch.admit(self.update)
+        # Worker has its own copy of the cache, keys go back to parser
+        prefetch.worker_index = 0
+        prefetch.release_event(self.update)
+        prefetch.worker_index = None
+        self.assertFalse(prefetch.admit(self.update))
+        prefetch.release_returned()
+        self.assertTrue(prefetch.admit(self.update))
+
+    def test_release_stale_ring_records(self):
+        prefetch = self.prefetch
+        events = Ring(4096, on_drop=prefetch.release_event)
+        prefetch.admit(self.update)
+        events.put(self.update)
+        events.advance((0, self.update.pos))
+        self.assertRaises(Queue.Empty, events.get_nowait)
+        self.assertTrue(prefetch.admit(self.update))
+
+
+if __name__ == "__main__":
+    unittest.main()
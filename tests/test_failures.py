@@ -0,0 +1,126 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Suppression of statement shapes that keep failing.
+"""
+
+import unittest
+
+from myprefetch import failures
+from myprefetch.binlog import Event, Transaction
+from myprefetch.failures import FailureCache, failure_key
+
+
+def event(query, db='db'):
+    return Event(100, 'query', db, query, 0, 0, None, None)
+
+
+class Clock(object):
+    """Stands in for time module in failures"""
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class FailureKeyTest(unittest.TestCase):
+    def test_same_shape_same_key(self):
+        self.assertEqual(failure_key(event("DELETE FROM t WHERE id = 1")),
+                         failure_key(event("DELETE FROM t WHERE id = 2")))
+        self.assertNotEqual(failure_key(event("DELETE FROM t WHERE id = 1")),
+                            failure_key(event("DELETE FROM u WHERE id = 1")))
+        self.assertNotEqual(failure_key(event("DELETE FROM t WHERE id = 1")),
+                            failure_key(event("DELETE FROM t WHERE id = 1",
+                                              'other')))
+
+    def test_transaction(self):
+        first = event("DELETE FROM t WHERE id = 1")
+        transaction = Transaction(event("BEGIN"))
+        transaction.events = [first, event("COMMIT")]
+        self.assertEqual(failure_key(transaction)[0], "transaction")
+        self.assertNotEqual(failure_key(transaction), failure_key(first))
+
+
+class FailureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.time = failures.time
+        failures.time = self.clock = Clock()
+        self.cache = FailureCache(size=2, threshold=2, window=60,
+                                  backoff=10, max_backoff=15)
+        self.key = ("query", "a")
+
+    def tearDown(self):
+        failures.time = self.time
+
+    def test_suppressed_after_threshold(self):
+        self.cache.failed(self.key)
+        self.assertFalse(self.cache.check(self.key))
+        self.clock.now = 1
+        self.cache.failed(self.key)
+        self.clock.now = 5
+        self.assertTrue(self.cache.check(self.key))
+        self.clock.now = 11
+        self.assertFalse(self.cache.check(self.key))
+
+    def test_backoff_doubles_up_to_max(self):
+        for now in (0, 1):
+            self.clock.now = now
+            self.cache.failed(self.key)
+        self.clock.now = 12
+        self.cache.failed(self.key)
+        self.clock.now = 26
+        self.assertTrue(self.cache.check(self.key))
+        self.clock.now = 27
+        self.assertFalse(self.cache.check(self.key))
+
+    def test_streak_ends_outside_window(self):
+        self.cache.failed(self.key)
+        self.clock.now = 61
+        self.cache.failed(self.key)
+        self.assertFalse(self.cache.check(self.key))
+
+    def test_success_starts_over(self):
+        self.cache.failed(self.key)
+        self.cache.succeeded(self.key)
+        self.cache.failed(self.key)
+        self.assertFalse(self.cache.check(self.key))
+
+    def test_success_while_suppressed_ignored(self):
+        self.cache.failed(self.key)
+        self.cache.failed(self.key)
+        # Was in flight before suppression started
+        self.cache.succeeded(self.key)
+        self.assertTrue(self.cache.check(self.key))
+
+    def test_least_recently_failed_evicted(self):
+        for key in (self.key, ("query", "b"), ("query", "c")):
+            self.cache.failed(key)
+            self.cache.failed(key)
+        self.assertFalse(self.cache.check(self.key))
+        self.assertTrue(self.cache.check(("query", "c")))
+
+    def test_horizon_forgets_everything(self):
+        self.cache.failed(self.key)
+        self.cache.failed(self.key)
+        self.clock.now = 100
+        self.assertFalse(self.cache.check(self.key))
+        self.assertEqual(len(self.cache.entries), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Pipelines of statements in one round trip, and telling how far they got.
+"""
+
+import unittest
+
+from myprefetch import mysql
+from myprefetch.rewriters import Prepared
+
+
+class Result(object):
+    def __init__(self, column, value):
+        self.column = column
+        self.value = value
+
+    def describe(self):
+        return ((self.column, 3, None, None, None, None, 0), )
+
+    def fetch_row(self):
+        return ((self.value, ), )
+
+
+class PipelineConnection(object):
+    """_mysql connection lookalike running multi-statement text, failing
+       statements containing FAIL as server would"""
+    def __init__(self):
+        self.queries = []
+        self.statements = []
+
+    def query(self, query):
+        self.queries.append(query)
+        self.statements = query.split("; ")
+        self.run()
+
+    def run(self):
+        statement = self.statements[0]
+        if "FAIL" in statement:
+            self.statements = []
+            raise mysql.Error(1146, "Table 't' doesn't exist")
+        if mysql.PIPELINE_MARK in statement:
+            self.result = Result(mysql.PIPELINE_MARK,
+                                 statement.split()[1])
+        else:
+            self.result = None
+
+    def use_result(self):
+        return self.result
+
+    def next_result(self):
+        self.statements.pop(0)
+        if not self.statements:
+            return -1
+        self.run()
+        return 0
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = mysql.MySQL(mysql.Config("localhost", 3306,
+                                                   "user", "pw"),
+                                      prepared_size=2)
+        self.connection._conn = PipelineConnection()
+
+    def test_all_ran(self):
+        items = [(["SELECT 1"], "/* a */", "db"),
+                 (["SELECT 2", "SELECT 3"], "/* b */", "db")]
+        self.assertEqual(self.connection.pipeline(items), (2, None))
+        self.assertEqual(self.connection._conn.queries,
+                         ["USE `db`; /* a */ SELECT 1; SELECT 0 AS %s; "
+                          "/* b */ SELECT 2; /* b */ SELECT 3; "
+                          "SELECT 1 AS %s" % ((mysql.PIPELINE_MARK, ) * 2)])
+        self.assertEqual(self.connection.schema, "db")
+
+    def test_stops_at_failing_item(self):
+        items = [(["SELECT 1"], "", None),
+                 (["SELECT FAIL"], "", None),
+                 (["SELECT 3"], "", "other")]
+        done, error = self.connection.pipeline(items)
+        self.assertEqual(done, 1)
+        self.assertEqual(error.args[0], 1146)
+        self.assertEqual(self.connection.schema, None)
+
+    def test_first_item_failing(self):
+        done, error = self.connection.pipeline([(["SELECT FAIL"], "", None)])
+        self.assertEqual(done, 0)
+        self.assertTrue(isinstance(error, mysql.Error))
+
+    def test_unprepared_statements_forgotten(self):
+        first = Prepared("SELECT ? FAIL", ("1", ))
+        second = Prepared("SELECT ?", ("2", ))
+        self.connection.pipeline([([first], "", None),
+                                  ([second], "", None)])
+        self.assertEqual(self.connection.prepared.names, {})
+        # Both get prepared again on next use
+        self.connection.pipeline([([first, second], "", None)])
+        self.assertEqual(
+            self.connection._conn.queries[-1].count("PREPARE "), 2)
+
+    def test_schema_of_last_item(self):
+        self.connection.schema = "a"
+        query, schema = self.connection.pipeline_query(
+            [(["SELECT 1"], "", "a"), (["SELECT 2"], "", "b"),
+             (["SELECT 3"], "", None)])
+        self.assertEqual(schema, "b")
+        self.assertEqual(query.count("USE "), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
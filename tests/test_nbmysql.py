@@ -0,0 +1,198 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Client protocol of non-blocking connections, against canned server packets.
+"""
+
+import hashlib
+import struct
+import unittest
+
+from myprefetch import nbmysql
+from myprefetch.mysql import Config
+from myprefetch.rewriters import Prepared
+
+
+def packet(payload, sequence=1):
+    return struct.pack("<I", len(payload))[:3] + chr(sequence) + payload
+
+
+def ok(status=0):
+    return packet("\x00\x00\x00" + struct.pack("<HH", status, 0))
+
+
+def error(code, message):
+    return packet("\xff" + struct.pack("<H", code) + "#42S02" + message)
+
+
+def result_set(status=0):
+    """Single column, single row"""
+    return (packet("\x01") + packet("\x03def") +
+            packet("\xfe\x00\x00\x02\x00") + packet("\x01a") +
+            packet("\xfe\x00\x00" + struct.pack("<H", status)))
+
+
+def sent_queries(outbuf):
+    """COM_QUERY texts in client output"""
+    queries = []
+    pos = 0
+    while pos < len(outbuf):
+        length, = struct.unpack("<I", outbuf[pos:pos + 3] + "\0")
+        payload = outbuf[pos + 4:pos + 4 + length]
+        if payload[0] == chr(nbmysql.COM_QUERY):
+            queries.append(payload[1:])
+        pos += 4 + length
+    return queries
+
+
+class FakeSocket(object):
+    def __init__(self):
+        self.chunks = []
+
+    def recv(self, size):
+        return self.chunks.pop(0)
+
+    def close(self):
+        pass
+
+
+class ProtocolTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = nbmysql.Connection(Config("localhost", 3306, "user", "pw"),
+                                       prepared_size=2)
+        self.conn.sock = FakeSocket()
+        self.conn.state = nbmysql.READY
+        self.results = []
+
+    def done(self, command, error):
+        self.results.append((command.context, error))
+
+    def receive(self, *chunks):
+        for chunk in chunks:
+            self.conn.sock.chunks.append(chunk)
+            self.conn.readable()
+
+    def test_scramble_native(self):
+        salt = "0123456789abcdefghij"
+        response = nbmysql.scramble_native("secret", salt)
+        # What the server checks, knowing SHA1(SHA1(password)) only
+        stage2 = hashlib.sha1(hashlib.sha1("secret").digest()).digest()
+        stage1 = nbmysql._xor(response,
+                              hashlib.sha1(salt + stage2).digest())
+        self.assertEqual(hashlib.sha1(stage1).digest(), stage2)
+        self.assertEqual(nbmysql.scramble_native("", salt), "")
+
+    def test_handshake(self):
+        conn = self.conn
+        conn.state = nbmysql.HANDSHAKE
+        conn.init_commands = ["SET SESSION wait_timeout=5"]
+        upper = nbmysql.CLIENT_PLUGIN_AUTH >> 16
+        greeting = ("\x0a" + "8.0.30\0" + struct.pack("<I", 7) +
+                    "abcdefgh" + "\0" + struct.pack("<H", 0xffff) +
+                    chr(33) + struct.pack("<HH", 2, upper) + chr(21) +
+                    "\0" * 10 + "ijklmnopqrst\0" + "caching_sha2_password\0")
+        self.receive(packet(greeting, 0))
+        self.assertEqual(conn.state, nbmysql.AUTH)
+        self.assertEqual(conn.scramble, "abcdefghijklmnopqrst")
+        self.assertEqual(conn.plugin, "caching_sha2_password")
+        auth = nbmysql.scramble_sha256("pw", conn.scramble)
+        self.assertEqual(ord(conn.outbuf[3]), 1)
+        self.assertTrue(conn.outbuf.endswith(
+            "user\0" + chr(len(auth)) + auth + "caching_sha2_password\0"))
+
+        conn.outbuf = ""
+        # Fast authentication success, then OK
+        self.receive(packet("\x01\x03", 2) + ok())
+        self.assertEqual(conn.state, nbmysql.READY)
+        self.assertEqual(sent_queries(conn.outbuf),
+                         ["SET SESSION wait_timeout=5"])
+
+    def test_handshake_error(self):
+        self.conn.state = nbmysql.HANDSHAKE
+        self.receive(packet("\xff" + struct.pack("<H", 1040) +
+                            "Too many connections", 0))
+        self.assertEqual(self.conn.state, nbmysql.CLOSED)
+
+    def test_results_in_order(self):
+        for index in range(3):
+            self.conn.query("SELECT %d" % index, self.done, index)
+        self.receive(ok() + error(1146, "Table 't' doesn't exist") +
+                     result_set())
+        self.assertEqual([context for context, _ in self.results], [0, 1, 2])
+        self.assertEqual(self.results[0][1], None)
+        self.assertEqual((self.results[1][1].code,
+                          self.results[1][1].message),
+                         (1146, "Table 't' doesn't exist"))
+        self.assertEqual(self.results[2][1], None)
+        self.assertEqual(self.conn.in_flight, 0)
+
+    def test_multiple_results(self):
+        self.conn.query("SELECT 1; SELECT 2", self.done, 0)
+        self.receive(result_set(nbmysql.SERVER_MORE_RESULTS_EXISTS))
+        self.assertEqual(self.results, [])
+        self.receive(ok(nbmysql.SERVER_MORE_RESULTS_EXISTS))
+        self.assertEqual(self.results, [])
+        self.receive(result_set())
+        self.assertEqual(self.results, [(0, None)])
+
+    def test_packets_split_across_reads(self):
+        self.conn.query("SELECT 1", self.done, 0)
+        self.conn.query("SELECT 2", self.done, 1)
+        data = result_set() + ok()
+        self.receive(*data)
+        self.assertEqual(self.results, [(0, None), (1, None)])
+
+    def test_schema_switch(self):
+        conn = self.conn
+        conn.query("SELECT 1", self.done, 0, schema="a")
+        # First USE may yet fail, so it is sent again
+        conn.query("SELECT 2", self.done, 1, schema="a")
+        self.receive(ok(nbmysql.SERVER_MORE_RESULTS_EXISTS) + ok() +
+                     ok(nbmysql.SERVER_MORE_RESULTS_EXISTS) + ok())
+        conn.query("SELECT 3", self.done, 2, schema="a")
+        self.assertEqual(sent_queries(conn.outbuf),
+                         ["USE `a`; SELECT 1", "USE `a`; SELECT 2",
+                          "SELECT 3"])
+        self.receive(error(1146, "Table 't' doesn't exist"))
+        self.assertEqual(conn.schema, None)
+
+    def test_failed_prepared_statement_prepared_again(self):
+        statement = Prepared("SELECT 1 FROM t WHERE id IN (?)", ("1", ))
+        self.conn.execute(statement, self.done, 0)
+        self.receive(error(1146, "Table 't' doesn't exist"))
+        self.conn.execute(statement, self.done, 1)
+        first, second = sent_queries(self.conn.outbuf)
+        self.assertTrue(first.startswith("PREPARE "))
+        self.assertTrue(second.startswith("PREPARE "))
+
+    def test_close_fails_commands_in_flight(self):
+        self.conn.query("SELECT 1", self.done, 0)
+        self.receive("")
+        self.assertEqual(self.conn.state, nbmysql.CLOSED)
+        self.assertEqual(self.results[0][1].code, 2013)
+
+    def test_long_packet_split(self):
+        self.conn.write_packet("x" * (nbmysql.MAX_PACKET + 1), 0)
+        outbuf = self.conn.outbuf
+        self.assertEqual(outbuf[:4], "\xff\xff\xff\x00")
+        tail = outbuf[4 + nbmysql.MAX_PACKET:]
+        self.assertEqual(tail, "\x01\x00\x00\x01x")
+
+
+if __name__ == "__main__":
+    unittest.main()
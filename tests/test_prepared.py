@@ -0,0 +1,112 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Statements prepared on a connection, reused by shape.
+"""
+
+import unittest
+
+from myprefetch import mysql
+from myprefetch.prepared import StatementCache
+from myprefetch.rewriters import Prepared, lookup_query
+
+SHAPE = "SELECT 1 FROM t WHERE id IN (?)"
+
+
+class StatementCacheTest(unittest.TestCase):
+    def test_prepared_on_first_use(self):
+        cache = StatementCache(2)
+        self.assertEqual(cache.sql(Prepared(SHAPE, ("1", ))),
+                         "PREPARE prefetch_0 FROM "
+                         "'SELECT 1 FROM t WHERE id IN (?)'; "
+                         "SET @p0=1; EXECUTE prefetch_0 USING @p0")
+        self.assertEqual(cache.sql(Prepared(SHAPE, ("'a'", ))),
+                         "SET @p0='a'; EXECUTE prefetch_0 USING @p0")
+
+    def test_without_params(self):
+        cache = StatementCache(2)
+        cache.sql(Prepared("SELECT 1", ()))
+        self.assertEqual(cache.sql(Prepared("SELECT 1", ())),
+                         "EXECUTE prefetch_0")
+
+    def test_least_recently_used_name_reused(self):
+        cache = StatementCache(2)
+        cache.sql(Prepared("SELECT 1", ()))
+        cache.sql(Prepared("SELECT 2", ()))
+        cache.sql(Prepared("SELECT 1", ()))
+        self.assertEqual(cache.sql(Prepared("SELECT 3", ())),
+                         "PREPARE prefetch_1 FROM 'SELECT 3'; "
+                         "EXECUTE prefetch_1")
+        self.assertEqual(sorted(cache.names.values()),
+                         ["prefetch_0", "prefetch_1"])
+
+    def test_forget(self):
+        cache = StatementCache(2)
+        cache.sql(Prepared("SELECT 1", ()))
+        cache.forget("SELECT 1")
+        # Failed name goes to next new shape, not a third one
+        self.assertEqual(cache.sql(Prepared("SELECT 2", ())),
+                         "PREPARE prefetch_0 FROM 'SELECT 2'; "
+                         "EXECUTE prefetch_0")
+
+    def test_clear(self):
+        cache = StatementCache(2)
+        cache.sql(Prepared("SELECT 1", ()))
+        cache.clear()
+        self.assertTrue(cache.sql(Prepared("SELECT 1", ())).startswith(
+            "PREPARE "))
+
+    def test_disabled(self):
+        cache = StatementCache(0)
+        self.assertEqual(cache.sql(Prepared(SHAPE, ("5", ))),
+                         "SELECT 1 FROM t WHERE id IN (5)")
+        self.assertEqual(cache.names, {})
+
+    def test_lookup_shape(self):
+        prepared = lookup_query("db", "t", ("a", "b"),
+                                (("1", "'x'"), ("2", "'?'")), prepared=True)
+        self.assertEqual(StatementCache(0).sql(prepared),
+                         lookup_query("db", "t", ("a", "b"),
+                                      (("1", "'x'"), ("2", "'?'"))))
+
+
+class FailingConnection(object):
+    """_mysql connection lookalike failing every query"""
+    def __init__(self):
+        self.queries = []
+
+    def query(self, query):
+        self.queries.append(query)
+        raise mysql.Error(1146, "Table 't' doesn't exist")
+
+
+class ExecuteTest(unittest.TestCase):
+    def test_failed_statement_prepared_again(self):
+        connection = mysql.MySQL(mysql.Config("localhost", 3306, "user",
+                                              "pw"), prepared_size=2)
+        connection._conn = FailingConnection()
+        for _ in range(2):
+            self.assertRaises(mysql.Error, connection.execute,
+                              Prepared(SHAPE, ("1", )), "/* c */")
+        queries = connection._conn.queries
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(all(query.startswith("/* c */ PREPARE prefetch_0 ")
+                            for query in queries))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Shared memory ring passing events to worker processes.
+"""
+
+import multiprocessing
+import Queue
+import unittest
+
+from myprefetch.binlog import Event
+from myprefetch.ring import Ring
+
+
+def event(pos, length=40, type_='query'):
+    query = "UPDATE t SET a = 1 WHERE id = %d " % pos
+    query += "x" * max(length - len(query), 0)
+    return Event(pos, type_, 'db', query, 1000 + pos, 0, pos, None)
+
+
+def fields(item):
+    return (item.pos, item.type, item.db, item.query, item.timestamp,
+            item.insert_id)
+
+
+def consume(events, results, count):
+    for _ in range(count):
+        results.put(fields(events.get(timeout=5)))
+
+
+class RingTest(unittest.TestCase):
+    def test_round_trip(self):
+        events = Ring(4096)
+        query = event(100)
+        xid = event(200, type_='xid')
+        events.put(query)
+        events.put(xid)
+        self.assertEqual(events.qsize(), 2)
+        self.assertEqual(fields(events.get_nowait()), fields(query))
+        self.assertEqual(fields(events.get_nowait()), fields(xid))
+        self.assertRaises(Queue.Empty, events.get_nowait)
+
+    def test_wrap_around(self):
+        # Records of varying sizes, so that both wrap marker and tails
+        # too short for a header come up
+        events = Ring(2048)
+        pos = 0
+        expected = []
+        for round_ in range(200):
+            for _ in range(round_ % 3 + 1):
+                item = event(pos, 20 + pos * 7 % 90)
+                events.put_nowait(item)
+                expected.append(fields(item))
+                pos += 1
+            while len(expected) > 1:
+                self.assertEqual(fields(events.get_nowait()),
+                                 expected.pop(0))
+        self.assertEqual(fields(events.get_nowait()), expected.pop(0))
+        self.assertEqual(events.qsize(), 0)
+
+    def test_full(self):
+        events = Ring(512)
+        self.assertRaises(Queue.Full, self.fill, events)
+        events.get_nowait()
+        events.put_nowait(event(1000))
+        limited = Ring(4096, maxsize=2)
+        limited.put(event(1))
+        limited.put(event(2))
+        self.assertTrue(limited.full())
+        self.assertRaises(Queue.Full, limited.put, event(3), True, 0.01)
+
+    def fill(self, events):
+        for pos in range(100):
+            events.put_nowait(event(pos))
+
+    def test_stale_dropped(self):
+        dropped = []
+        events = Ring(4096, on_drop=dropped.append)
+        for pos in (100, 200, 300):
+            events.put(event(pos), position=(1, pos))
+        events.advance((1, 200))
+        self.assertEqual(events.get_nowait().pos, 300)
+        self.assertEqual([item.pos for item in dropped], [100, 200])
+        self.assertEqual((events.dropped, events.rejected), (2, 0))
+
+    def test_stale_dropped_while_empty(self):
+        dropped = []
+        events = Ring(4096, on_drop=dropped.append)
+        events.put(event(100))
+        events.advance((0, 100))
+        self.assertRaises(Queue.Empty, events.get_nowait)
+        self.assertEqual([item.pos for item in dropped], [100])
+
+    def test_oversize_rejected(self):
+        dropped = []
+        events = Ring(512, on_drop=dropped.append)
+        events.put(event(100, 200))
+        self.assertEqual(events.qsize(), 0)
+        self.assertEqual([item.pos for item in dropped], [100])
+        self.assertEqual((events.dropped, events.rejected), (0, 1))
+
+    def test_across_processes(self):
+        events = Ring(1024)
+        results = multiprocessing.Queue()
+        count = 100
+        worker = multiprocessing.Process(target=consume,
+                                         args=(events, results, count))
+        worker.start()
+        sent = []
+        for pos in range(count):
+            item = event(pos, 50 + pos % 30)
+            events.put(item, timeout=5)
+            sent.append(fields(item))
+        received = [results.get(timeout=5) for _ in range(count)]
+        worker.join(5)
+        self.assertEqual(received, sent)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Routing of events to runner queues, and connection schema tracking that
+makes routing worth it.
+"""
+
+import unittest
+
+from myprefetch.binlog import Event
+from myprefetch import mysql
+from myprefetch.routing import HashRing, Router, KEYS, table_key
+from myprefetch.scheduler import Scheduler
+
+
+def event(db, query, pos=100):
+    return Event(pos, 'query', db, query, 0, 0, None, None)
+
+
+class FakeConnection(object):
+    """_mysql connection lookalike recording queries, without results"""
+    def __init__(self):
+        self.queries = []
+
+    def query(self, query):
+        self.queries.append(query)
+
+    def use_result(self):
+        return None
+
+    def store_result(self):
+        return None
+
+    def next_result(self):
+        return -1
+
+
+class HashRingTest(unittest.TestCase):
+    def test_only_removed_node_keys_move(self):
+        keys = ["db%d" % i for i in range(500)]
+        large, small = HashRing(4), HashRing(3)
+        moved = [key for key in keys if large.node(key) != small.node(key)]
+        self.assertTrue(moved)
+        self.assertTrue(all(large.node(key) == 3 for key in moved))
+        self.assertEqual(set(large.node(key) for key in keys),
+                         set(range(4)))
+
+
+class RouterTest(unittest.TestCase):
+    def test_table_key(self):
+        self.assertEqual(table_key(event("a", "UPDATE b.t SET x = 1 "
+                                                 "WHERE id = 1")), ("b", "t"))
+        self.assertEqual(table_key(event("a", "DELETE FROM t WHERE id = 1")),
+                         ("a", "t"))
+        self.assertEqual(table_key(event("a", "COMMIT")), ("a", None))
+
+    def test_same_key_same_queue(self):
+        router = Router([Scheduler() for _ in range(4)], KEYS["db"])
+        for pos in range(100):
+            router.put(event("db%d" % (pos % 10), "COMMIT", pos))
+        self.assertEqual(router.qsize(), 100)
+        for queue in router.queues:
+            dbs = set()
+            while queue.qsize():
+                dbs.add(queue.get_nowait().db)
+            for db in dbs:
+                self.assertEqual(router.route(event(db, "COMMIT")),
+                                 router.queues.index(queue))
+
+    def test_only_active_queues(self):
+        active = [2]
+        router = Router([Scheduler() for _ in range(4)], KEYS["db"],
+                        lambda: active[0])
+        routes = [router.route(event("db%d" % i, "COMMIT"))
+                  for i in range(50)]
+        self.assertEqual(set(routes), set([0, 1]))
+        active[0] = 0
+        self.assertEqual(router.route(event("db1", "COMMIT")), 0)
+
+    def test_advance_and_dropped(self):
+        router = Router([Scheduler() for _ in range(2)], KEYS["db"])
+        for pos in range(10):
+            router.put(event("db%d" % pos, "COMMIT", pos))
+        router.advance((0, 5))
+        self.assertEqual(router.dropped, 6)
+        self.assertEqual(router.qsize(), 4)
+
+
+class SchemaTrackingTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = mysql.MySQL(mysql.Config("localhost", 3306,
+                                                   "user", "pw"))
+        self.connection._conn = FakeConnection()
+
+    def test_use_sent_on_switch_only(self):
+        self.connection.q("SELECT 1", discard=True, schema="a")
+        self.connection.q("SELECT 2", discard=True, schema="a")
+        self.connection.q("SELECT 3", schema="b")
+        self.assertEqual(self.connection._conn.queries,
+                         ["USE `a`; SELECT 1", "SELECT 2",
+                          "USE `b`; SELECT 3"])
+        self.assertEqual(self.connection.schema, "b")
+
+    def test_failed_switch_forgets_schema(self):
+        def fail(query):
+            raise mysql.Error(1146, "Table 't' doesn't exist")
+        self.connection.q("SELECT 1", discard=True, schema="a")
+        self.connection._conn.query = fail
+        self.assertRaises(mysql.Error, self.connection.q, "SELECT 2",
+                          discard=True, schema="b")
+        self.assertEqual(self.connection.schema, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Row image decoders, table map metadata and primary key lookups made from
+row events.
+"""
+
+from decimal import Decimal
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from myprefetch import binlog, rows
+from myprefetch.rewriters import Lookup, PrimaryKeyLookup
+from myprefetch.synthetic import RelayLogWriter
+
+
+def decode(column_type, data, meta=None):
+    return rows.DECODERS[column_type](data, 0, meta)
+
+
+def table_map_body(db, table, column_types, optional=""):
+    """TABLE_MAP_EVENT body past the post-header, columns without
+       metadata of their own"""
+    return (chr(len(db)) + db + "\0" + chr(len(table)) + table + "\0" +
+            chr(len(column_types)) + "".join(map(chr, column_types)) +
+            "\0" + "\0" * ((len(column_types) + 7) // 8) + optional)
+
+
+def metadata_field(field_type, payload):
+    return chr(field_type) + chr(len(payload)) + payload
+
+
+class RowsEventStub(object):
+    def __init__(self, table_map, action, images):
+        self.db = table_map.schema
+        self.table = table_map.table
+        self.table_map = table_map
+        self.action = action
+        self.rows = images
+
+
+class DecoderTest(unittest.TestCase):
+    def test_integers(self):
+        self.assertEqual(decode(rows.MYSQL_TYPE_TINY, "\xff"), (-1, 1))
+        self.assertEqual(decode(rows.MYSQL_TYPE_INT24, "\xfe\xff\xff"),
+                         (-2, 3))
+        self.assertEqual(decode(rows.MYSQL_TYPE_INT24, "\x01\x02\x03"),
+                         (0x030201, 3))
+        self.assertEqual(decode(rows.MYSQL_TYPE_LONGLONG,
+                                struct.pack("<q", -5)), (-5, 8))
+
+    def test_unsigned(self):
+        self.assertEqual(rows.unsigned(-1, rows.MYSQL_TYPE_LONG), 0xffffffff)
+        self.assertEqual(rows.unsigned(-1, rows.MYSQL_TYPE_TINY), 0xff)
+        self.assertEqual(rows.unsigned(5, rows.MYSQL_TYPE_LONG), 5)
+
+    def test_packed_int(self):
+        self.assertEqual(rows.packed_int("\xfa", 0), (250, 1))
+        self.assertEqual(rows.packed_int("\xfc\x01\x02", 0), (0x0201, 3))
+        self.assertEqual(rows.packed_int("\xfd\x01\x02\x03", 0),
+                         (0x030201, 4))
+        self.assertEqual(rows.packed_int("\xfe" + struct.pack("<Q", 1 << 40),
+                                         0), (1 << 40, 9))
+
+    def test_varchar(self):
+        self.assertEqual(decode(rows.MYSQL_TYPE_VARCHAR, "\x03abcd", 255),
+                         ("abc", 4))
+        self.assertEqual(decode(rows.MYSQL_TYPE_VARCHAR, "\x03\x00abc", 300),
+                         ("abc", 5))
+
+    def test_newdecimal(self):
+        # DECIMAL(10,2): four bytes for 8 integral digits, one for 2
+        # fractional ones, sign bit flipped
+        self.assertEqual(decode(rows.MYSQL_TYPE_NEWDECIMAL,
+                                "\x80\x00\x04\xd2\x38", (10, 2)),
+                         (Decimal("1234.56"), 5))
+        # Negative values have all bits inverted
+        self.assertEqual(decode(rows.MYSQL_TYPE_NEWDECIMAL,
+                                "\x7f\xff\xfb\x2d\xc7", (10, 2)),
+                         (Decimal("-1234.56"), 5))
+
+    def test_datetime2(self):
+        ymd = (2020 * 13 + 1) << 5 | 2
+        hms = 3 << 12 | 4 << 6 | 5
+        packed = struct.pack(">Q", (ymd << 17 | hms) + 0x8000000000)[3:]
+        self.assertEqual(decode(rows.MYSQL_TYPE_DATETIME2, packed, 0),
+                         ("2020-01-02 03:04:05", 5))
+        self.assertEqual(decode(rows.MYSQL_TYPE_DATETIME2, packed + "\x0c",
+                                2),
+                         ("2020-01-02 03:04:05.120000", 6))
+
+    def test_time2(self):
+        hms = 1 << 12 | 2 << 6 | 3
+        packed = struct.pack(">I", hms + 0x800000)[1:]
+        self.assertEqual(decode(rows.MYSQL_TYPE_TIME2, packed, 0),
+                         ("01:02:03", 3))
+
+    def test_year(self):
+        self.assertEqual(decode(rows.MYSQL_TYPE_YEAR, "\x78"), (2020, 1))
+        self.assertEqual(decode(rows.MYSQL_TYPE_YEAR, "\x00"), (0, 1))
+
+
+class TableMapTest(unittest.TestCase):
+    def test_signedness_skips_year(self):
+        # YEAR has no signedness flag, first flag is for id
+        column_types = (rows.MYSQL_TYPE_YEAR, rows.MYSQL_TYPE_LONG,
+                        rows.MYSQL_TYPE_LONG)
+        names = "".join(chr(len(name)) + name
+                        for name in ("born", "id", "delta"))
+        body = table_map_body(
+            "db", "people", column_types,
+            metadata_field(rows.SIGNEDNESS, "\x80") +
+            metadata_field(rows.COLUMN_NAME, names) +
+            metadata_field(rows.SIMPLE_PRIMARY_KEY, "\x01"))
+        table_map = rows.parse_table_map(7, body, 0, len(body))
+        self.assertEqual(table_map.unsigned, frozenset([1]))
+        self.assertEqual(table_map.column_names, ["born", "id", "delta"])
+        self.assertEqual(table_map.primary_key, [1])
+
+        event = RowsEventStub(table_map, "delete", [(1990, -1, -1)])
+        self.assertEqual(PrimaryKeyLookup()(event),
+                         Lookup("db", "people", ("id", ),
+                                (("4294967295", ), ), None))
+
+    def test_no_optional_metadata(self):
+        body = table_map_body("db", "t", (rows.MYSQL_TYPE_LONG, ))
+        table_map = rows.parse_table_map(1, body, 0, len(body))
+        self.assertEqual((table_map.schema, table_map.table), ("db", "t"))
+        self.assertEqual(table_map.primary_key, None)
+        self.assertEqual(PrimaryKeyLookup()(RowsEventStub(
+            table_map, "insert", [(1, )])), None)
+
+
+class RowsEventTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "relay-bin.000001")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        log = binlog.Binlog(self.path)
+        try:
+            return [event for event in log if event.type == 'rows']
+        finally:
+            log.close()
+
+    def test_row_images(self):
+        writer = RelayLogWriter(self.path)
+        writer.table_map(1, 5, "db", "t")
+        writer.rows(1, 5, "insert", [(1, "a"), (2, "bc")])
+        writer.table_map(1, 5, "db", "t")
+        writer.rows(1, 5, "update", [(1, "a"), (1, "b")])
+        writer.table_map(1, 5, "db", "t")
+        writer.rows(1, 5, "delete", [(-3, "")])
+        writer.close()
+
+        insert, update, delete = self.read()
+        self.assertEqual((insert.db, insert.table, insert.action),
+                         ("db", "t", "insert"))
+        self.assertEqual(insert.rows, [(1, "a"), (2, "bc")])
+        self.assertEqual(update.action, "update")
+        self.assertEqual(update.rows, [(1, "a"), (1, "b")])
+        self.assertEqual(delete.rows, [(-3, "")])
+
+    def test_rows_without_table_map_are_skipped(self):
+        writer = RelayLogWriter(self.path)
+        writer.rows(1, 5, "insert", [(1, "a")])
+        writer.close()
+        self.assertEqual(self.read(), [])
+
+
+class PrimaryKeyLookupTest(unittest.TestCase):
+    def setUp(self):
+        body = table_map_body(
+            "db", "t", (rows.MYSQL_TYPE_LONG, rows.MYSQL_TYPE_LONG),
+            metadata_field(rows.COLUMN_NAME, "\x02id\x01v") +
+            metadata_field(rows.SIMPLE_PRIMARY_KEY, "\x00"))
+        self.table_map = rows.parse_table_map(1, body, 0, len(body))
+
+    def lookup(self, action, images):
+        return PrimaryKeyLookup()(RowsEventStub(self.table_map, action,
+                                                images))
+
+    def test_keys_deduplicated(self):
+        self.assertEqual(self.lookup("insert", [(1, 0), (2, 0), (1, 5)]),
+                         Lookup("db", "t", ("id", ), (("1", ), ("2", )),
+                                None))
+
+    def test_update_adds_changed_keys(self):
+        # Before images, then after images whose key changed
+        self.assertEqual(self.lookup("update", [(1, 0), (1, 5), (2, 0),
+                                                (3, 0)]).values,
+                         (("1", ), ("2", ), ("3", )))
+
+    def test_missing_keys(self):
+        self.assertEqual(self.lookup("delete", [(None, 1)]), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
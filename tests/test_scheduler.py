@@ -0,0 +1,93 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Runner queue ordered by distance from the SQL thread.
+"""
+
+import Queue
+import unittest
+
+from myprefetch.binlog import Event
+from myprefetch.scheduler import Scheduler
+
+
+def event(pos):
+    return Event(pos, 'query', 'db', 'UPDATE t SET a = 1 WHERE id = %d' % pos,
+                 0, 0, None, None)
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_closest_first(self):
+        queue = Scheduler()
+        for pos in (300, 100, 200):
+            queue.put(event(pos))
+        self.assertEqual([queue.get_nowait().pos for _ in range(3)],
+                         [100, 200, 300])
+
+    def test_relay_log_sequence_orders_first(self):
+        queue = Scheduler()
+        queue.put(event(100), position=(2, 100))
+        queue.put(event(900), position=(1, 900))
+        self.assertEqual(queue.get_nowait().pos, 900)
+
+    def test_same_position_keeps_order(self):
+        queue = Scheduler()
+        first, second = event(100), event(100)
+        queue.put(first)
+        queue.put(second)
+        self.assertTrue(queue.get_nowait() is first)
+        self.assertTrue(queue.get_nowait() is second)
+
+    def test_advance_drops_stale(self):
+        dropped = []
+        queue = Scheduler(on_drop=dropped.append)
+        for pos in (100, 200, 300):
+            queue.put(event(pos))
+        queue.advance((0, 200))
+        self.assertEqual([item.pos for item in dropped], [100, 200])
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait().pos, 300)
+
+    def test_get_drops_stale(self):
+        dropped = []
+        queue = Scheduler(on_drop=dropped.append)
+        queue.advance((0, 150))
+        queue.put(event(100))
+        queue.put(event(200))
+        self.assertEqual(queue.get_nowait().pos, 200)
+        self.assertEqual([item.pos for item in dropped], [100])
+
+    def test_full(self):
+        queue = Scheduler(maxsize=2)
+        queue.put(event(100))
+        queue.put(event(200))
+        self.assertTrue(queue.full())
+        self.assertRaises(Queue.Full, queue.put_nowait, event(300))
+        self.assertRaises(Queue.Full, queue.put, event(300), True, 0.01)
+
+    def test_empty(self):
+        queue = Scheduler()
+        self.assertRaises(Queue.Empty, queue.get_nowait)
+        self.assertRaises(Queue.Empty, queue.get, True, 0.01)
+        queue.put(event(100))
+        queue.advance((0, 100))
+        self.assertRaises(Queue.Empty, queue.get_nowait)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+#
+#   Copyright 2026 mysql-prefetcher contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Write statement parsing, and index lookups IndexLookup makes of it.
+"""
+
+import collections
+import unittest
+
+from myprefetch import statements
+from myprefetch.binlog import Event
+from myprefetch.rewriters import IndexLookup, Lookup
+from myprefetch.schema import Table
+
+
+class ParseTest(unittest.TestCase):
+    def test_update(self):
+        statement = statements.parse(
+            "/* app */ UPDATE LOW_PRIORITY `db`.`t` SET a = 'x, y', "
+            "`B` = b + 1 WHERE id IN (1, 2) AND k = 'z' ORDER BY id LIMIT 2")
+        self.assertEqual(statement.kind, "update")
+        self.assertEqual((statement.db, statement.table), ("db", "t"))
+        self.assertEqual(statement.assignments, {"a": "'x, y'", "b": "b + 1"})
+        self.assertEqual(statement.where,
+                         "id IN (1, 2) AND k = 'z' ORDER BY id LIMIT 2")
+        self.assertEqual(statement.equalities,
+                         {"id": ("1", "2"), "k": ("'z'", )})
+
+    def test_update_needs_where(self):
+        self.assertEqual(statements.parse("UPDATE t SET a = 1"), None)
+
+    def test_delete(self):
+        statement = statements.parse("DELETE FROM t WHERE (id = 5) AND "
+                                     "a > 3")
+        self.assertEqual(statement.kind, "delete")
+        self.assertEqual((statement.db, statement.table), (None, "t"))
+        self.assertEqual(statement.equalities, {"id": ("5", )})
+
+    def test_or_spoils_equalities(self):
+        statement = statements.parse("DELETE FROM t WHERE id = 5 OR id = 6")
+        self.assertEqual(statement.equalities, {})
+        # Unless it is nested or inside a string
+        statement = statements.parse("DELETE FROM t WHERE id = 5 AND "
+                                     "(a = 1 OR b = 2) AND c = 'x OR y'")
+        self.assertEqual(statement.equalities,
+                         {"id": ("5", ), "c": ("'x OR y'", )})
+
+    def test_non_literals_ignored(self):
+        statement = statements.parse("DELETE FROM t WHERE id = NOW() AND "
+                                     "k IN (1, a)")
+        self.assertEqual(statement.equalities, {})
+
+    def test_insert(self):
+        statement = statements.parse(
+            "INSERT IGNORE INTO t (id, `Name`) VALUES (1, 'a,b'), (2, 'c') "
+            "ON DUPLICATE KEY UPDATE name = VALUES(name)")
+        self.assertEqual(statement.kind, "insert")
+        self.assertEqual(statement.columns, ["id", "name"])
+        self.assertEqual(statement.rows, [["1", "'a,b'"], ["2", "'c'"]])
+        self.assertEqual(statement.assignments, {"name": "VALUES(name)"})
+
+    def test_insert_without_columns(self):
+        statement = statements.parse("REPLACE t VALUES (1, 2)")
+        self.assertEqual(statement.columns, None)
+        self.assertEqual(statement.rows, [["1", "2"]])
+
+    def test_unsupported(self):
+        for query in ("INSERT INTO t SELECT * FROM u",
+                      "INSERT INTO t (a) VALUES (1, 2)",
+                      "UPDATE t SET a = (SELECT 1) WHERE id = 1",
+                      "UPDATE t, u SET t.a = 1 WHERE t.id = u.id",
+                      "SELECT 1"):
+            self.assertEqual(statements.parse(query), None, query)
+
+    def test_target(self):
+        self.assertEqual(statements.target("INSERT INTO db.t VALUES (1)"),
+                         ("db", "t"))
+        self.assertEqual(statements.target(
+            "/* c */ SELECT a FROM `t` WHERE 1"), (None, "t"))
+        self.assertEqual(statements.target("BEGIN"), None)
+
+
+class Schema(object):
+    def __init__(self, table):
+        self.definition = table
+
+    def table(self, db, table):
+        return self.definition
+
+
+class IndexLookupTest(unittest.TestCase):
+    def setUp(self):
+        indexes = collections.OrderedDict([
+            ("PRIMARY", ["id"]),
+            ("user_created", ["user_id", "created"]),
+            ("email", ["email"]),
+        ])
+        self.rewriter = IndexLookup(Schema(Table(
+            ["id", "user_id", "created", "email", "note"], set(), indexes,
+            set(["PRIMARY", "email"]))))
+
+    def rewrite(self, query):
+        return self.rewriter(Event(100, 'query', 'db', query, 0, 0, None,
+                                   None))
+
+    def test_insert_full_indexes_only(self):
+        self.assertEqual(self.rewrite(
+            "INSERT INTO t (id, user_id, email) VALUES (1, 5, 'a')"),
+            [Lookup("db", "t", ("id", ), (("1", ), ), None),
+             Lookup("db", "t", ("email", ), (("'a'", ), ), "email")])
+        # Leading column alone would be a range scan
+        self.assertEqual(self.rewrite(
+            "INSERT INTO t (user_id, note) VALUES (5, 'x')"), None)
+
+    def test_insert_auto_increment_skipped(self):
+        self.assertEqual(self.rewrite(
+            "INSERT INTO t (id, email) VALUES (NULL, 'a'), (NULL, 'b')"),
+            [Lookup("db", "t", ("email", ), (("'a'", ), ("'b'", )),
+                    "email")])
+
+    def test_update_old_and_new_entries(self):
+        self.assertEqual(self.rewrite(
+            "UPDATE t SET email = 'b' WHERE id = 1"),
+            [Lookup("db", "t", ("id", ), (("1", ), ), None),
+             "SELECT 1 FROM (SELECT `email` FROM `db`.`t` WHERE id = 1) "
+             "AS old JOIN `db`.`t` AS cur FORCE INDEX (`email`) "
+             "ON old.`email` <=> cur.`email`",
+             Lookup("db", "t", ("email", ), (("'b'", ), ), "email")])
+
+    def test_partial_index_falls_back_to_where(self):
+        lookups = self.rewrite("DELETE FROM t WHERE user_id = 5")
+        self.assertEqual(lookups[0], "SELECT 1 FROM `db`.`t` WHERE "
+                                     "user_id = 5")
+        self.assertEqual(lookups[1],
+                         "SELECT 1 FROM (SELECT `user_id`, `created` FROM "
+                         "`db`.`t` WHERE user_id = 5) AS old JOIN `db`.`t` "
+                         "AS cur FORCE INDEX (`user_created`) ON "
+                         "old.`user_id` <=> cur.`user_id` AND "
+                         "old.`created` <=> cur.`created`")
+
+    def test_full_index_lookup(self):
+        lookups = self.rewrite("DELETE FROM t WHERE user_id IN (5, 6) AND "
+                               "created = 7")
+        self.assertEqual(lookups[1],
+                         Lookup("db", "t", ("user_id", "created"),
+                                (("5", "7"), ("6", "7")), "user_created"))
+
+    def test_too_many_keys(self):
+        self.rewriter.max_keys = 1
+        lookups = self.rewrite("DELETE FROM t WHERE id IN (1, 2)")
+        self.assertEqual(lookups[0], "SELECT 1 FROM `db`.`t` WHERE "
+                                     "id IN (1, 2)")
+
+    def test_unknown_table(self):
+        self.rewriter.schema.definition = None
+        self.assertEqual(self.rewrite("DELETE FROM t WHERE id = 1"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()